@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Banca, Conteudo, Questao
+from .models import Banca, Conteudo, ExportacaoProva, Questao, QuestaoImagem
 
 
 @admin.register(Banca)
@@ -16,4 +16,17 @@ class ConteudoAdmin(admin.ModelAdmin):
 @admin.register(Questao)
 class QuestaoAdmin(admin.ModelAdmin):
     list_display = ('area', 'unidade', 'topico', 'subtopico', 'categoria', 'ano', 'banca', 'tipo_questao', 'dificuldade', 'enunciado')
-    search_fields = ('area', 'unidade', 'topico', 'subtopico', 'categoria', 'enunciado')
\ No newline at end of file
+    search_fields = ('area', 'unidade', 'topico', 'subtopico', 'categoria', 'enunciado')
+
+@admin.register(QuestaoImagem)
+class QuestaoImagemAdmin(admin.ModelAdmin):
+    list_display = ('caminho', 'questao', 'campo', 'largura', 'altura', 'local')
+    list_filter = ('campo', 'local')
+    search_fields = ('caminho',)
+
+
+@admin.register(ExportacaoProva)
+class ExportacaoProvaAdmin(admin.ModelAdmin):
+    list_display = ('nome_arquivo', 'usuario', 'status', 'progresso', 'tentativas', 'criado_em', 'concluido_em')
+    list_filter = ('status',)
+    readonly_fields = ('id', 'parametros', 'arquivo', 'worker', 'iniciado_em', 'concluido_em')
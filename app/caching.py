@@ -0,0 +1,61 @@
+"""
+Cache da aplicação sobre o cache do Django, com invalidação direcionada: nenhuma
+escrita limpa o cache inteiro.
+
+Domínios e como cada um é invalidado:
+- taxonomia: geração 'taxonomia' (Geracao), incrementada por Conteudo.save()/delete();
+- ids por filtro (app.filters) e facetas (app.facets): geração 'questoes' no prefixo da
+  chave, incrementada por Questao.save()/delete();
+- questão por id (detalhe da API): versão da própria linha (Questao.atualizado_em) e do
+  snapshot da árvore (app.taxonomy) na chave: uma escrita só invalida o detalhe da questão
+  alterada;
+- fórmulas renderizadas: a chave é o hash do conteúdo (app.utils.math_cache_key),
+  então nunca ficam obsoletas e não precisam de invalidação.
+
+As gerações vivem no banco: uma escrita feita por um worker invalida as entradas de
+todos os outros, mesmo com o cache local (LocMem) de cada processo.
+
+`get_or_compute()` evita a debandada (stampede) quando uma chave quente expira ou muda
+de geração: só quem obtém a trava recalcula; os demais esperam o valor aparecer.
+"""
+import hashlib
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+_LOCK_PREFIX = 'lock:'
+
+
+def hashed(text: str) -> str:
+    """Trecho de chave de tamanho fixo e sem espaços (chaves do Memcached têm até 250 caracteres)."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+
+
+def get_or_compute(key: str, compute, timeout: int):
+    """
+    Valor em cache para `key` ou `compute()`, guardado por `timeout` segundos (com um
+    pequeno jitter para as entradas não expirarem todas juntas).
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+    lock_key = f'{_LOCK_PREFIX}{key}'
+    lock_timeout = getattr(settings, 'CACHE_LOCK_TIMEOUT', 30)
+    if not cache.add(lock_key, 1, lock_timeout):
+        # Outro processo/thread já está recalculando: espera o resultado por um tempo limitado
+        deadline = time.monotonic() + getattr(settings, 'CACHE_LOCK_WAIT', 5.0)
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            value = cache.get(key)
+            if value is not None:
+                return value
+        # Quem tinha a trava demorou demais (ou morreu): calcula sem guardar para não competir
+        return compute()
+    try:
+        value = compute()
+        cache.set(key, value, int(timeout * random.uniform(1.0, 1.1)))
+        return value
+    finally:
+        cache.delete(lock_key)
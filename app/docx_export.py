@@ -0,0 +1,368 @@
+"""
+Motor de exportação nativo: monta o DOCX da prova direto com python-docx, no próprio
+processo, sem HTML intermediário nem pandoc.
+
+Segue o mesmo roteiro da exportação via pandoc (`exam_outline`): títulos, bloco de
+cabeçalho (Professor/Turma/Data/Nota), linha do aluno, quebras de página e o HTML de
+cada campo. No HTML são suportados parágrafos, negrito/itálico/sublinhado, índices,
+listas, tabelas simples, imagens de MEDIA_ROOT (ou data URI) e fórmulas, convertidas de
+LaTeX para OMML (app.omml), que o Word edita como equação nativa.
+
+Qualquer coisa fora disso levanta `UnsupportedContent`; `app.exports` então gera o
+mesmo documento pelo pandoc.
+"""
+import base64
+import binascii
+import io
+import os
+import re
+from urllib.parse import unquote, urlparse
+
+from bs4 import BeautifulSoup, Comment, NavigableString
+from django.conf import settings
+from docx import Document
+from docx.enum.style import WD_STYLE_TYPE
+from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_BREAK
+from docx.image.exceptions import UnrecognizedImageError
+from docx.shared import Emu, Inches
+
+from app.exam import HEADER_FIELDS, STUDENT_FIELD, exam_outline
+from app.images import declared_size
+from app.math_rewriter import rewrite_math, strip_math_delimiters
+from app.omml import UnsupportedLatex, latex_to_omml
+
+
+class UnsupportedContent(ValueError):
+    pass
+
+
+# Largura útil da página do modelo padrão do python-docx (Carta, margens de 1,25")
+MAX_IMAGE_WIDTH = Inches(6)
+# Pixels CSS (96 por polegada) → EMU
+_EMU_PER_PX = 9525
+
+_SPACE_RE = re.compile(r'\s+')
+_EQUATION_TAG = 'eduqbank-eq'
+
+_BLOCK_TAGS = {'p', 'div', 'center', 'section', 'article', 'blockquote', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+_INLINE_FORMAT = {
+    'strong': 'bold', 'b': 'bold', 'em': 'italic', 'i': 'italic', 'u': 'underline', 'ins': 'underline',
+    's': 'strike', 'strike': 'strike', 'del': 'strike', 'sub': 'subscript', 'sup': 'superscript',
+}
+_INLINE_PLAIN = {'span', 'a', 'font', 'small', 'big', 'code', 'label', 'abbr', 'cite'}
+
+
+def _roman(number: int) -> str:
+    values = ((1000, 'm'), (900, 'cm'), (500, 'd'), (400, 'cd'), (100, 'c'), (90, 'xc'),
+              (50, 'l'), (40, 'xl'), (10, 'x'), (9, 'ix'), (5, 'v'), (4, 'iv'), (1, 'i'))
+    out = []
+    for value, letters in values:
+        while number >= value:
+            out.append(letters)
+            number -= value
+    return ''.join(out)
+
+
+def _list_marker(list_type: str, number: int) -> str:
+    if list_type in ('a', 'A') and number <= 26:
+        letter = chr(ord('a') + number - 1)
+        return f"{letter.upper() if list_type == 'A' else letter}. "
+    if list_type in ('i', 'I'):
+        return f"{_roman(number).upper() if list_type == 'I' else _roman(number)}. "
+    return f"{number}. "
+
+
+def _paragraph_style_ids(document) -> dict:
+    """Nome → id dos estilos de parágrafo, resolvidos uma vez por documento."""
+    return {style.name: style.style_id for style in document.styles if style.type == WD_STYLE_TYPE.PARAGRAPH}
+
+
+def _styled_paragraph(container, style_ids: dict, name: str, text: str = None):
+    # `add_paragraph(style=nome)` percorre todos os estilos do documento a cada parágrafo
+    paragraph = container.add_paragraph(text)
+    paragraph._p.style = style_ids[name]
+    return paragraph
+
+
+def _mark_equations(html: str, equations: list) -> str:
+    """Troca cada fórmula por <eduqbank-eq data-i="n"> e guarda (latex, bloco) em `equations`."""
+    def mark(fragment):
+        latex = strip_math_delimiters(fragment.latex).strip()
+        if fragment.kind == 'delimited' and not fragment.display and fragment.latex.startswith('$'):
+            # Mesmas regras do tex_math_dollars do pandoc: "R$ 10 e R$ 20" não é fórmula
+            inner = fragment.latex[1:-1]
+            if not inner or inner[0].isspace() or inner[-1].isspace():
+                return None
+        if not latex:
+            return None
+        display = fragment.sole_child if fragment.kind == 'span' else fragment.display
+        equations.append((latex, display))
+        return f'<{_EQUATION_TAG} data-i="{len(equations) - 1}"></{_EQUATION_TAG}>'
+
+    return rewrite_math(html, mark)
+
+
+def _image_stream(src: str):
+    """Arquivo (caminho ou BytesIO) de uma imagem local ou data URI."""
+    if src.startswith('data:'):
+        header, _, payload = src.partition(',')
+        if ';base64' not in header:
+            raise UnsupportedContent("imagem data: sem base64")
+        try:
+            return io.BytesIO(base64.b64decode(payload))
+        except (binascii.Error, ValueError):
+            raise UnsupportedContent("imagem data: inválida")
+    media_url = getattr(settings, 'MEDIA_URL', '/media/')
+    media_root = getattr(settings, 'MEDIA_ROOT', None)
+    parsed = urlparse(src)
+    if media_root and not parsed.scheme and not parsed.netloc and parsed.path.startswith(media_url):
+        path = os.path.join(media_root, unquote(parsed.path[len(media_url):]))
+        if os.path.isfile(path):
+            return path
+    # Imagens externas (ou ausentes): o pandoc lida com elas (ou as ignora) do jeito atual
+    raise UnsupportedContent(f"imagem fora de MEDIA_ROOT: {src[:100]}")
+
+
+class _HtmlRenderer:
+    """Acrescenta o HTML de um campo de questão a um documento (ou célula de tabela)."""
+
+    def __init__(self, container, style_ids: dict, equations: list, in_table: bool = False):
+        self.container = container
+        self.style_ids = style_ids
+        self.equations = equations
+        self.in_table = in_table
+        self.paragraph = None
+
+    @property
+    def paragraph(self):
+        return self._paragraph
+
+    @paragraph.setter
+    def paragraph(self, paragraph):
+        self._paragraph = paragraph
+        # Se o último conteúdo do parágrafo terminou em espaço (ou quebra): o próximo texto
+        # descarta o espaço inicial. Guardado à parte porque `paragraph.text` remonta o
+        # texto de todos os runs a cada chamada.
+        self.after_space = True
+
+    def _current(self):
+        if self.paragraph is None:
+            self.paragraph = self.container.add_paragraph()
+        return self.paragraph
+
+    def _close(self):
+        self.paragraph = None
+
+    # Blocos -------------------------------------------------------------------
+
+    def render(self, nodes):
+        for node in nodes:
+            if isinstance(node, Comment):
+                continue
+            if isinstance(node, NavigableString):
+                self._text(str(node), {})
+                continue
+            name = node.name.lower()
+            if name in _BLOCK_TAGS:
+                self._block(node, name)
+            elif name in ('ul', 'ol'):
+                self._close()
+                self._list(node, depth=1)
+                self._close()
+            elif name == 'table':
+                self._close()
+                self._table(node)
+                self._close()
+            elif name == 'hr':
+                self._close()
+            else:
+                self._inline(node, {})
+
+    def _block(self, node, name):
+        self._close()
+        if name.startswith('h') and name[1:].isdigit():
+            self.paragraph = _styled_paragraph(self.container, self.style_ids, f"Heading {name[1]}")
+        style = (node.get('style') or '').replace(' ', '').lower()
+        if 'text-align:center' in style or name == 'center':
+            self._current().alignment = WD_ALIGN_PARAGRAPH.CENTER
+        elif 'text-align:right' in style:
+            self._current().alignment = WD_ALIGN_PARAGRAPH.RIGHT
+        self.render(node.children)
+        self._close()
+
+    def _list(self, node, depth: int):
+        if depth > 3:
+            raise UnsupportedContent("lista aninhada com mais de 3 níveis")
+        if any(child.name and child.name.lower() != 'li' for child in node.children):
+            raise UnsupportedContent(f"conteúdo inesperado em <{node.name}>")
+        ordered = node.name.lower() == 'ol'
+        list_type = node.get('type', '1')
+        try:
+            number = int(node.get('start', 1))
+        except ValueError:
+            number = 1
+        for item in node.find_all('li', recursive=False):
+            # Numeração escrita no texto: "List Number" do Word continuaria a contagem da lista anterior
+            style = 'List Paragraph' if ordered else ('List Bullet' if depth == 1 else f'List Bullet {depth}')
+            self.paragraph = _styled_paragraph(self.container, self.style_ids, style)
+            if ordered:
+                self.paragraph.paragraph_format.left_indent = Inches(0.25 * depth)
+                self.paragraph.add_run(_list_marker(list_type, number))
+                number += 1
+            marker_runs = len(self.paragraph.runs)
+            for child in item.children:
+                if getattr(child, 'name', None) in ('ul', 'ol'):
+                    self._list(child, depth + 1)
+                    self.paragraph = None
+                elif getattr(child, 'name', None) in _BLOCK_TAGS:
+                    # <li><p>...</p></li>: continua no mesmo item, em nova linha se já houver texto
+                    if self.paragraph is not None and len(self.paragraph.runs) > marker_runs:
+                        self.paragraph.add_run().add_break()
+                        self.after_space = True
+                    self.render(child.children)
+                else:
+                    self.render([child])
+            self._close()
+
+    def _table(self, node):
+        if self.in_table:
+            raise UnsupportedContent("tabela dentro de tabela")
+        rows = [tr for tr in node.find_all('tr') if tr.find_parent('table') is node]
+        if not rows:
+            return
+        cells = [[cell for cell in tr.find_all(('td', 'th'), recursive=False)] for tr in rows]
+        for row in cells:
+            for cell in row:
+                if any((cell.get(attr) or '1').strip() != '1' for attr in ('colspan', 'rowspan')):
+                    raise UnsupportedContent("tabela com células mescladas")
+        columns = max(len(row) for row in cells)
+        if not columns:
+            return
+        table = self.container.add_table(rows=len(cells), cols=columns)
+        table.style = 'Table Grid'
+        for row_index, row in enumerate(cells):
+            for col_index, cell in enumerate(row):
+                target = table.cell(row_index, col_index)
+                renderer = _HtmlRenderer(target, self.style_ids, self.equations, in_table=True)
+                renderer.paragraph = target.paragraphs[0]
+                fmt = {'bold': True} if cell.name == 'th' else {}
+                for child in cell.children:
+                    if isinstance(child, NavigableString) and not isinstance(child, Comment):
+                        renderer._text(str(child), fmt)
+                    elif getattr(child, 'name', None) in _INLINE_FORMAT or getattr(child, 'name', None) in _INLINE_PLAIN:
+                        renderer._inline(child, fmt)
+                    else:
+                        renderer.render([child])
+                        # Próximo conteúdo da célula vai num parágrafo novo
+                        renderer.paragraph = None
+
+    # Conteúdo em linha ---------------------------------------------------------
+
+    def _text(self, text: str, fmt: dict):
+        text = _SPACE_RE.sub(' ', text)
+        if self.after_space:
+            text = text.lstrip()
+        if not text:
+            return
+        run = self._current().add_run(text)
+        self.after_space = text[-1] == ' '
+        for attribute, value in fmt.items():
+            if attribute in ('subscript', 'superscript', 'strike'):
+                setattr(run.font, attribute, value)
+            else:
+                setattr(run, attribute, value)
+
+    def _inline(self, node, fmt: dict):
+        name = node.name.lower()
+        if name == 'br':
+            self._current().add_run().add_break()
+            self.after_space = True
+        elif name == 'img':
+            self._image(node)
+        elif name == _EQUATION_TAG:
+            self._equation(int(node['data-i']))
+        elif name in _INLINE_FORMAT or name in _INLINE_PLAIN:
+            fmt = {**fmt, _INLINE_FORMAT[name]: True} if name in _INLINE_FORMAT else fmt
+            for child in node.children:
+                if isinstance(child, Comment):
+                    continue
+                if isinstance(child, NavigableString):
+                    self._text(str(child), fmt)
+                elif child.name.lower() in _BLOCK_TAGS or child.name.lower() in ('ul', 'ol', 'table'):
+                    raise UnsupportedContent(f"<{child.name}> dentro de <{name}>")
+                else:
+                    self._inline(child, fmt)
+        else:
+            raise UnsupportedContent(f"elemento não suportado: <{name}>")
+
+    def _image(self, node):
+        src = (node.get('src') or '').strip()
+        if not src:
+            return
+        stream = _image_stream(src)
+        width, height = declared_size({key: str(value) for key, value in node.attrs.items() if key in ('width', 'height', 'style')})
+        try:
+            if width:
+                picture = self._current().add_run().add_picture(stream, width=Emu(width * _EMU_PER_PX),
+                                                                height=Emu(height * _EMU_PER_PX) if height else None)
+            else:
+                picture = self._current().add_run().add_picture(stream)
+        except (UnrecognizedImageError, OSError, ValueError) as exc:
+            raise UnsupportedContent(f"imagem não suportada ({exc})")
+        if picture.width > MAX_IMAGE_WIDTH:
+            # Mesmo efeito do img{max-width:100%} da exportação via HTML
+            picture.height = int(picture.height * MAX_IMAGE_WIDTH / picture.width)
+            picture.width = MAX_IMAGE_WIDTH
+        self.after_space = False
+
+    def _equation(self, index: int):
+        latex, display = self.equations[index]
+        try:
+            math = latex_to_omml(latex, display=display)
+        except UnsupportedLatex as exc:
+            raise UnsupportedContent(f"fórmula não suportada ({exc}): {latex[:100]}")
+        if display:
+            # Equação em bloco: parágrafo próprio, centralizado
+            self._close()
+            paragraph = self._current()
+            paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+            paragraph._p.append(math)
+            self._close()
+        else:
+            self._current()._p.append(math)
+            self.after_space = False
+
+
+def _add_html(document, style_ids: dict, html: str):
+    equations = []
+    soup = BeautifulSoup(_mark_equations(html, equations), 'html.parser')
+    _HtmlRenderer(document, style_ids, equations).render(soup.children)
+
+
+def build_exam_docx(
+    questions,
+    include_gabarito: bool = True,
+    use_resposta_gabarito: bool = False,
+    gabarito_option=None,
+) -> bytes:
+    """DOCX da prova gerado com python-docx. UnsupportedContent se algum campo não puder ser convertido."""
+    document = Document()
+    style_ids = _paragraph_style_ids(document)
+    for kind, *args in exam_outline(questions, include_gabarito, use_resposta_gabarito, gabarito_option):
+        if kind == 'title':
+            level, text = args
+            _styled_paragraph(document, style_ids, f"Heading {level}", text).alignment = WD_ALIGN_PARAGRAPH.CENTER
+        elif kind == 'heading':
+            level, text = args
+            _styled_paragraph(document, style_ids, f"Heading {level}", text)
+        elif kind == 'fields':
+            document.add_paragraph('   '.join(HEADER_FIELDS))
+        elif kind == 'student':
+            document.add_paragraph(STUDENT_FIELD)
+        elif kind == 'page_break':
+            document.add_paragraph().add_run().add_break(WD_BREAK.PAGE)
+        else:
+            _add_html(document, style_ids, args[0])
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
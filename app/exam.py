@@ -0,0 +1,317 @@
+"""
+Prova como documento: roteiro comum aos motores de exportação (`exam_outline`) e o
+caminho pelo pandoc — fragmentos de HTML convertidos (fórmulas em LaTeX, imagens com
+caminho absoluto), HTML da prova e conversão para docx/pdf (pool de `pandoc server` ou
+binário). Usado por app.exports e app.docx_export, sem dependência das views.
+"""
+import os
+import re
+import hashlib
+import html as html_lib
+import tempfile
+import subprocess
+from typing import Callable, Optional
+from bs4 import BeautifulSoup
+from django.conf import settings
+from django.core.cache import cache
+from urllib.parse import urlparse
+from app.math_rewriter import rewrite_math, strip_math_delimiters
+from app.pandoc_pool import get_pandoc_pool
+
+
+def convert_ckeditor_math_to_latex(html: str) -> str:
+    r"""
+    Converte fórmulas do CKEditor 4 (MathJax) para formato LaTeX que o Pandoc entende.
+    
+    O CKEditor salva fórmulas como:
+    - <span class="math-tex">\(...\)</span> ou <span class="math-tex">\[...\]</span>
+    - <script type="math/tex">...</script> ou <script type="math/tex; mode=display">...</script>
+    
+    O Pandoc precisa de:
+    - \(...\) para fórmulas inline
+    - \[...\] para fórmulas display
+    
+    Usa o reescritor de passada única (app.math_rewriter): só os trechos de fórmula
+    são alterados, o restante do HTML é mantido como está.
+    """
+    if not html:
+        return html
+
+    def to_latex(fragment):
+        clean_latex = strip_math_delimiters(fragment.latex).strip()
+        if not clean_latex:
+            return None
+        # <span>: bloco quando é o único filho de um <p>/<div>; <script>: pelo mode=display
+        is_display = fragment.sole_child if fragment.kind == 'span' else fragment.display
+        if is_display:
+            return html_lib.escape(f'\\[{clean_latex}\\]', quote=False)
+        return html_lib.escape(f'\\({clean_latex}\\)', quote=False)
+
+    return rewrite_math(html, to_latex, kinds=('span', 'script'))
+
+
+def _rewrite_img_src_to_fs_paths(html: str) -> str:
+    """Rewrite <img src> that point to MEDIA_URL into absolute filesystem paths so Pandoc can embed them."""
+    if '<img' not in html.lower():
+        return html
+    # Fragmento (enunciado/resposta): html.parser não acrescenta <html><body> em volta
+    soup = BeautifulSoup(html, 'html.parser')
+    media_url = getattr(settings, 'MEDIA_URL', '/media/')
+    media_root = getattr(settings, 'MEDIA_ROOT', None)
+    for img in soup.find_all('img'):
+        src = img.get('src', '')
+        if not src:
+            continue
+        parsed = urlparse(src)
+        if src.startswith('data:image'):
+            continue
+        if not parsed.scheme and media_root and src.startswith(media_url):
+            rel_path = src[len(media_url):]
+            abs_path = os.path.join(media_root, rel_path)
+            if os.path.exists(abs_path):
+                img['src'] = abs_path
+    return str(soup)
+
+
+# Incrementar sempre que a conversão de fragmentos mudar (invalida o cache de fragmentos)
+EXPORT_FRAGMENT_VERSION = 1
+
+
+def _export_fragment_key(html: str) -> str:
+    # MEDIA_URL/MEDIA_ROOT entram na chave porque definem os caminhos das imagens reescritas
+    payload = '|'.join((
+        str(EXPORT_FRAGMENT_VERSION),
+        getattr(settings, 'MEDIA_URL', '/media/'),
+        str(getattr(settings, 'MEDIA_ROOT', '')),
+        html,
+    ))
+    return f"exportfrag:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+def _convert_export_fragment(html: str) -> str:
+    """Campo de questão pronto para o pandoc: fórmulas em LaTeX e imagens locais com caminho absoluto."""
+    return _rewrite_img_src_to_fs_paths(convert_ckeditor_math_to_latex(html))
+
+
+def export_fragments(sources) -> dict:
+    """
+    HTML original → fragmento convertido, para todos os `sources` de uma vez. Os fragmentos
+    ficam no cache do Django pela chave de conteúdo (hash do HTML + EXPORT_FRAGMENT_VERSION),
+    então questões que não mudaram não passam de novo pela conversão; editar uma questão
+    muda o hash e a entrada antiga simplesmente deixa de ser usada.
+    """
+    keys = {_export_fragment_key(html): html for html in set(sources) if html}
+    fragments = {}
+    cached = cache.get_many(list(keys))
+    missing = {}
+    for key, html in keys.items():
+        if key in cached:
+            fragments[html] = cached[key]
+        else:
+            fragments[html] = missing[key] = _convert_export_fragment(html)
+    if missing:
+        cache.set_many(missing, getattr(settings, 'EXPORT_FRAGMENT_CACHE_TIMEOUT', 7 * 24 * 3600))
+    return fragments
+
+
+INSTITUTION_TITLE = "INSTITUTO FEDERAL – Sistema de Avaliação"
+HEADER_FIELDS = ("Professor(a): __________________", "Turma: ______", "Data: ____/____/______", "Nota: ______")
+STUDENT_FIELD = "Aluno(a): _________________________________________________________________"
+
+
+def exam_outline(
+    questions,
+    include_gabarito: bool = True,
+    use_resposta_gabarito: bool = False,
+    gabarito_option: Optional[str] = None,
+) -> list:
+    """
+    Estrutura da prova como lista de blocos, comum aos motores de exportação (HTML → pandoc
+    e python-docx): ('title', nível, texto) centralizado, ('heading', nível, texto),
+    ('fields',) com Professor/Turma/Data/Nota, ('student',), ('page_break',) e
+    ('html', fonte) com o HTML original de um campo da questão.
+    """
+    blocks = [('title', 2, INSTITUTION_TITLE), ('title', 1, 'PROVA'), ('fields',), ('student',)]
+    gabarito_option = gabarito_option or ("final_arquivo" if include_gabarito else "somente_questoes")
+
+    def gabarito_header(with_fields=False):
+        blocks.extend([('page_break',), ('title', 2, INSTITUTION_TITLE), ('title', 1, 'GABARITO')])
+        if with_fields:
+            blocks.extend([('fields',), ('student',)])
+
+    def answer(q):
+        if use_resposta_gabarito and getattr(q, 'resposta_gabarito', None):
+            return q.resposta_gabarito
+        return getattr(q, 'resposta', None) or None
+
+    if gabarito_option == "somente_questoes":
+        for idx, q in enumerate(questions, start=1):
+            blocks.extend([('heading', 3, f"Questão {idx}"), ('html', q.enunciado or '')])
+
+    elif gabarito_option == "somente_gabarito":
+        gabarito_header()
+        for idx, q in enumerate(questions, start=1):
+            blocks.append(('heading', 3, f"Questão {idx}"))
+            if getattr(q, 'resposta_gabarito', None):
+                blocks.append(('html', q.resposta_gabarito))
+
+    elif gabarito_option == "somente_gabarito_com_expectativa":
+        gabarito_header()
+        for idx, q in enumerate(questions, start=1):
+            blocks.append(('heading', 3, f"Questão {idx}"))
+            if getattr(q, 'resposta', None):
+                blocks.append(('html', q.resposta))
+
+    elif gabarito_option == "apos_cada_questao":
+        for idx, q in enumerate(questions, start=1):
+            blocks.extend([('heading', 3, f"Questão {idx}"), ('html', q.enunciado or ''), ('heading', 4, "Gabarito")])
+            if answer(q):
+                blocks.append(('html', answer(q)))
+
+    else:  # "final_arquivo"
+        for idx, q in enumerate(questions, start=1):
+            blocks.extend([('heading', 3, f"Questão {idx}"), ('html', q.enunciado or '')])
+
+        if include_gabarito:
+            gabarito_header(with_fields=True)
+            for idx, q in enumerate(questions, start=1):
+                blocks.append(('heading', 3, f"Questão {idx}"))
+                if answer(q):
+                    blocks.append(('html', answer(q)))
+
+    return blocks
+
+
+def build_exam_html(
+    questions,
+    include_gabarito: bool = True,
+    use_resposta_gabarito: bool = False,
+    gabarito_option: Optional[str] = None,
+) -> str:
+    """Monta o HTML completo da prova para ser entregue ao Pandoc."""
+    head = (
+        "<meta charset='utf-8'/>"
+        "<style>body{font-family: Arial, sans-serif;margin:40px;} img{max-width:100%;}</style>"
+    )
+    outline = exam_outline(questions, include_gabarito, use_resposta_gabarito, gabarito_option)
+    # Campos convertidos de uma vez (cache por conteúdo); aqui só se concatena
+    fragments = export_fragments(block[1] for block in outline if block[0] == 'html')
+
+    body_parts = []
+    for kind, *args in outline:
+        if kind == 'title':
+            level, text = args
+            body_parts.append(f"<h{level} style='text-align:center'>{text}</h{level}>")
+        elif kind == 'heading':
+            level, text = args
+            body_parts.append(f"<h{level}>{text}</h{level}>")
+        elif kind == 'fields':
+            body_parts.append(f"<div>{' &nbsp;&nbsp; '.join(HEADER_FIELDS)}</div>")
+        elif kind == 'student':
+            body_parts.append(f"<div>{STUDENT_FIELD}</div>")
+        elif kind == 'page_break':
+            body_parts.append("<p style='page-break-before: always;'></p>")
+        else:
+            body_parts.append(f"<div>{fragments.get(args[0], '')}</div>")
+
+    return f"<html><head>{head}</head><body>{''.join(body_parts)}</body></html>"
+
+
+PANDOC_READER = 'html+tex_math_dollars+tex_math_single_backslash'
+
+_IMG_SRC_RE = re.compile(r'<img\b[^>]*?\bsrc="([^"]+)"', re.IGNORECASE)
+
+
+def local_image_files(html: str) -> dict:
+    """Imagens sob MEDIA_ROOT referenciadas pelo HTML (caminho absoluto → bytes), para o pandoc server."""
+    media_root = getattr(settings, 'MEDIA_ROOT', None)
+    if not media_root:
+        return {}
+    root = os.path.join(os.path.abspath(media_root), '')
+    files = {}
+    for src in set(_IMG_SRC_RE.findall(html)):
+        path = html_lib.unescape(src)
+        if path.startswith(root) and os.path.isfile(path):
+            with open(path, 'rb') as f:
+                files[path] = f.read()
+    return files
+
+
+def _pandoc_binary() -> str:
+    return getattr(settings, 'PANDOC_BINARY', 'pandoc')
+
+
+def convert_with_subprocess(html: str, out_format: str, timeout: Optional[float] = None) -> bytes:
+    """Um processo pandoc por conversão; DOCX entra por stdin e sai por stdout (sem arquivos temporários)."""
+    media_root = getattr(settings, 'MEDIA_ROOT', None)
+    resource_args = ['--resource-path', media_root] if media_root else []
+
+    if out_format == 'docx':
+        cmd = [_pandoc_binary(), '-f', PANDOC_READER, '-t', out_format, '-o', '-', *resource_args]
+        result = subprocess.run(cmd, input=html.encode('utf-8'), check=True,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+        return result.stdout
+
+    # PDF precisa de arquivo de saída (o pandoc escolhe o motor pela extensão)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        out_path = os.path.join(tmpdir, f'output.{out_format}')
+        cmd = [_pandoc_binary(), '-f', PANDOC_READER, '-o', out_path, *resource_args]
+        subprocess.run(cmd, input=html.encode('utf-8'), check=True,
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+        with open(out_path, 'rb') as f:
+            return f.read()
+
+
+def _convert_with_pandoc(html: str, out_format: str, timeout: Optional[float] = None) -> bytes:
+    """
+    Converte o HTML gerado em docx/pdf com o pandoc: DOCX passa pelo pool de `pandoc server`
+    (app.pandoc_pool) quando disponível; o resto, ou sem pool, dispara o binário.
+    Interrompido após `timeout` segundos.
+    """
+    if out_format == 'docx':
+        pool = get_pandoc_pool()
+        if pool is not None:
+            return pool.convert(html, PANDOC_READER, out_format, files=local_image_files(html), timeout=timeout)
+    return convert_with_subprocess(html, out_format, timeout=timeout)
+
+
+def generate_exam_with_pandoc(
+    questions,
+    out_format: str = "docx",
+    include_gabarito: bool = True,
+    use_resposta_gabarito: bool = False,
+    gabarito_option: Optional[str] = None,
+    timeout: Optional[float] = None,
+    on_html_ready: Optional[Callable[[], None]] = None,
+) -> bytes:
+    """
+    Pipeline único: monta HTML a partir das questões e converte com o pandoc.
+    Lança RuntimeError em caso de falha para que a view trate corretamente.
+    `on_html_ready` é chamado entre as duas etapas (progresso das exportações assíncronas).
+    """
+    html = build_exam_html(
+        questions,
+        include_gabarito=include_gabarito,
+        use_resposta_gabarito=use_resposta_gabarito,
+        gabarito_option=gabarito_option,
+    )
+    if on_html_ready is not None:
+        on_html_ready()
+    try:
+        return _convert_with_pandoc(html, out_format=out_format, timeout=timeout)
+    except subprocess.CalledProcessError as exc:
+        stderr = ""
+        if exc.stderr:
+            try:
+                stderr = exc.stderr.decode("utf-8", errors="ignore")
+            except Exception:
+                stderr = str(exc.stderr)
+        details = f"Falha ao executar pandoc (code {exc.returncode})."
+        if stderr:
+            details = f"{details} Detalhes: {stderr.strip()}"
+        raise RuntimeError(details) from exc
+    except subprocess.TimeoutExpired as exc:
+        raise RuntimeError(f"pandoc excedeu o tempo limite de {exc.timeout:g}s.") from exc
+    except Exception as exc:
+        raise RuntimeError(f"Erro ao gerar arquivo com pandoc: {exc}") from exc
+
@@ -0,0 +1,417 @@
+"""
+Exportação de provas (DOCX) fora do ciclo da requisição.
+
+A view cria uma `ExportacaoProva` pendente e responde na hora; o comando
+`export_worker` (processo separado, sem broker externo: a fila é a própria tabela)
+reivindica tarefas com um UPDATE condicional, gera o arquivo e o grava em
+EXPORT_JOBS_DIR. O cliente acompanha pelo status e baixa o arquivo ao final.
+
+- Sem worker: uma tarefa disponível há mais de EXPORT_SYNC_FALLBACK_AFTER segundos sem
+  ser reivindicada é gerada pela própria consulta de status (`run_if_unclaimed()`), para
+  que a página não fique esperando para sempre quando o export_worker não está rodando.
+
+- Retentativas: falhas de geração voltam para a fila com espera crescente, até
+  EXPORT_JOB_MAX_ATTEMPTS tentativas.
+- Tempo limite: o pandoc é interrompido após EXPORT_JOB_TIMEOUT segundos; tarefas
+  presas em "executando" (worker morto) são devolvidas à fila por `requeue_stale()`.
+- Limpeza: `cleanup_exports()` apaga tarefas finalizadas (e seus arquivos) mais velhas
+  que EXPORT_JOB_RETENTION segundos.
+
+O documento é gerado pelo pandoc (HTML intermediário) ou, com `engine="python-docx"`,
+direto com python-docx (app.docx_export); conteúdo que o motor nativo não suporta cai
+de volta no pandoc. O padrão vem de EXPORT_ENGINE.
+
+Documentos prontos ficam num cache em disco (EXPORT_CACHE_DIR) pela chave de
+`export_cache_key()`: a mesma prova pedida de novo, sem edições nas questões, não
+passa pelo pandoc. `cleanup_export_cache()` remove os documentos sem uso; quem grava no
+cache (worker ou download síncrono) a chama no máximo a cada EXPORT_CLEANUP_INTERVAL
+segundos. O arquivo de cada tarefa é um hard link para o documento do cache.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import time
+import uuid
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .exam import EXPORT_FRAGMENT_VERSION, generate_exam_with_pandoc
+from .models import ExportacaoProva, Questao
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name: str, default):
+    return getattr(settings, name, default)
+
+
+def _jobs_dir() -> str:
+    return _setting('EXPORT_JOBS_DIR', os.path.join(settings.BASE_DIR, 'exports'))
+
+
+EXPORT_ENGINES = ('pandoc', 'python-docx')
+
+
+def export_options(data) -> dict:
+    """
+    Opções normalizadas de exportação a partir do corpo da requisição (mesmas regras
+    de /api/print-test/docx/). Lança ValueError se question_ids não for uma lista não vazia.
+    """
+    ids = data.get('question_ids', [])
+
+    # Compatibilidade: valores antigos ainda podem ser enviados
+    include_gabarito = bool(data.get('include_gabarito', True))
+    use_resposta_gabarito = bool(data.get('use_resposta_gabarito', False))
+    gabarito_option = data.get('gabarito_option')
+
+    # Se a opção de gabarito foi explicitamente informada pelo frontend novo,
+    # convertemos para os flags internos.
+    if gabarito_option:
+        if gabarito_option == "somente_questoes":
+            include_gabarito = False
+            use_resposta_gabarito = False
+        elif gabarito_option == "somente_gabarito":
+            include_gabarito = True
+            use_resposta_gabarito = True  # usar resposta_gabarito (letras, etc.)
+        elif gabarito_option == "somente_gabarito_com_expectativa":
+            include_gabarito = True
+            use_resposta_gabarito = False  # usar expectativa / resposta completa
+        elif gabarito_option in ("apos_cada_questao", "final_arquivo"):
+            # Provas completas com gabarito em posições diferentes.
+            include_gabarito = True
+            # Para essas opções seguimos o valor enviado ou o padrão (False).
+        else:
+            # Valor desconhecido: assumir comportamento padrão atual
+            gabarito_option = "final_arquivo"
+    else:
+        # Frontend antigo: inferir opção a partir dos flags
+        if not include_gabarito:
+            gabarito_option = "somente_questoes"
+        else:
+            gabarito_option = "final_arquivo"
+
+    if not isinstance(ids, list) or not ids:
+        raise ValueError("question_ids deve ser uma lista não vazia")
+    try:
+        ids = [int(pk) for pk in ids]
+    except (TypeError, ValueError):
+        raise ValueError("question_ids deve conter apenas números")
+
+    # Obter nome da prova (se fornecido)
+    test_name = (data.get('test_name') or '').strip()
+    if not test_name:
+        test_name = "prova" if not include_gabarito else "prova_com_gabarito"
+
+    # Motor de geração; valor desconhecido ou ausente usa o padrão configurado
+    engine = data.get('engine')
+    if engine not in EXPORT_ENGINES:
+        engine = _setting('EXPORT_ENGINE', 'pandoc')
+
+    return {
+        'question_ids': ids,
+        'include_gabarito': include_gabarito,
+        'use_resposta_gabarito': use_resposta_gabarito,
+        'gabarito_option': gabarito_option,
+        'test_name': test_name,
+        'engine': engine,
+    }
+
+
+# Incrementar quando a estrutura do documento (cabeçalho, seções, estilos) mudar: invalida o cache de DOCX
+EXPORT_TEMPLATE_VERSION = 1
+
+
+def _export_questions(options: dict) -> list:
+    questions = list(Questao.objects.filter(id__in=options['question_ids']))
+    if not questions:
+        raise LookupError("Nenhuma questão encontrada")
+    return questions
+
+
+def question_content_hash(question) -> str:
+    """Hash dos campos de uma questão que aparecem na prova."""
+    payload = '\0'.join(getattr(question, field, None) or '' for field in ('enunciado', 'resposta', 'resposta_gabarito'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def export_cache_key(options: dict, questions) -> str:
+    """
+    Chave do DOCX em cache: questões na ordem em que entram na prova, o hash do conteúdo
+    de cada uma, as opções que mudam o documento (inclusive o motor) e as versões do
+    modelo e da conversão.
+    Editar qualquer questão incluída muda a chave. O nome da prova não entra: só vira
+    o nome do arquivo baixado.
+    """
+    payload = json.dumps({
+        'template': EXPORT_TEMPLATE_VERSION,
+        'fragments': EXPORT_FRAGMENT_VERSION,
+        'questions': [[q.pk, question_content_hash(q)] for q in questions],
+        'options': [options['gabarito_option'], options['include_gabarito'], options['use_resposta_gabarito']],
+        'engine': options.get('engine', 'pandoc'),
+    }, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _cache_dir() -> str:
+    return _setting('EXPORT_CACHE_DIR', os.path.join(_jobs_dir(), 'cache'))
+
+
+# Arquivo no cache cujo mtime marca a última limpeza (compartilhado por todos os processos)
+_CLEANUP_STAMP = '.ultima-limpeza'
+
+
+def _atomic_write(path: str, data: bytes):
+    # Escrita atômica: quem lê nunca vê um arquivo pela metade
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _render_native(options: dict, questions) -> Optional[bytes]:
+    """DOCX pelo motor python-docx, ou None se a prova tiver conteúdo que ele não suporta."""
+    from .docx_export import UnsupportedContent, build_exam_docx
+
+    try:
+        return build_exam_docx(
+            questions,
+            include_gabarito=options['include_gabarito'],
+            use_resposta_gabarito=options['use_resposta_gabarito'],
+            gabarito_option=options['gabarito_option'],
+        )
+    except UnsupportedContent as exc:
+        logger.info("Exportação nativa indisponível para esta prova (%s); usando o pandoc", exc)
+        return None
+
+
+def render_export_file(options: dict, timeout: Optional[float] = None, on_html_ready=None) -> str:
+    """
+    Caminho do DOCX da prova descrita por `options` no cache em disco; só gera o documento
+    se ele ainda não existir. LookupError se nenhuma questão existir; RuntimeError se o
+    pandoc falhar.
+    """
+    questions = _export_questions(options)
+    key = export_cache_key(options, questions)
+    path = os.path.join(_cache_dir(), key[:2], f"{key}.docx")
+    if os.path.exists(path):
+        # Mantém a entrada viva para cleanup_exports (remoção por tempo sem uso)
+        os.utime(path)
+        return path
+    data = None
+    if options.get('engine') == 'python-docx':
+        data = _render_native(options, questions)
+    if data is None:
+        data = generate_exam_with_pandoc(
+            questions,
+            out_format='docx',
+            include_gabarito=options['include_gabarito'],
+            use_resposta_gabarito=options['use_resposta_gabarito'],
+            gabarito_option=options['gabarito_option'],
+            timeout=timeout,
+            on_html_ready=on_html_ready,
+        )
+    _atomic_write(path, data)
+    _cleanup_export_cache_if_due()
+    return path
+
+
+def submit_export(options: dict, usuario=None) -> ExportacaoProva:
+    return ExportacaoProva.objects.create(
+        usuario=usuario if usuario is not None and usuario.is_authenticated else None,
+        parametros=options,
+        nome_arquivo=f"{options['test_name']}.docx",
+    )
+
+
+def claim_next(worker: str) -> Optional[ExportacaoProva]:
+    """
+    Reivindica a tarefa pendente mais antiga. O UPDATE condicional (status ainda pendente)
+    garante que dois workers nunca peguem a mesma tarefa.
+    """
+    now = timezone.now()
+    candidates = (
+        ExportacaoProva.objects.filter(status=ExportacaoProva.PENDENTE, disponivel_em__lte=now)
+        .order_by('criado_em').values_list('pk', flat=True)[:10]
+    )
+    for pk in candidates:
+        job = _claim(pk, worker, now)
+        if job is not None:
+            return job
+    return None
+
+
+def _claim(pk, worker: str, now) -> Optional[ExportacaoProva]:
+    claimed = ExportacaoProva.objects.filter(pk=pk, status=ExportacaoProva.PENDENTE).update(
+        status=ExportacaoProva.EXECUTANDO, progresso=10, tentativas=F('tentativas') + 1,
+        worker=worker, iniciado_em=now,
+    )
+    return ExportacaoProva.objects.get(pk=pk) if claimed else None
+
+
+def run_if_unclaimed(job: ExportacaoProva) -> ExportacaoProva:
+    """
+    Gera no processo atual uma tarefa pendente que nenhum worker reivindicou em
+    EXPORT_SYNC_FALLBACK_AFTER segundos (0 desliga) e devolve a tarefa atualizada. A
+    reivindicação é o mesmo UPDATE condicional do worker: só um dos dois a executa.
+    """
+    wait = _setting('EXPORT_SYNC_FALLBACK_AFTER', 15)
+    now = timezone.now()
+    if wait <= 0 or job.status != ExportacaoProva.PENDENTE or job.disponivel_em > now - timedelta(seconds=wait):
+        return job
+    claimed = _claim(job.pk, f"sync:{socket.gethostname()}:{os.getpid()}", now)
+    if claimed is None:
+        job.refresh_from_db()
+        return job
+    logger.warning("Exportação %s sem worker há %ss; gerando na própria requisição "
+                   "(o export_worker está rodando?)", job.pk, wait)
+    run_export(claimed)
+    claimed.refresh_from_db()
+    return claimed
+
+
+def _finish(job: ExportacaoProva, **fields) -> bool:
+    # Só altera a tarefa se ela ainda estiver com este worker (pode ter sido devolvida à fila)
+    return bool(ExportacaoProva.objects.filter(
+        pk=job.pk, status=ExportacaoProva.EXECUTANDO, worker=job.worker,
+    ).update(**fields))
+
+
+def _retry_or_fail(job: ExportacaoProva, error: str, retry: bool = True):
+    now = timezone.now()
+    if retry and job.tentativas < _setting('EXPORT_JOB_MAX_ATTEMPTS', 3):
+        delay = _setting('EXPORT_JOB_RETRY_DELAY', 10) * job.tentativas
+        _finish(job, status=ExportacaoProva.PENDENTE, progresso=0, erro=error,
+                disponivel_em=now + timedelta(seconds=delay))
+    else:
+        _finish(job, status=ExportacaoProva.FALHOU, erro=error, concluido_em=now)
+
+
+def _write_artifact(job: ExportacaoProva, source: str) -> str:
+    """
+    Publica o documento do cache como arquivo da tarefa: hard link (sem copiar bytes; a
+    limpeza de um lado não afeta o outro), ou cópia se o cache estiver em outro sistema
+    de arquivos.
+    """
+    relative = f"{job.pk}.docx"
+    path = os.path.join(_jobs_dir(), relative)
+    os.makedirs(_jobs_dir(), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        try:
+            os.link(source, tmp_path)
+        except OSError:
+            shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return relative
+
+
+def artifact_path(job: ExportacaoProva) -> Optional[str]:
+    if not job.arquivo:
+        return None
+    return os.path.join(_jobs_dir(), job.arquivo)
+
+
+def run_export(job: ExportacaoProva):
+    """Executa uma tarefa já reivindicada, registrando o resultado (ou a falha) no banco."""
+    def html_ready():
+        _finish(job, progresso=50)
+
+    try:
+        source = render_export_file(job.parametros, timeout=_setting('EXPORT_JOB_TIMEOUT', 120),
+                                    on_html_ready=html_ready)
+    except LookupError as exc:
+        # Questões apagadas depois do envio: tentar de novo não adianta
+        _retry_or_fail(job, str(exc), retry=False)
+        return
+    except Exception as exc:
+        logger.warning("Falha na exportação %s (tentativa %s): %s", job.pk, job.tentativas, exc)
+        _retry_or_fail(job, str(exc))
+        return
+    relative = _write_artifact(job, source)
+    if not _finish(job, status=ExportacaoProva.CONCLUIDA, progresso=100, erro='',
+                   arquivo=relative, concluido_em=timezone.now()):
+        # A tarefa foi devolvida à fila enquanto rodava; outro worker vai regravar o arquivo
+        logger.info("Exportação %s concluída após ser devolvida à fila", job.pk)
+
+
+def requeue_stale() -> int:
+    """Devolve à fila (ou marca como falha) tarefas "executando" há mais que o tempo limite."""
+    limit = _setting('EXPORT_JOB_TIMEOUT', 120) + _setting('EXPORT_JOB_STALE_GRACE', 60)
+    cutoff = timezone.now() - timedelta(seconds=limit)
+    stale = ExportacaoProva.objects.filter(status=ExportacaoProva.EXECUTANDO, iniciado_em__lt=cutoff)
+    count = 0
+    for job in stale:
+        _retry_or_fail(job, "Tempo limite excedido (worker interrompido?)")
+        count += 1
+    return count
+
+
+def cleanup_exports(now=None) -> int:
+    """Apaga tarefas concluídas/falhas mais antigas que EXPORT_JOB_RETENTION e seus arquivos."""
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=_setting('EXPORT_JOB_RETENTION', 24 * 3600))
+    old = ExportacaoProva.objects.filter(
+        status__in=(ExportacaoProva.CONCLUIDA, ExportacaoProva.FALHOU), concluido_em__lt=cutoff,
+    )
+    count = 0
+    for job in old:
+        path = artifact_path(job)
+        if path and os.path.exists(path):
+            os.remove(path)
+        job.delete()
+        count += 1
+    return count
+
+
+def cleanup_export_cache(now: float = None) -> int:
+    """Remove do cache de DOCX os documentos sem uso há mais de EXPORT_CACHE_MAX_AGE segundos."""
+    cutoff = (now or time.time()) - _setting('EXPORT_CACHE_MAX_AGE', 7 * 24 * 3600)
+    count = 0
+    for dirpath, _, filenames in os.walk(_cache_dir()):
+        for filename in filenames:
+            if filename == _CLEANUP_STAMP:
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    count += 1
+            except FileNotFoundError:
+                pass
+    return count
+
+
+def _cleanup_export_cache_if_due():
+    """
+    `cleanup_export_cache()` no caminho de escrita, no máximo a cada EXPORT_CLEANUP_INTERVAL
+    segundos: o cache não cresce sem limite mesmo sem o export_worker rodando.
+    """
+    stamp = os.path.join(_cache_dir(), _CLEANUP_STAMP)
+    try:
+        if time.time() - os.path.getmtime(stamp) < _setting('EXPORT_CLEANUP_INTERVAL', 600):
+            return
+    except FileNotFoundError:
+        pass
+    with open(stamp, 'a'):
+        pass
+    os.utime(stamp)
+    cleanup_export_cache()
@@ -0,0 +1,80 @@
+"""
+Facetas da listagem de questões: quantas questões cada valor de ano, banca, tipo,
+dificuldade e grau de escolaridade teria dentro do filtro atual.
+
+Uma única query agrupa as questões que passam pelos filtros que não são facetas
+(busca, árvore de conteúdos, imagem) pelas cinco colunas; as contagens por faceta
+saem dessa tabela em Python. A contagem de cada faceta ignora a seleção da própria
+faceta (facetas disjuntivas): com "FGV" marcada, as outras bancas continuam com
+o número de resultados que dariam se fossem marcadas também.
+
+O resultado fica no cache do Django pela chave normalizada do filtro e pela geração
+das questões, então qualquer escrita em Questao invalida as entradas antigas.
+"""
+from django.conf import settings
+from django.db.models import Count
+from django.http import QueryDict
+
+from .caching import get_or_compute
+from .filters import FACET_FIELDS, apply_filters, filter_key, parse_filters
+from .models import Geracao, Questao
+
+# Ordem dos valores em cada faceta (a mesma das listas de valores distintos usadas antes)
+_DESCENDING = {'ano'}
+
+
+def _facet_rows(filters: dict) -> list:
+    queryset = apply_filters(Questao.objects.all(), filters, facets=False)
+    return list(
+        queryset.order_by().values_list(*FACET_FIELDS).annotate(total=Count('id'))
+    )
+
+
+def _count_facets(rows: list, filters: dict) -> dict:
+    selected = {field: set(filters[field]) for field in FACET_FIELDS}
+    positions = {field: i for i, field in enumerate(FACET_FIELDS)}
+    counts = {field: {} for field in FACET_FIELDS}
+    total = 0
+    for row in rows:
+        *values, n = row
+        # Facetas cujo filtro esta linha não satisfaz
+        misses = [field for field in FACET_FIELDS if selected[field] and values[positions[field]] not in selected[field]]
+        if not misses:
+            total += n
+        for field in FACET_FIELDS:
+            if not misses or misses == [field]:
+                value = values[positions[field]]
+                counts[field][value] = counts[field].get(value, 0) + n
+    facets = {
+        field: [
+            {'value': value, 'count': count}
+            for value, count in sorted(counts[field].items(), key=lambda item: item[0],
+                                       reverse=field in _DESCENDING)
+        ]
+        for field in FACET_FIELDS
+    }
+    # Valores selecionados sem nenhum resultado continuam visíveis (com zero)
+    for field in FACET_FIELDS:
+        missing = selected[field] - counts[field].keys()
+        facets[field] += [{'value': value, 'count': 0} for value in sorted(missing)]
+    return {'total': total, 'facets': facets}
+
+
+def compute_facets(filters: dict) -> dict:
+    """{'total': N, 'facets': {campo: [{'value', 'count'}, ...]}} para o filtro normalizado."""
+    return get_or_compute(
+        f"facets:{Geracao.current(Questao.GERACAO)}:{filter_key(filters)}",
+        lambda: _count_facets(_facet_rows(filters), filters),
+        getattr(settings, 'FACETS_CACHE_TIMEOUT', 300),
+    )
+
+
+def distinct_values() -> dict:
+    """Valores existentes de cada faceta (sem filtro), na ordem das antigas consultas DISTINCT."""
+    facets = compute_facets(parse_filters(QueryDict()))['facets']
+    return {field: [item['value'] for item in items] for field, items in facets.items()}
+
+
+def values_etag() -> str:
+    """ETag dos valores distintos: muda junto com a geração das questões."""
+    return f'"q{Geracao.current(Questao.GERACAO)}"'
@@ -0,0 +1,138 @@
+"""
+Filtros da listagem de questões, compartilhados pela API (QuestaoViewSet), pela página
+de questões e pelas facetas.
+
+`parse_filters()` normaliza os parâmetros da requisição (listas ordenadas, sem vazios
+nem valores inválidos), `filter_key()` gera uma chave estável para cache e
+`apply_filters()` monta o queryset.
+
+`result_ids()` guarda no cache a lista ordenada de ids que casam com um filtro, para a
+paginação por número de página fatiar a lista e buscar só as linhas da página pela
+chave primária (sem refazer o filtro nem o COUNT(*) a cada página). Resultados maiores
+que RESULT_IDS_CACHE_MAX_IDS ficam de fora e são paginados pelo queryset.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+
+from .caching import get_or_compute
+from .models import Geracao, Questao
+from .search import search_questoes
+from .taxonomy import TAXONOMY_LEVELS, area_selection_q, under_conteudo_q
+
+# Campos com valores discretos exibidos como facetas na barra de filtros
+FACET_FIELDS = ('ano', 'banca', 'tipo_questao', 'dificuldade', 'grau_escolaridade')
+INT_FIELDS = {'ano'} | {f'{level}_id' for level in TAXONOMY_LEVELS}
+
+
+def _getlist(params, name):
+    # A API aceita tanto ?area_id=1&area_id=2 quanto ?area_ids=1&area_ids=2
+    values = params.getlist(name)
+    if not values and name.endswith('_id'):
+        values = params.getlist(f'{name}s')
+    return values
+
+
+def _clean(values, as_int: bool) -> tuple:
+    cleaned = set()
+    for value in values:
+        value = str(value).strip()
+        if not value:
+            continue
+        if as_int:
+            try:
+                value = int(value)
+            except ValueError:
+                continue
+        cleaned.add(value)
+    return tuple(sorted(cleaned))
+
+
+def parse_filters(params) -> dict:
+    """Filtros normalizados a partir de request.GET/query_params."""
+    filters = {'search': (params.get('search') or '').strip()}
+    for level in TAXONOMY_LEVELS:
+        filters[f'{level}_id'] = _clean(_getlist(params, f'{level}_id'), as_int=True)
+    # Nó de qualquer nível: questões em qualquer ponto da subárvore dele
+    filters['conteudo_id'] = _clean(_getlist(params, 'conteudo_id'), as_int=True)
+    for field in FACET_FIELDS:
+        filters[field] = _clean(_getlist(params, field), as_int=field in INT_FIELDS)
+    tem_imagem = (params.get('tem_imagem') or '').lower()
+    filters['tem_imagem'] = tem_imagem if tem_imagem in ('true', 'false') else ''
+    return filters
+
+
+def filter_key(filters: dict) -> str:
+    """Chave curta e estável do conjunto de filtros (mesmos filtros em qualquer ordem → mesma chave)."""
+    payload = json.dumps(filters, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def apply_filters(queryset, filters: dict, facets: bool = True):
+    """
+    Aplica os filtros ao queryset. Com `facets=False` os filtros de faceta (ano, banca, ...)
+    ficam de fora, para a contagem por valor em app.facets.
+    """
+    if filters['search']:
+        queryset = search_questoes(queryset, filters['search'])
+
+    area_ids = filters['area_id']
+    children = {level: filters[f'{level}_id'] for level in TAXONOMY_LEVELS[1:]}
+    if area_ids and any(children.values()):
+        # (área=Matemática) OU (área=Química E unidade=Química Orgânica): para cada área,
+        # os filhos selecionados dentro dela (ou a área inteira, se não houver)
+        queryset = queryset.filter(area_selection_q(area_ids, children))
+    else:
+        # Comportamento padrão: AND entre diferentes tipos de filtros
+        for level in TAXONOMY_LEVELS:
+            if filters[f'{level}_id']:
+                queryset = queryset.filter(**{f'{level}_id__in': filters[f'{level}_id']})
+    if filters['conteudo_id']:
+        queryset = queryset.filter(under_conteudo_q(filters['conteudo_id']))
+
+    if facets:
+        for field in FACET_FIELDS:
+            if filters[field]:
+                queryset = queryset.filter(**{f'{field}__in': filters[field]})
+
+    if filters['tem_imagem'] == 'true':
+        # Questões que têm imagem no enunciado ou resposta
+        queryset = queryset.filter(has_image=True)
+    elif filters['tem_imagem'] == 'false':
+        queryset = queryset.filter(has_image=False)
+    return queryset
+
+
+def default_ordering(filters: dict) -> tuple:
+    """Relevância quando há busca; senão as mais novas primeiro."""
+    return ('-search_rank', '-id') if filters['search'] else ('-id',)
+
+
+def result_ids(filters: dict, ordering: tuple):
+    """
+    Ids das questões que casam com `filters`, na ordem `ordering`. Em cache pela chave do
+    filtro + ordenação e pela geração das questões (qualquer escrita invalida).
+    Acima de RESULT_IDS_CACHE_MAX_IDS retorna None (só max + 1 ids são lidos para saber
+    disso): o chamador pagina o queryset direto em vez de materializar todos os ids.
+    """
+    max_ids = getattr(settings, 'RESULT_IDS_CACHE_MAX_IDS', 20000)
+
+    def compute():
+        queryset = apply_filters(Questao.objects.all(), filters).order_by(*ordering)
+        ids = list(queryset.values_list('id', flat=True)[:max_ids + 1])
+        # False (e não None) para o "grande demais" também ficar em cache
+        return ids if len(ids) <= max_ids else False
+
+    ids = get_or_compute(
+        f"qids:{Geracao.current(Questao.GERACAO)}:{max_ids}:{filter_key(filters)}:{','.join(ordering)}",
+        compute,
+        getattr(settings, 'RESULT_IDS_CACHE_TIMEOUT', 300),
+    )
+    return None if ids is False else ids
+
+
+def fetch_in_order(queryset, ids) -> list:
+    """Linhas de `queryset` com os `ids` dados, na mesma ordem (ids que sumiram são ignorados)."""
+    rows = queryset.in_bulk(list(ids))
+    return [rows[pk] for pk in ids if pk in rows]
@@ -0,0 +1,102 @@
+"""
+Referências de imagem no HTML das questões.
+
+Extrai as tags <img> de enunciado/resposta/gabarito para a tabela `QuestaoImagem`
+(campo, caminho e dimensões) e para o flag indexado `Questao.has_image`, usados no
+filtro `tem_imagem` no lugar de buscas `icontains '<img'` em todo o texto rico.
+"""
+import html as html_lib
+import os
+import re
+from typing import NamedTuple, Optional
+from urllib.parse import unquote, urlparse
+
+from django.conf import settings
+from PIL import Image
+
+_IMG_RE = re.compile(r"<img\b([^>]*)>", re.IGNORECASE)
+_ATTR_RE = re.compile(r"""\b(src|width|height|style)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.IGNORECASE)
+_STYLE_SIZE_RE = re.compile(r"\b(width|height)\s*:\s*(\d+)(?:\.\d+)?\s*px", re.IGNORECASE)
+_NUMBER_RE = re.compile(r"^\s*(\d+)")
+
+# O caminho guardado é truncado neste tamanho (data URIs não são armazenados)
+MAX_PATH_LENGTH = 500
+
+
+class ImageRef(NamedTuple):
+    caminho: str             # relativo a MEDIA_ROOT para arquivos locais; URL completa para externos
+    local: bool              # arquivo servido a partir de MEDIA_ROOT
+    largura: Optional[int]
+    altura: Optional[int]
+
+
+def _attrs(raw: str) -> dict:
+    attrs = {}
+    for m in _ATTR_RE.finditer(raw):
+        value = next(g for g in m.groups()[1:] if g is not None)
+        attrs.setdefault(m.group(1).lower(), html_lib.unescape(value))
+    return attrs
+
+
+def declared_size(attrs: dict):
+    """Dimensões declaradas no HTML: style="width:..px; height:..px" (CKEditor) ou atributos width/height."""
+    size = {}
+    for name, value in _STYLE_SIZE_RE.findall(attrs.get('style', '')):
+        size.setdefault(name.lower(), int(value))
+    for name in ('width', 'height'):
+        if name not in size and name in attrs:
+            m = _NUMBER_RE.match(attrs[name])
+            if m:
+                size[name] = int(m.group(1))
+    return size.get('width'), size.get('height')
+
+
+def _file_size(rel_path: str):
+    """Dimensões lidas do arquivo (só o cabeçalho); None se não existir ou não for imagem."""
+    media_root = getattr(settings, 'MEDIA_ROOT', None)
+    if not media_root:
+        return None, None
+    try:
+        with Image.open(os.path.join(media_root, rel_path)) as image:
+            return image.size
+    except (OSError, ValueError):
+        return None, None
+
+
+def _resolve(src: str):
+    """Normaliza o src: caminho relativo a MEDIA_ROOT para mídia local, URL completa para o resto."""
+    media_url = getattr(settings, 'MEDIA_URL', '/media/')
+    parsed = urlparse(src)
+    path = parsed.path
+    if parsed.scheme in ('http', 'https') and path.startswith(media_url):
+        # URL absoluta do próprio servidor também é mídia local
+        return unquote(path[len(media_url):]), True
+    if not parsed.scheme and not parsed.netloc and path.startswith(media_url):
+        return unquote(path[len(media_url):]), True
+    return src[:MAX_PATH_LENGTH], False
+
+
+def has_images(*fragments: str) -> bool:
+    return any(fragment and _IMG_RE.search(fragment) for fragment in fragments)
+
+
+def extract_image_refs(html: str) -> list:
+    """Lista de ImageRef das tags <img> do HTML, na ordem do documento (sem repetir caminhos)."""
+    if not html:
+        return []
+    refs = []
+    seen = set()
+    for m in _IMG_RE.finditer(html):
+        attrs = _attrs(m.group(1))
+        src = attrs.get('src', '').strip()
+        if not src or src.startswith('data:'):
+            continue
+        caminho, local = _resolve(src)
+        if caminho in seen:
+            continue
+        seen.add(caminho)
+        largura, altura = declared_size(attrs)
+        if local and largura is None and altura is None:
+            largura, altura = _file_size(caminho)
+        refs.append(ImageRef(caminho, local, largura, altura))
+    return refs
@@ -0,0 +1,29 @@
+"""Dados e medição compartilhados pelos comandos bench_* (não é um comando)."""
+import time
+from types import SimpleNamespace
+
+
+def sample_questions(total: int) -> list:
+    """Questões sintéticas no formato salvo pelo CKEditor (texto, fórmulas inline e em bloco)."""
+    return [
+        SimpleNamespace(
+            enunciado=(
+                f'<p>Questão {i}: considere <span class="math-tex">\\(f(x) = x^{{{i % 7}}} + \\frac{{{i}}}{{2}}\\)</span> '
+                f'e calcule:</p><p><span class="math-tex">\\[\\int_0^{{{i}}} f(x)\\,dx\\]</span></p>'
+                '<ol><li>alternativa a</li><li>alternativa b</li><li>alternativa c</li></ol>'
+            ),
+            resposta=f'<p>Resposta {i}: <span class="math-tex">\\(x = {i}\\)</span></p>',
+            resposta_gabarito='<p>A</p>',
+        )
+        for i in range(total)
+    ]
+
+
+def timings(func, repeat: int) -> list:
+    """Duração (s) de `repeat` chamadas de `func`."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from app.models import Questao
+
+
+class Command(BaseCommand):
+    help = "Gera (ou regenera) o HTML pré-renderizado de enunciado/resposta das questões existentes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Re-renderiza mesmo quando o hash está atualizado.')
+        parser.add_argument('--chunk-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        fields = ['id']
+        for field in Questao.RENDERED_FIELDS:
+            fields += [field, f'{field}_rendered', f'{field}_rendered_hash']
+
+        updated = 0
+        total = 0
+        for questao in Questao.objects.only(*fields).order_by('id').iterator(chunk_size=options['chunk_size']):
+            total += 1
+            changes = {}
+            for field in Questao.RENDERED_FIELDS:
+                if options['force']:
+                    setattr(questao, f'{field}_rendered_hash', '')
+                if questao._refresh_rendered(field):
+                    changes[f'{field}_rendered'] = getattr(questao, f'{field}_rendered')
+                    changes[f'{field}_rendered_hash'] = getattr(questao, f'{field}_rendered_hash')
+            if changes:
+                Questao.objects.filter(pk=questao.pk).update(**changes)
+                updated += 1
+
+        self.stdout.write(self.style.SUCCESS(f"{updated} de {total} questões atualizadas."))
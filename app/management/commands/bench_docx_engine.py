@@ -0,0 +1,86 @@
+import os
+import resource
+import statistics
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.docx_export import UnsupportedContent, build_exam_docx
+from app.exam import build_exam_html, convert_with_subprocess
+from app.management.bench import sample_questions, timings
+
+
+def _peak_rss_kib(func):
+    """
+    Pico de RSS (KiB, Linux) de uma chamada isolada num processo filho: (processo Python,
+    maior processo pandoc disparado por ele). O filho parte do RSS do pai, então compare
+    com a linha de base impressa no início. tracemalloc não serve aqui: o XML do
+    python-docx vive em memória do lxml, fora do alocador do Python.
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            func()
+            usage = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                     resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+            os.write(write_fd, ('%d %d' % usage).encode())
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as pipe:
+        data = pipe.read()
+    os.waitpid(pid, 0)
+    if not data:
+        raise CommandError("Falha ao medir memória no processo filho")
+    own, children = (int(value) for value in data.split())
+    return own, children
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara latência e memória por exportação DOCX: motor nativo (python-docx) e pandoc "
+        "(montagem do HTML + conversão por processo; o pool fica de fora para a memória do pandoc "
+        "aparecer no processo filho)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, nargs='+', default=[10, 60])
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--skip-pandoc', action='store_true', help="Mede só o motor nativo")
+
+    def handle(self, *args, **options):
+        # Base: imports e primeira exportação já feitos, para o filho não contar o carregamento
+        build_exam_docx(sample_questions(1))
+        self.stdout.write(f"RSS base do processo: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss} KiB")
+        self.stdout.write(
+            f"{'motor':<12} {'questões':>8} {'KiB':>6} {'mediana ms':>11} {'p95 ms':>8} "
+            f"{'RSS processo KiB':>17} {'RSS pandoc KiB':>15}"
+        )
+        for total in options['questions']:
+            questions = sample_questions(total)
+
+            def native():
+                return build_exam_docx(questions, gabarito_option='final_arquivo')
+
+            def pandoc():
+                html = build_exam_html(questions, gabarito_option='final_arquivo')
+                return convert_with_subprocess(html, 'docx')
+
+            cases = [('python-docx', native)]
+            if not options['skip_pandoc']:
+                cases.append(('pandoc', pandoc))
+            for label, func in cases:
+                try:
+                    size = len(func())  # aquecimento (imports, cache de fragmentos)
+                except UnsupportedContent as exc:
+                    raise CommandError(f"Questões do benchmark não suportadas pelo motor nativo: {exc}")
+                except OSError as exc:
+                    raise CommandError(f"pandoc indisponível: {exc} (use --skip-pandoc)")
+                samples = sorted(timings(func, options['repeat']))
+                p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+                own, children = _peak_rss_kib(func)
+                self.stdout.write(
+                    f"{label:<12} {total:>8} {size / 1024:>6.0f} {statistics.median(samples) * 1000:>11.1f} "
+                    f"{p95 * 1000:>8.1f} {own:>17} {children or '-':>15}"
+                )
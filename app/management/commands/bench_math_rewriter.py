@@ -0,0 +1,118 @@
+import re
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+from django.core.management.base import BaseCommand
+
+from app.math_rewriter import rewrite_math
+from app.exam import convert_ckeditor_math_to_latex
+
+_IMG = '<img alt="math" style="vertical-align: middle;" src="/media/math/00/0000.png" />'
+
+
+def _legacy_render(html: str) -> str:
+    """Implementação anterior de html_render_math_to_img (regex + BeautifulSoup), com renderizador fixo."""
+    pattern = re.compile(r"(\$\$[\s\S]*?\$\$|\\\[[\s\S]*?\\\]|\\\([\s\S]*?\\\)|\$[\s\S]*?\$)")
+    processed = pattern.sub(lambda m: _IMG, html)
+    soup = BeautifulSoup(processed, 'lxml')
+    changed = False
+    for span in soup.find_all(['span', 'script'], class_=lambda c: c and 'math-tex' in c.split()) or []:
+        span.get_text()
+        img_tag = soup.new_tag('img', src='/media/math/00/0000.png')
+        img_tag['alt'] = 'math'
+        img_tag['style'] = 'vertical-align: middle;'
+        span.replace_with(img_tag)
+        changed = True
+    for script in soup.find_all('script'):
+        t = (script.get('type') or '').lower()
+        if t.startswith('math/tex'):
+            script.get_text()
+            img_tag = soup.new_tag('img', src='/media/math/00/0000.png')
+            script.replace_with(img_tag)
+            changed = True
+    if changed:
+        return str(soup)
+    return processed
+
+
+def _legacy_convert(html: str) -> str:
+    """Implementação anterior de convert_ckeditor_math_to_latex (parse completo com BeautifulSoup)."""
+    soup = BeautifulSoup(html, 'lxml')
+    for span in soup.find_all('span', class_=lambda c: c and 'math-tex' in (c if isinstance(c, str) else ' '.join(c)).split()):
+        latex_content = span.get_text(strip=True)
+        if latex_content:
+            parent = span.parent
+            is_display = parent and parent.name in ['div', 'p'] and span == parent.contents[0] and len(parent.contents) == 1
+            delim = ('\\[', '\\]') if is_display else ('\\(', '\\)')
+            span.replace_with(soup.new_string(f'{delim[0]}{latex_content[2:-2]}{delim[1]}'))
+    for script in soup.find_all('script'):
+        script_type = (script.get('type') or '').lower()
+        if script_type.startswith('math/tex'):
+            latex_content = script.get_text(strip=True)
+            if latex_content:
+                script.replace_with(soup.new_string(f'\\({latex_content}\\)'))
+    if soup.body:
+        return soup.body.decode_contents()
+    return html
+
+
+def _build_document(paragraphs: int) -> str:
+    """Documento sintético no formato salvo pelo CKEditor (texto, fórmulas, imagens, tabelas)."""
+    parts = []
+    for i in range(paragraphs):
+        parts.append(
+            f'<p>Considere a função <span class="math-tex">\\(f(x) = x^{{{i % 7}}} + \\frac{{{i}}}{{2}}\\)</span> '
+            f'definida para $x &gt; {i}$ e a figura abaixo.</p>'
+        )
+        if i % 5 == 0:
+            parts.append(f'<p><span class="math-tex">\\[\\int_0^{{{i}}} f(x)\\,dx\\]</span></p>')
+        if i % 7 == 0:
+            parts.append(f'<p><img alt="" src="/media/uploads/figura_{i}.png" style="height:120px; width:240px" /></p>')
+        if i % 11 == 0:
+            parts.append(
+                '<table border="1"><tbody><tr><td>a</td><td>\\(a^2\\)</td></tr>'
+                '<tr><td>b</td><td><script type="math/tex; mode=display">b^2</script></td></tr></tbody></table>'
+            )
+    return ''.join(parts)
+
+
+def _measure(func, html: str, repeat: int):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(html)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+class Command(BaseCommand):
+    help = "Compara tempo e memória do reescritor de fórmulas de passada única com a abordagem regex + BeautifulSoup."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paragraphs', type=int, nargs='+', default=[100, 1000, 5000])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        def new_render(html):
+            return rewrite_math(html, lambda fragment: _IMG)
+
+        cases = [
+            ('render (html_render_math_to_img)', _legacy_render, new_render),
+            ('export (convert_ckeditor_math_to_latex)', _legacy_convert, convert_ckeditor_math_to_latex),
+        ]
+        self.stdout.write(f"{'caso':<42} {'parágrafos':>10} {'KiB':>8} {'antes ms':>10} {'depois ms':>10} "
+                          f"{'antes pico KiB':>15} {'depois pico KiB':>16}")
+        for paragraphs in options['paragraphs']:
+            html = _build_document(paragraphs)
+            for label, legacy, current in cases:
+                old_time, old_peak = _measure(legacy, html, options['repeat'])
+                new_time, new_peak = _measure(current, html, options['repeat'])
+                self.stdout.write(
+                    f"{label:<42} {paragraphs:>10} {len(html) / 1024:>8.0f} {old_time * 1000:>10.1f} "
+                    f"{new_time * 1000:>10.1f} {old_peak / 1024:>15.0f} {new_peak / 1024:>16.0f}"
+                )
@@ -0,0 +1,70 @@
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app.exam import PANDOC_READER, build_exam_html, convert_with_subprocess, local_image_files
+from app.management.bench import sample_questions, timings
+from app.pandoc_pool import PandocPool, PandocServerError
+
+
+def _legacy_convert(html: str, out_format: str = 'docx') -> bytes:
+    """Implementação anterior de app.exam._convert_with_pandoc: input.html/output.docx em diretório temporário."""
+    media_root = getattr(settings, 'MEDIA_ROOT', None)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        in_path = os.path.join(tmpdir, 'input.html')
+        out_path = os.path.join(tmpdir, f'output.{out_format}')
+        with open(in_path, 'w', encoding='utf-8') as f:
+            f.write(html)
+        cmd = [getattr(settings, 'PANDOC_BINARY', 'pandoc'), in_path, '-f', PANDOC_READER, '-o', out_path]
+        if media_root:
+            cmd.extend(['--resource-path', media_root])
+        subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        with open(out_path, 'rb') as f:
+            return f.read()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara a latência por exportação DOCX: processo pandoc com arquivos temporários (modelo anterior), "
+        "processo com stdin/stdout e pool de `pandoc server`."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, nargs='+', default=[10, 60])
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--pool-size', type=int, default=2)
+
+    def handle(self, *args, **options):
+        pool = PandocPool(options['pool_size'], binary=getattr(settings, 'PANDOC_BINARY', 'pandoc'))
+        start = time.perf_counter()
+        try:
+            pool.warm_up()
+        except (OSError, PandocServerError) as exc:
+            raise CommandError(f"pandoc server indisponível: {exc} (requer pandoc >= 3)")
+        self.stdout.write(f"Subida da primeira instância do pool: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        self.stdout.write(f"{'modelo':<28} {'questões':>8} {'KiB':>6} {'mediana ms':>11} {'p95 ms':>8} {'mín ms':>8}")
+        try:
+            for total in options['questions']:
+                html = build_exam_html(sample_questions(total), gabarito_option='final_arquivo')
+                files = local_image_files(html)
+                cases = [
+                    ('spawn + arquivos temporários', lambda: _legacy_convert(html)),
+                    ('spawn + stdin/stdout', lambda: convert_with_subprocess(html, 'docx')),
+                    ('pool pandoc server', lambda: pool.convert(html, PANDOC_READER, 'docx', files=files)),
+                ]
+                for label, func in cases:
+                    func()  # aquecimento (cache de disco, instância do pool)
+                    samples = sorted(timings(func, options['repeat']))
+                    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+                    self.stdout.write(
+                        f"{label:<28} {total:>8} {len(html) / 1024:>6.0f} {statistics.median(samples) * 1000:>11.1f} "
+                        f"{p95 * 1000:>8.1f} {samples[0] * 1000:>8.1f}"
+                    )
+        finally:
+            pool.shutdown()
@@ -0,0 +1,49 @@
+import os
+import signal
+import socket
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from app.exports import claim_next, cleanup_export_cache, cleanup_exports, requeue_stale, run_export
+
+
+class Command(BaseCommand):
+    help = "Processa a fila de exportações de provas (ExportacaoProva) fora dos workers web."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Processa as tarefas disponíveis e sai (útil em cron e testes).')
+        parser.add_argument('--poll', type=float, default=getattr(settings, 'EXPORT_WORKER_POLL_INTERVAL', 1.0),
+                            help='Segundos de espera quando a fila está vazia.')
+
+    def handle(self, *args, **options):
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        stopping = []
+        # SIGTERM (docker stop): termina a tarefa atual e sai
+        signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+        cleanup_interval = getattr(settings, 'EXPORT_CLEANUP_INTERVAL', 600)
+        last_cleanup = 0.0
+        processed = 0
+
+        while not stopping:
+            close_old_connections()
+            if time.monotonic() - last_cleanup >= cleanup_interval:
+                requeued, removed, evicted = requeue_stale(), cleanup_exports(), cleanup_export_cache()
+                if requeued or removed or evicted:
+                    self.stdout.write(f"{requeued} tarefas devolvidas à fila, {removed} removidas, "
+                                      f"{evicted} documentos retirados do cache.")
+                last_cleanup = time.monotonic()
+            job = claim_next(worker)
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll'])
+                continue
+            run_export(job)
+            processed += 1
+            job.refresh_from_db()
+            self.stdout.write(f"{job.pk}: {job.get_status_display()} (tentativa {job.tentativas})")
+
+        self.stdout.write(self.style.SUCCESS(f"{processed} tarefas processadas."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from app.models import Conteudo, Geracao
+from app.taxonomy import rebuild_closure
+
+
+class Command(BaseCommand):
+    help = "Reconstrói a tabela de fechamento da hierarquia de conteúdos (após loaddata ou edições diretas no banco)."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            total = rebuild_closure()
+            Geracao.bump(Conteudo.GERACAO)
+        self.stdout.write(self.style.SUCCESS(f"{total} pares ancestral/descendente gravados."))
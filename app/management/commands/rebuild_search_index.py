@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from app.models import Questao
+from app.search import html_to_search_text, refresh_search_index
+
+
+class Command(BaseCommand):
+    help = "Recalcula o texto pesquisável das questões e reconstrói o índice de busca (tsvector ou FTS5)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        pks = []
+        total = 0
+        queryset = Questao.objects.only('id', 'enunciado', 'resposta', 'search_text').order_by('id')
+        for questao in queryset.iterator(chunk_size=chunk_size):
+            total += 1
+            text = html_to_search_text(questao.enunciado, questao.resposta)
+            if text != questao.search_text:
+                Questao.objects.filter(pk=questao.pk).update(search_text=text)
+            pks.append(questao.pk)
+            if len(pks) >= chunk_size:
+                refresh_search_index(Questao, pks)
+                pks = []
+        refresh_search_index(Questao, pks)
+
+        self.stdout.write(self.style.SUCCESS(f"Índice de busca reconstruído para {total} questões."))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from app.models import Conteudo
+from app.taxonomy import question_counts
+
+
+class Command(BaseCommand):
+    help = "Recalcula os contadores de questões de cada conteúdo a partir de app_questao e corrige divergências."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Só lista as divergências, sem gravar.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            expected = question_counts()
+            drift = []
+            for node in Conteudo.objects.select_for_update().only('id', 'nome', *Conteudo.COUNTER_FIELDS):
+                direct, total = expected.get(node.id, (0, 0))
+                if (node.questoes_diretas, node.questoes_total) != (direct, total):
+                    drift.append((node, direct, total))
+
+            for node, direct, total in drift:
+                self.stdout.write(
+                    f"{node.nome} (#{node.id}): diretas {node.questoes_diretas} → {direct}, "
+                    f"total {node.questoes_total} → {total}"
+                )
+                if not options['dry_run']:
+                    Conteudo.objects.filter(pk=node.pk).update(questoes_diretas=direct, questoes_total=total)
+
+        action = "encontradas" if options['dry_run'] else "corrigidas"
+        self.stdout.write(self.style.SUCCESS(f"{len(drift)} divergências {action}."))
@@ -0,0 +1,155 @@
+"""
+Reescritor de fórmulas em HTML do CKEditor em uma única passada linear.
+
+Reconhece as três formas em que as fórmulas aparecem no conteúdo das questões:
+- delimitadores no texto: $...$, $$...$$, \\(...\\), \\[...\\]
+- <span class="math-tex">...</span> (plugin MathJax do CKEditor)
+- <script type="math/tex">...</script> e <script type="math/tex; mode=display">
+
+O HTML não é parseado em árvore: um tokenizador por regex percorre o documento
+uma vez, pula tags/comentários/scripts comuns e só reescreve os trechos de
+fórmula encontrados. Todo o resto é copiado byte a byte.
+"""
+import html as html_lib
+import re
+from typing import Callable, NamedTuple, Optional
+
+_TOKEN_RE = re.compile(
+    r"(?P<comment><!--[\s\S]*?-->)"
+    r"|(?P<tag><(?P<close>/)?(?P<name>[a-zA-Z][a-zA-Z0-9]*)(?P<attrs>[^>]*)>)"
+    r"|(?P<math>\$\$[^<]*?\$\$|\\\[[^<]*?\\\]|\\\([^<]*?\\\)|\$[^<]*?\$)"
+)
+_CLOSE_TAG_RES = {
+    name: re.compile(rf"</{name}\s*>", re.IGNORECASE) for name in ('script', 'style')
+}
+_SPAN_TAG_RE = re.compile(r"<(/?)span\b[^>]*>", re.IGNORECASE)
+_SOLE_CHILD_CLOSE_RE = re.compile(r"</(p|div)\s*>", re.IGNORECASE)
+_CLASS_ATTR_RE = re.compile(r"""\bclass\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.IGNORECASE)
+_TYPE_ATTR_RE = re.compile(r"""\btype\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.IGNORECASE)
+_INNER_TAG_RE = re.compile(r"<[^>]+>")
+
+KINDS = ('delimited', 'span', 'script')
+
+
+class MathFragment(NamedTuple):
+    kind: str          # "delimited", "span" ou "script"
+    source: str        # trecho original do HTML (mantido se o callback devolver None)
+    latex: str         # conteúdo textual (entidades HTML decodificadas), ainda com delimitadores
+    display: bool      # fórmula em bloco ($$, \[ ou mode=display)
+    sole_child: bool   # único filho de um <p>/<div> (usado para decidir bloco na exportação)
+
+
+def strip_math_delimiters(expr: str) -> str:
+    t = expr.strip()
+    if (t.startswith('$$') and t.endswith('$$')):
+        return t[2:-2]
+    if (t.startswith('$') and t.endswith('$')):
+        return t[1:-1]
+    if (t.startswith('\\(') and t.endswith('\\)')):
+        return t[2:-2]
+    if (t.startswith('\\[') and t.endswith('\\]')):
+        return t[2:-2]
+    return t
+
+
+def _attr(pattern, attrs: str) -> str:
+    m = pattern.search(attrs)
+    if not m:
+        return ''
+    return html_lib.unescape(next(g for g in m.groups() if g is not None))
+
+
+def _is_display(latex: str) -> bool:
+    t = latex.strip()
+    return t.startswith('$$') or t.startswith('\\[')
+
+
+def rewrite_math(
+    html: str,
+    replace: Callable[[MathFragment], Optional[str]],
+    kinds=KINDS,
+) -> str:
+    """
+    Chama `replace` para cada fórmula do HTML (na ordem do documento) e substitui o trecho
+    pelo valor retornado; None mantém o trecho original. `kinds` restringe as formas tratadas.
+    """
+    if not html:
+        return html or ""
+
+    out = []
+    last = 0          # fim do último trecho já copiado para `out`
+    pos = 0
+    open_parent_end = -1   # posição logo após o último <p>/<div> de abertura
+    open_parent_name = ''
+    length = len(html)
+    search = _TOKEN_RE.search
+
+    while pos < length:
+        m = search(html, pos)
+        if m is None:
+            break
+        start, end = m.span()
+        fragment = None
+
+        if m.group('tag') is not None:
+            name = m.group('name').lower()
+            closing = m.group('close') is not None
+            if not closing and name in ('p', 'div'):
+                open_parent_end, open_parent_name = end, name
+            elif not closing and name == 'span':
+                if 'span' in kinds and 'math-tex' in _attr(_CLASS_ATTR_RE, m.group('attrs')).split():
+                    # O </span> que fecha este span (spans internos não encerram a fórmula)
+                    close = _matching_span_close(html, end)
+                    if close is not None:
+                        latex = html_lib.unescape(_INNER_TAG_RE.sub('', html[end:close.start()]))
+                        fragment = MathFragment('span', html[start:close.end()], latex, _is_display(latex),
+                                                _is_sole_child(html, start, close.end(), open_parent_end, open_parent_name))
+                        end = close.end()
+                # span comum: continua varrendo o conteúdo
+            elif not closing and name in ('script', 'style'):
+                close = _CLOSE_TAG_RES[name].search(html, end)
+                if close is None:
+                    pos = end
+                    continue
+                if name == 'script':
+                    script_type = _attr(_TYPE_ATTR_RE, m.group('attrs')).lower()
+                    if 'script' in kinds and script_type.startswith('math/tex'):
+                        latex = html_lib.unescape(html[end:close.start()])
+                        fragment = MathFragment('script', html[start:close.end()], latex, 'display' in script_type,
+                                                _is_sole_child(html, start, close.end(), open_parent_end, open_parent_name))
+                # nunca procurar fórmulas dentro de <script>/<style>
+                end = close.end()
+        elif m.group('math') is not None and 'delimited' in kinds:
+            source = m.group('math')
+            fragment = MathFragment('delimited', source, html_lib.unescape(source), _is_display(source),
+                                    _is_sole_child(html, start, end, open_parent_end, open_parent_name))
+
+        if fragment is not None:
+            replacement = replace(fragment)
+            if replacement is not None:
+                out.append(html[last:start])
+                out.append(replacement)
+                last = end
+        pos = end
+
+    if not out:
+        return html
+    out.append(html[last:])
+    return ''.join(out)
+
+
+def _matching_span_close(html: str, pos: int):
+    """</span> que fecha o <span> aberto antes de `pos`, contando spans aninhados."""
+    depth = 1
+    for m in _SPAN_TAG_RE.finditer(html, pos):
+        depth += -1 if m.group(1) else 1
+        if depth == 0:
+            return m
+    return None
+
+
+def _is_sole_child(html: str, start: int, end: int, parent_end: int, parent_name: str) -> bool:
+    if parent_end != start:
+        return False
+    close = _SOLE_CHILD_CLOSE_RE.match(html, end)
+    return close is not None and close.group(1).lower() == parent_name
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.26 on 2026-10-18 14:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_banca'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='questao',
+            name='enunciado_rendered',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='questao',
+            name='enunciado_rendered_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='questao',
+            name='resposta_rendered',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='questao',
+            name='resposta_rendered_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.26 on 2026-10-18 15:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_questao_rendered_html'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='questao',
+            index=models.Index(fields=['ano', 'id'], name='questao_ano_id_idx'),
+        ),
+    ]
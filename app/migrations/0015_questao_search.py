@@ -0,0 +1,104 @@
+# Generated by Django 4.2.26 on 2026-10-18 15:06
+
+import html as html_lib
+import re
+
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+FTS_TABLE = 'app_questao_fts'
+
+# Cópia congelada de app.search.html_to_search_text no momento desta migração (migrações não
+# importam código da aplicação, que continua mudando). As fórmulas são reconhecidas por regex
+# em vez do tokenizador de app.math_rewriter; `manage.py rebuild_search_index` regrava o texto
+# com a lógica atual.
+_MATH_RE = re.compile(
+    r"<script\b[^>]*math/tex[^>]*>[\s\S]*?</script\s*>"
+    r"|<span\b[^>]*\bmath-tex\b[^>]*>[\s\S]*?</span\s*>"
+    r"|\$\$[^<]*?\$\$|\\\[[^<]*?\\\]|\\\([^<]*?\\\)|\$[^<]*?\$",
+    re.IGNORECASE,
+)
+_TAG_RE = re.compile(r"<[^>]+>")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def html_to_search_text(*fragments):
+    parts = []
+    for html in fragments:
+        if not html:
+            continue
+        text = _MATH_RE.sub(' ', html)
+        parts.append(html_lib.unescape(_TAG_RE.sub(' ', text)))
+    return _SPACE_RE.sub(' ', ' '.join(parts)).strip()
+
+
+def create_search_backend(apps, schema_editor):
+    """PostgreSQL: unaccent + configuração pt_unaccent + índice GIN. SQLite: tabela FTS5."""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS unaccent")
+        schema_editor.execute(
+            "DO $$ BEGIN "
+            "IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'pt_unaccent') THEN "
+            "CREATE TEXT SEARCH CONFIGURATION pt_unaccent (COPY = portuguese); "
+            "ALTER TEXT SEARCH CONFIGURATION pt_unaccent "
+            "ALTER MAPPING FOR hword, hword_part, word WITH unaccent, portuguese_stem; "
+            "END IF; END $$"
+        )
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS questao_search_vector_gin ON app_questao USING gin (search_vector)"
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+            "USING fts5(search_text, tokenize='unicode61 remove_diacritics 2')"
+        )
+
+
+def drop_search_backend(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS questao_search_vector_gin")
+        schema_editor.execute("DROP TEXT SEARCH CONFIGURATION IF EXISTS pt_unaccent")
+    elif vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def backfill_search(apps, schema_editor):
+    Questao = apps.get_model('app', 'Questao')
+    for questao in Questao.objects.only('id', 'enunciado', 'resposta').iterator():
+        Questao.objects.filter(pk=questao.pk).update(
+            search_text=html_to_search_text(questao.enunciado, questao.resposta)
+        )
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            "UPDATE app_questao SET search_vector = to_tsvector('pt_unaccent', search_text)"
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(f"DELETE FROM {FTS_TABLE}")
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, search_text) SELECT id, search_text FROM app_questao"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_questao_ano_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='questao',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='questao',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_backend, drop_search_backend),
+        migrations.RunPython(backfill_search, migrations.RunPython.noop),
+    ]
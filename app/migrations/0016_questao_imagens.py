@@ -0,0 +1,136 @@
+# Generated by Django 4.2.26 on 2026-10-18 15:09
+
+import html as html_lib
+import os
+import re
+from urllib.parse import unquote, urlparse
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from PIL import Image
+
+IMAGE_FIELDS = ('enunciado', 'resposta', 'resposta_gabarito')
+MAX_PATH_LENGTH = 500
+
+# Cópia congelada da extração de app.images no momento desta migração (migrações não importam
+# código da aplicação, que continua mudando).
+_IMG_RE = re.compile(r"<img\b([^>]*)>", re.IGNORECASE)
+_ATTR_RE = re.compile(r"""\b(src|width|height|style)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.IGNORECASE)
+_STYLE_SIZE_RE = re.compile(r"\b(width|height)\s*:\s*(\d+)(?:\.\d+)?\s*px", re.IGNORECASE)
+_NUMBER_RE = re.compile(r"^\s*(\d+)")
+
+
+def _attrs(raw):
+    attrs = {}
+    for m in _ATTR_RE.finditer(raw):
+        value = next(g for g in m.groups()[1:] if g is not None)
+        attrs.setdefault(m.group(1).lower(), html_lib.unescape(value))
+    return attrs
+
+
+def _declared_size(attrs):
+    size = {}
+    for name, value in _STYLE_SIZE_RE.findall(attrs.get('style', '')):
+        size.setdefault(name.lower(), int(value))
+    for name in ('width', 'height'):
+        if name not in size and name in attrs:
+            m = _NUMBER_RE.match(attrs[name])
+            if m:
+                size[name] = int(m.group(1))
+    return size.get('width'), size.get('height')
+
+
+def _file_size(rel_path):
+    media_root = getattr(settings, 'MEDIA_ROOT', None)
+    if not media_root:
+        return None, None
+    try:
+        with Image.open(os.path.join(media_root, rel_path)) as image:
+            return image.size
+    except (OSError, ValueError):
+        return None, None
+
+
+def _resolve(src):
+    media_url = getattr(settings, 'MEDIA_URL', '/media/')
+    parsed = urlparse(src)
+    path = parsed.path
+    if parsed.scheme in ('http', 'https') and path.startswith(media_url):
+        return unquote(path[len(media_url):]), True
+    if not parsed.scheme and not parsed.netloc and path.startswith(media_url):
+        return unquote(path[len(media_url):]), True
+    return src[:MAX_PATH_LENGTH], False
+
+
+def has_images(*fragments):
+    return any(fragment and _IMG_RE.search(fragment) for fragment in fragments)
+
+
+def extract_image_refs(html):
+    """(caminho, local, largura, altura) das tags <img>, na ordem do documento e sem repetir caminhos."""
+    refs = []
+    seen = set()
+    for m in _IMG_RE.finditer(html or ''):
+        attrs = _attrs(m.group(1))
+        src = attrs.get('src', '').strip()
+        if not src or src.startswith('data:'):
+            continue
+        caminho, local = _resolve(src)
+        if caminho in seen:
+            continue
+        seen.add(caminho)
+        largura, altura = _declared_size(attrs)
+        if local and largura is None and altura is None:
+            largura, altura = _file_size(caminho)
+        refs.append((caminho, local, largura, altura))
+    return refs
+
+
+def backfill_images(apps, schema_editor):
+    Questao = apps.get_model('app', 'Questao')
+    QuestaoImagem = apps.get_model('app', 'QuestaoImagem')
+    rows = []
+    with_image = []
+    for questao in Questao.objects.only('id', *IMAGE_FIELDS).iterator():
+        if has_images(questao.enunciado, questao.resposta):
+            with_image.append(questao.pk)
+        for field in IMAGE_FIELDS:
+            for caminho, local, largura, altura in extract_image_refs(getattr(questao, field)):
+                rows.append(QuestaoImagem(questao_id=questao.pk, campo=field, caminho=caminho, local=local,
+                                          largura=largura, altura=altura))
+    QuestaoImagem.objects.bulk_create(rows, batch_size=500)
+    for start in range(0, len(with_image), 500):
+        Questao.objects.filter(pk__in=with_image[start:start + 500]).update(has_image=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_questao_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='questao',
+            name='has_image',
+            field=models.BooleanField(db_index=True, default=False, editable=False),
+        ),
+        migrations.CreateModel(
+            name='QuestaoImagem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('campo', models.CharField(max_length=30)),
+                ('caminho', models.CharField(db_index=True, max_length=500)),
+                ('local', models.BooleanField(default=True)),
+                ('largura', models.PositiveIntegerField(blank=True, null=True)),
+                ('altura', models.PositiveIntegerField(blank=True, null=True)),
+                ('questao', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='imagens', to='app.questao')),
+            ],
+            options={
+                'verbose_name': 'Imagem de questão',
+                'verbose_name_plural': 'Imagens de questões',
+            },
+        ),
+        migrations.RunPython(backfill_images, migrations.RunPython.noop),
+    ]
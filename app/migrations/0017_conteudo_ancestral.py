@@ -0,0 +1,44 @@
+# Generated by Django 4.2.26 on 2026-10-18 15:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_closure(apps, schema_editor):
+    # Cópia congelada de app.taxonomy.rebuild_closure (migrações não importam código da aplicação)
+    Conteudo = apps.get_model('app', 'Conteudo')
+    ConteudoAncestral = apps.get_model('app', 'ConteudoAncestral')
+    parents = dict(Conteudo.objects.values_list('id', 'pai_id'))
+    rows = []
+    for node_id in parents:
+        ancestral_id, profundidade = node_id, 0
+        visited = set()
+        while ancestral_id is not None and ancestral_id not in visited:
+            visited.add(ancestral_id)
+            rows.append(ConteudoAncestral(ancestral_id=ancestral_id, descendente_id=node_id, profundidade=profundidade))
+            ancestral_id, profundidade = parents.get(ancestral_id), profundidade + 1
+    ConteudoAncestral.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_questao_imagens'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConteudoAncestral',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('profundidade', models.PositiveSmallIntegerField()),
+                ('ancestral', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendentes_rel', to='app.conteudo')),
+                ('descendente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestrais_rel', to='app.conteudo')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['descendente', 'profundidade'], name='conteudo_desc_prof_idx')],
+                'constraints': [models.UniqueConstraint(fields=('ancestral', 'descendente'), name='conteudo_ancestral_unico')],
+            },
+        ),
+        migrations.RunPython(build_closure, migrations.RunPython.noop),
+    ]
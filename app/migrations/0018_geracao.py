@@ -0,0 +1,24 @@
+# Generated by Django 4.2.26 on 2026-10-18 15:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0017_conteudo_ancestral'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Geracao',
+            fields=[
+                ('nome', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('valor', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Geração de cache',
+                'verbose_name_plural': 'Gerações de cache',
+            },
+        ),
+    ]
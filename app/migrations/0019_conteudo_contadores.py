@@ -0,0 +1,43 @@
+# Generated by Django 4.2.26 on 2026-10-18 15:14
+
+from django.db import migrations, models
+from django.db.models import Count
+
+LEVELS = ('area_id', 'unidade_id', 'topico_id', 'subtopico_id', 'categoria_id')
+
+
+def fill_counters(apps, schema_editor):
+    # Cópia congelada de app.taxonomy.question_counts (migrações não importam código da aplicação)
+    Conteudo = apps.get_model('app', 'Conteudo')
+    Questao = apps.get_model('app', 'Questao')
+    counts = {}
+    for row in Questao.objects.order_by().values(*LEVELS).annotate(total=Count('id')):
+        path = [row[level] for level in LEVELS if row[level] is not None]
+        for depth, node_id in enumerate(path):
+            direct, total = counts.get(node_id, (0, 0))
+            if depth == len(path) - 1:
+                direct += row['total']
+            counts[node_id] = (direct, total + row['total'])
+    for node_id, (direct, total) in counts.items():
+        Conteudo.objects.filter(pk=node_id).update(questoes_diretas=direct, questoes_total=total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0018_geracao'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conteudo',
+            name='questoes_diretas',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='conteudo',
+            name='questoes_total',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
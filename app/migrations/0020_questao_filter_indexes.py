@@ -0,0 +1,30 @@
+# Generated by Django 4.2.26 on 2026-10-18 15:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0019_conteudo_contadores'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='questao',
+            name='has_image',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='questao',
+            index=models.Index(fields=['area', 'id'], name='questao_area_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='questao',
+            index=models.Index(fields=['banca', 'id'], name='questao_banca_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='questao',
+            index=models.Index(condition=models.Q(('has_image', True)), fields=['id'], name='questao_com_imagem_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.26 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0021_exportacao_prova'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='questao',
+            name='atualizado_em',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
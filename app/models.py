@@ -1,5 +1,15 @@
-from django.db import models
+import uuid
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
+from django.contrib.postgres.search import SearchVectorField
+from django.utils import timezone
 from ckeditor_uploader.fields import RichTextUploadingField
+from .utils import html_render_math_to_img, math_render_format, rendered_html_hash
+from .search import html_to_search_text, refresh_search_index, remove_from_search_index
+from .images import extract_image_refs, has_images
 
 class Banca(models.Model):
     """Banca organizadora de concurso/vestibular (ex.: FGV, CESPE, VUNESP)."""
@@ -15,6 +25,47 @@ class Banca(models.Model):
         return f"{self.sigla}" if self.sigla else self.nome
 
 
+class Geracao(models.Model):
+    """
+    Contador de versão (geração) de um conjunto de dados em cache, compartilhado entre os
+    workers pelo banco. Quem escreve incrementa; quem lê compara com a versão do seu cache.
+    """
+    nome = models.CharField(max_length=50, primary_key=True)
+    valor = models.PositiveBigIntegerField(default=0)
+
+    # Incrementos feitos por este processo (força a releitura local sem esperar o intervalo de checagem)
+    _local_bumps = {}
+
+    class Meta:
+        verbose_name = 'Geração de cache'
+        verbose_name_plural = 'Gerações de cache'
+
+    def __str__(self):
+        return f"{self.nome}={self.valor}"
+
+    @classmethod
+    def current(cls, nome: str) -> int:
+        return cls.objects.filter(nome=nome).values_list('valor', flat=True).first() or 0
+
+    @classmethod
+    def current_many(cls, *nomes: str) -> tuple:
+        """Valores de várias gerações numa query só, na ordem de `nomes`."""
+        valores = dict(cls.objects.filter(nome__in=nomes).values_list('nome', 'valor'))
+        return tuple(valores.get(nome, 0) for nome in nomes)
+
+    @classmethod
+    def bump(cls, nome: str):
+        if not cls.objects.filter(nome=nome).update(valor=F('valor') + 1):
+            obj, created = cls.objects.get_or_create(nome=nome, defaults={'valor': 1})
+            if not created:
+                cls.objects.filter(nome=nome).update(valor=F('valor') + 1)
+        cls._local_bumps[nome] = cls._local_bumps.get(nome, 0) + 1
+
+    @classmethod
+    def local_bumps(cls, nome: str) -> int:
+        return cls._local_bumps.get(nome, 0)
+
+
 class Conteudo(models.Model):
     nome = models.CharField(max_length=500)
     pai = models.ForeignKey('self', null=True, blank=True, on_delete=models.PROTECT, related_name='subconteudos')
@@ -28,11 +79,93 @@ class Conteudo(models.Model):
     ]
     tipo = models.CharField(max_length=20, choices=TIPO_CHOICES)
 
+    # Contadores de questões mantidos pelo Questao.save() e pelos sinais de exclusão de Questao:
+    # classificadas diretamente neste nó (nível mais profundo preenchido) e em toda a subárvore.
+    # Ver `reconcile_question_counters`.
+    questoes_diretas = models.PositiveIntegerField(default=0, editable=False)
+    questoes_total = models.PositiveIntegerField(default=0, editable=False)
+    COUNTER_FIELDS = ('questoes_diretas', 'questoes_total')
+
+    # Geração incrementada a cada escrita na árvore (invalida o snapshot de app.taxonomy)
+    GERACAO = 'taxonomia'
+
     def __str__(self):
         if self.pai:
             return f"{self.nome} ({self.get_tipo_display()})"
         return f"{self.nome} ({self.get_tipo_display()})"
 
+    def save(self, *args, **kwargs):
+        # Nó, tabela de fechamento e geração mudam juntos ou não mudam
+        with transaction.atomic():
+            self._save(*args, **kwargs)
+
+    def _save(self, *args, **kwargs):
+        adding = self._state.adding or not self.pk
+        old_pai_id = None
+        if not adding:
+            old_pai_id = Conteudo.objects.filter(pk=self.pk).values_list('pai_id', flat=True).first()
+        if self.pai_id and not adding and ConteudoAncestral.objects.filter(
+                ancestral_id=self.pk, descendente_id=self.pai_id).exists():
+            raise ValueError("Um conteúdo não pode ser movido para dentro da própria subárvore.")
+        if not adding and kwargs.get('update_fields') is None:
+            # Os contadores são mantidos por F() nas questões; não sobrescrever com valores antigos da instância
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+        if adding:
+            ConteudoAncestral.add_leaf(self.pk, self.pai_id)
+        elif old_pai_id != self.pai_id:
+            ConteudoAncestral.move_subtree(self.pk, self.pai_id)
+        Geracao.bump(self.GERACAO)
+
+
+class ConteudoAncestral(models.Model):
+    """
+    Tabela de fechamento (closure table) da hierarquia de Conteudo: uma linha para cada
+    par ancestral/descendente, incluindo o próprio nó (profundidade 0). Mantida no
+    Conteudo.save(); `rebuild_conteudo_closure` reconstrói tudo a partir de `pai`.
+    """
+    ancestral = models.ForeignKey(Conteudo, on_delete=models.CASCADE, related_name='descendentes_rel')
+    descendente = models.ForeignKey(Conteudo, on_delete=models.CASCADE, related_name='ancestrais_rel')
+    profundidade = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ancestral', 'descendente'], name='conteudo_ancestral_unico'),
+        ]
+        indexes = [
+            models.Index(fields=['descendente', 'profundidade'], name='conteudo_desc_prof_idx'),
+        ]
+
+    @classmethod
+    def add_leaf(cls, node_id, pai_id):
+        rows = [cls(ancestral_id=node_id, descendente_id=node_id, profundidade=0)]
+        if pai_id:
+            rows += [
+                cls(ancestral_id=ancestral_id, descendente_id=node_id, profundidade=profundidade + 1)
+                for ancestral_id, profundidade in cls.objects.filter(descendente_id=pai_id)
+                .values_list('ancestral_id', 'profundidade')
+            ]
+        cls.objects.bulk_create(rows)
+
+    @classmethod
+    def move_subtree(cls, node_id, novo_pai_id):
+        """Desliga a subárvore de `node_id` dos ancestrais antigos e a liga aos de `novo_pai_id`."""
+        subtree = list(cls.objects.filter(ancestral_id=node_id).values_list('descendente_id', 'profundidade'))
+        subtree_ids = [descendente_id for descendente_id, _ in subtree]
+        cls.objects.filter(descendente_id__in=subtree_ids).exclude(ancestral_id__in=subtree_ids).delete()
+        if novo_pai_id:
+            ancestrais = cls.objects.filter(descendente_id=novo_pai_id).values_list('ancestral_id', 'profundidade')
+            cls.objects.bulk_create([
+                cls(ancestral_id=ancestral_id, descendente_id=descendente_id,
+                    profundidade=profundidade_a + profundidade_d + 1)
+                for ancestral_id, profundidade_a in ancestrais
+                for descendente_id, profundidade_d in subtree
+            ])
+
+
 class Questao(models.Model):
     area = models.ForeignKey('Conteudo', on_delete=models.PROTECT, related_name='q_area')
     unidade = models.ForeignKey('Conteudo', on_delete=models.PROTECT, related_name='q_unidade', null=True, blank=True)
@@ -55,3 +188,250 @@ class Questao(models.Model):
     enunciado = RichTextUploadingField('Enunciado')
     resposta = RichTextUploadingField('Resposta')
     resposta_gabarito = RichTextUploadingField('Resposta Gabarito', blank=True, null=True)
+
+    # HTML com as fórmulas já renderizadas, gravado no save() e validado pelo hash do campo-fonte
+    enunciado_rendered = models.TextField(blank=True, default='', editable=False)
+    enunciado_rendered_hash = models.CharField(max_length=64, blank=True, default='', editable=False)
+    resposta_rendered = models.TextField(blank=True, default='', editable=False)
+    resposta_rendered_hash = models.CharField(max_length=64, blank=True, default='', editable=False)
+
+    # Texto puro (sem HTML/LaTeX) de enunciado + resposta e seu tsvector (PostgreSQL); ver app.search
+    search_text = models.TextField(blank=True, default='', editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    # Há <img> no enunciado ou na resposta (filtro tem_imagem); as referências ficam em QuestaoImagem
+    has_image = models.BooleanField(default=False, editable=False)
+
+    # Versão da linha: entra na chave do detalhe em cache da API (app.views.questions)
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # Escolhidos pelos filtros mais usados nas listagens, sempre com `id` no fim para servir
+        # o ORDER BY -id padrão sem ordenação extra. Colunas de baixa cardinalidade (tipo_questao,
+        # dificuldade, grau_escolaridade) ficam de fora: o planner prefere varrer a tabela.
+        # Cobertura verificada por QuestaoQueryPlanTests (EXPLAIN).
+        indexes = [
+            # Filtro por ano e ordenação ?ordering=ano/-ano da paginação por cursor
+            models.Index(fields=['ano', 'id'], name='questao_ano_id_idx'),
+            # Listagem por área (link da página inicial); com unidade/tópico o filtro da árvore
+            # (area_selection_q) parte deste mesmo índice
+            models.Index(fields=['area', 'id'], name='questao_area_id_idx'),
+            # Filtro por banca (com ano, o planner combina com questao_ano_id_idx)
+            models.Index(fields=['banca', 'id'], name='questao_banca_id_idx'),
+            # tem_imagem=true: índice parcial só com as questões com imagem (minoria); substitui o
+            # índice simples de has_image, que o SQLite não usa para `WHERE has_image`
+            models.Index(fields=['id'], condition=models.Q(has_image=True), name='questao_com_imagem_idx'),
+        ]
+
+    RENDERED_FIELDS = ('enunciado', 'resposta')
+    # Ordenações aceitas nas listagens (?ordering= da API, ?order_by= da página): todas servidas
+    # por índice e desempatadas por id
+    ORDERINGS = {
+        '-id': ('-id',),
+        'id': ('id',),
+        '-ano': ('-ano', '-id'),
+        'ano': ('ano', 'id'),
+    }
+    # FKs para Conteudo; usar em select_related para evitar uma query por nível em cada questão
+    TAXONOMY_FIELDS = ('area', 'unidade', 'topico', 'subtopico', 'categoria')
+    # Colunas de texto rico necessárias para cada campo da API (as demais podem ser adiadas no SQL)
+    RICH_TEXT_COLUMNS = {
+        'enunciado': ('enunciado',),
+        'resposta': ('resposta',),
+        'resposta_gabarito': ('resposta_gabarito',),
+        'enunciado_rendered': ('enunciado', 'enunciado_rendered', 'enunciado_rendered_hash'),
+        'resposta_rendered': ('resposta', 'resposta_rendered', 'resposta_rendered_hash'),
+    }
+    # Colunas usadas só pela busca, nunca serializadas
+    SEARCH_COLUMNS = ('search_text', 'search_vector')
+    # Geração incrementada a cada escrita em questões (contagens e caches derivados de app_questao)
+    GERACAO = 'questoes'
+    # Campos cujas imagens são registradas em QuestaoImagem (has_image considera só enunciado/resposta)
+    IMAGE_FIELDS = ('enunciado', 'resposta', 'resposta_gabarito')
+
+    def rendered_is_stale(self, field: str) -> bool:
+        return getattr(self, f'{field}_rendered_hash') != rendered_html_hash(getattr(self, field) or '')
+
+    def _refresh_rendered(self, field: str) -> bool:
+        """Re-renderiza `<field>_rendered` se o hash do campo-fonte mudou. Retorna True se atualizou."""
+        if not self.rendered_is_stale(field):
+            return False
+        source = getattr(self, field) or ''
+        setattr(self, f'{field}_rendered', html_render_math_to_img(source))
+        setattr(self, f'{field}_rendered_hash', rendered_html_hash(source))
+        return True
+
+    def get_rendered(self, field: str, skip_keys=None, fmt: str = None) -> str:
+        """
+        Retorna o HTML renderizado armazenado. Se estiver desatualizado (hash diferente),
+        renderiza de novo e persiste sem disparar um save() completo.
+        Com `skip_keys` (fórmulas que não ficaram prontas no lote) o resultado é parcial e não é persistido.
+        Um `fmt` diferente do padrão (MATH_RENDER_FORMAT) é renderizado a partir do cache de fórmulas.
+        """
+        if fmt and fmt != math_render_format():
+            return html_render_math_to_img(getattr(self, field) or '', skip_keys=skip_keys, fmt=fmt)
+        if skip_keys and self.rendered_is_stale(field):
+            return html_render_math_to_img(getattr(self, field) or '', skip_keys=skip_keys)
+        if self._refresh_rendered(field) and self.pk:
+            Questao.objects.filter(pk=self.pk).update(**{
+                f'{field}_rendered': getattr(self, f'{field}_rendered'),
+                f'{field}_rendered_hash': getattr(self, f'{field}_rendered_hash'),
+            })
+        return getattr(self, f'{field}_rendered')
+
+    def refresh_image_refs(self):
+        """Regrava as linhas de QuestaoImagem a partir do HTML atual."""
+        rows = [
+            QuestaoImagem(questao=self, campo=field, caminho=ref.caminho, local=ref.local,
+                          largura=ref.largura, altura=ref.altura)
+            for field in self.IMAGE_FIELDS
+            for ref in extract_image_refs(getattr(self, field) or '')
+        ]
+        QuestaoImagem.objects.filter(questao=self).delete()
+        QuestaoImagem.objects.bulk_create(rows)
+
+    def taxonomy_path(self) -> list:
+        """Ids de Conteudo da área até o nível mais profundo preenchido."""
+        return [node_id for node_id in (getattr(self, f'{level}_id') for level in self.TAXONOMY_FIELDS) if node_id]
+
+    @staticmethod
+    def _move_counters(old_path: list, new_path: list):
+        """Ajusta os contadores de Conteudo quando a questão sai de `old_path` e entra em `new_path`."""
+        removed = set(old_path) - set(new_path)
+        added = set(new_path) - set(old_path)
+        if removed:
+            Conteudo.objects.filter(pk__in=removed).update(questoes_total=F('questoes_total') - 1)
+        if added:
+            Conteudo.objects.filter(pk__in=added).update(questoes_total=F('questoes_total') + 1)
+        old_leaf = old_path[-1] if old_path else None
+        new_leaf = new_path[-1] if new_path else None
+        if old_leaf != new_leaf:
+            if old_leaf:
+                Conteudo.objects.filter(pk=old_leaf).update(questoes_diretas=F('questoes_diretas') - 1)
+            if new_leaf:
+                Conteudo.objects.filter(pk=new_leaf).update(questoes_diretas=F('questoes_diretas') + 1)
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            self._save(*args, **kwargs)
+
+    def _save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        adding = self._state.adding or not self.pk
+        old_path = []
+        if not adding and (update_fields is None or {
+                name for level in self.TAXONOMY_FIELDS for name in (level, f'{level}_id')} & set(update_fields)):
+            row = Questao.objects.filter(pk=self.pk).values_list(
+                *(f'{level}_id' for level in self.TAXONOMY_FIELDS)).first()
+            old_path = [node_id for node_id in row or () if node_id]
+            adding = row is None
+        changed = [field for field in self.RENDERED_FIELDS if self._refresh_rendered(field)]
+        self.search_text = html_to_search_text(self.enunciado, self.resposta)
+        self.has_image = has_images(self.enunciado, self.resposta)
+        if update_fields is not None:
+            update_fields = list(update_fields)
+            update_fields += [f'{field}{suffix}' for field in changed for suffix in ('_rendered', '_rendered_hash')]
+            if set(self.RENDERED_FIELDS) & set(update_fields):
+                update_fields += ['search_text', 'has_image']
+            update_fields.append('atualizado_em')
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+        if update_fields is None or 'search_text' in update_fields:
+            refresh_search_index(Questao, [self.pk])
+        if update_fields is None or set(self.IMAGE_FIELDS) & set(update_fields):
+            self.refresh_image_refs()
+        if adding:
+            self._move_counters([], self.taxonomy_path())
+        elif old_path:
+            self._move_counters(old_path, self.taxonomy_path())
+        Geracao.bump(self.GERACAO)
+
+
+
+# Exclusões passam por sinais, não por delete() no modelo: QuerySet.delete() (ex.: a ação "excluir
+# selecionados" do admin) não chama o delete() do modelo, mas dispara pre/post_delete por objeto,
+# dentro da mesma transação da exclusão.
+
+@receiver(post_delete, sender=Conteudo)
+def _conteudo_post_delete(sender, instance, **kwargs):
+    Geracao.bump(Conteudo.GERACAO)
+
+
+@receiver(pre_delete, sender=Questao)
+def _questao_pre_delete(sender, instance, **kwargs):
+    # Classificação lida do banco: a instância em memória pode ter sido alterada sem save()
+    path = Questao.objects.filter(pk=instance.pk).values_list(
+        *(f'{level}_id' for level in Questao.TAXONOMY_FIELDS)).first()
+    if path:
+        Questao._move_counters([node_id for node_id in path if node_id], [])
+
+
+@receiver(post_delete, sender=Questao)
+def _questao_post_delete(sender, instance, **kwargs):
+    remove_from_search_index([instance.pk])
+    Geracao.bump(Questao.GERACAO)
+
+
+class QuestaoImagem(models.Model):
+    """Imagem referenciada por um campo de texto rico de uma questão (gravada no Questao.save())."""
+    questao = models.ForeignKey(Questao, on_delete=models.CASCADE, related_name='imagens')
+    campo = models.CharField(max_length=30)
+    # Caminho relativo a MEDIA_ROOT (local=True) ou URL externa
+    caminho = models.CharField(max_length=500, db_index=True)
+    local = models.BooleanField(default=True)
+    largura = models.PositiveIntegerField(null=True, blank=True)
+    altura = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Imagem de questão'
+        verbose_name_plural = 'Imagens de questões'
+
+    def __str__(self):
+        return f"{self.caminho} (questão {self.questao_id}, {self.campo})"
+
+
+class ExportacaoProva(models.Model):
+    """
+    Geração assíncrona de prova (DOCX). A view só cria a tarefa; o comando
+    `export_worker` a executa fora do ciclo da requisição (ver app.exports; sem worker,
+    a consulta de status acaba gerando a tarefa).
+    """
+    PENDENTE = 'pendente'
+    EXECUTANDO = 'executando'
+    CONCLUIDA = 'concluida'
+    FALHOU = 'falhou'
+    STATUS_CHOICES = [
+        (PENDENTE, 'Pendente'),
+        (EXECUTANDO, 'Executando'),
+        (CONCLUIDA, 'Concluída'),
+        (FALHOU, 'Falhou'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.CASCADE,
+                                related_name='exportacoes')
+    # Opções normalizadas por app.exports.export_options (question_ids, gabarito_option, test_name, ...)
+    parametros = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDENTE)
+    progresso = models.PositiveSmallIntegerField(default=0)
+    tentativas = models.PositiveSmallIntegerField(default=0)
+    erro = models.TextField(blank=True)
+    # Caminho relativo a EXPORT_JOBS_DIR (fora de MEDIA_ROOT: não é servido publicamente)
+    arquivo = models.CharField(max_length=500, blank=True)
+    nome_arquivo = models.CharField(max_length=255)
+    worker = models.CharField(max_length=100, blank=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    # Próxima tentativa não antes deste instante (espera entre retentativas)
+    disponivel_em = models.DateTimeField(default=timezone.now)
+    iniciado_em = models.DateTimeField(null=True, blank=True)
+    concluido_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Exportação de prova'
+        verbose_name_plural = 'Exportações de provas'
+        indexes = [
+            models.Index(fields=['status', 'disponivel_em'], name='exportacao_fila_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.nome_arquivo} ({self.get_status_display()})"
@@ -0,0 +1,302 @@
+"""
+LaTeX → OMML (Office Math Markup Language), para o motor de exportação python-docx.
+
+Cobre o subconjunto que aparece nas questões: frações, raízes, índices/expoentes,
+somatórios/produtórios/integrais com limites, \\left...\\right, acentos, funções
+(\\sin, \\log, \\lim...), \\text/\\mathrm/\\mathbf, \\mathbb, letras gregas e os
+operadores e setas usuais. Qualquer outra coisa (ambientes \\begin{...}, comandos
+desconhecidos) levanta `UnsupportedLatex`, e a exportação volta para o pandoc.
+"""
+import re
+
+from lxml import etree
+
+M_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/math'
+_XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+
+_TOKEN_RE = re.compile(r"\\[a-zA-Z]+|\\.|\s+|.", re.DOTALL)
+
+
+class UnsupportedLatex(ValueError):
+    pass
+
+
+SYMBOLS = {
+    # Letras gregas
+    'alpha': 'α', 'beta': 'β', 'gamma': 'γ', 'delta': 'δ', 'epsilon': 'ϵ', 'varepsilon': 'ε',
+    'zeta': 'ζ', 'eta': 'η', 'theta': 'θ', 'vartheta': 'ϑ', 'iota': 'ι', 'kappa': 'κ',
+    'lambda': 'λ', 'mu': 'μ', 'nu': 'ν', 'xi': 'ξ', 'pi': 'π', 'varpi': 'ϖ', 'rho': 'ρ',
+    'varrho': 'ϱ', 'sigma': 'σ', 'varsigma': 'ς', 'tau': 'τ', 'upsilon': 'υ', 'phi': 'ϕ',
+    'varphi': 'φ', 'chi': 'χ', 'psi': 'ψ', 'omega': 'ω',
+    'Gamma': 'Γ', 'Delta': 'Δ', 'Theta': 'Θ', 'Lambda': 'Λ', 'Xi': 'Ξ', 'Pi': 'Π',
+    'Sigma': 'Σ', 'Upsilon': 'Υ', 'Phi': 'Φ', 'Psi': 'Ψ', 'Omega': 'Ω',
+    # Operadores e relações
+    'cdot': '⋅', 'times': '×', 'div': '÷', 'pm': '±', 'mp': '∓', 'ast': '∗', 'star': '⋆',
+    'leq': '≤', 'le': '≤', 'geq': '≥', 'ge': '≥', 'neq': '≠', 'ne': '≠', 'approx': '≈',
+    'equiv': '≡', 'sim': '∼', 'simeq': '≃', 'cong': '≅', 'propto': '∝', 'll': '≪', 'gg': '≫',
+    'in': '∈', 'notin': '∉', 'ni': '∋', 'subset': '⊂', 'subseteq': '⊆', 'supset': '⊃',
+    'supseteq': '⊇', 'cup': '∪', 'cap': '∩', 'setminus': '∖', 'emptyset': '∅', 'varnothing': '∅',
+    'forall': '∀', 'exists': '∃', 'neg': '¬', 'lnot': '¬', 'land': '∧', 'wedge': '∧',
+    'lor': '∨', 'vee': '∨', 'perp': '⊥', 'parallel': '∥', 'mid': '∣', 'angle': '∠',
+    'triangle': '△', 'circ': '∘', 'bullet': '∙', 'degree': '°', 'prime': '′',
+    'infty': '∞', 'partial': '∂', 'nabla': '∇', 'hbar': 'ℏ', 'ell': 'ℓ',
+    # Setas
+    'to': '→', 'rightarrow': '→', 'leftarrow': '←', 'gets': '←', 'leftrightarrow': '↔',
+    'Rightarrow': '⇒', 'Leftarrow': '⇐', 'Leftrightarrow': '⇔', 'iff': '⇔', 'implies': '⇒',
+    'mapsto': '↦', 'uparrow': '↑', 'downarrow': '↓', 'longrightarrow': '⟶',
+    # Pontos e delimitadores
+    'ldots': '…', 'dots': '…', 'cdots': '⋯', 'vdots': '⋮', 'ddots': '⋱',
+    'langle': '⟨', 'rangle': '⟩', 'lfloor': '⌊', 'rfloor': '⌋', 'lceil': '⌈', 'rceil': '⌉',
+    'vert': '|', 'Vert': '‖', 'lbrace': '{', 'rbrace': '}',
+}
+# Espaços (\, \; \quad ...) viram espaços comuns; \! some
+SPACES = {',': ' ', ':': ' ', ';': ' ', ' ': ' ', '!': '', 'quad': ' ', 'qquad': '  '}
+# Caracteres escapados com barra (\{ \% ...)
+ESCAPED = {'{': '{', '}': '}', '%': '%', '$': '$', '&': '&', '#': '#', '_': '_', '|': '‖'}
+# Operadores n-ários: caractere e posição dos limites
+NARY = {
+    'sum': ('∑', 'undOvr'), 'prod': ('∏', 'undOvr'), 'coprod': ('∐', 'undOvr'),
+    'bigcup': ('⋃', 'undOvr'), 'bigcap': ('⋂', 'undOvr'),
+    'int': ('∫', 'subSup'), 'iint': ('∬', 'subSup'), 'iiint': ('∭', 'subSup'), 'oint': ('∮', 'subSup'),
+}
+FUNCTIONS = {'sin', 'cos', 'tan', 'cot', 'sec', 'csc', 'arcsin', 'arccos', 'arctan', 'sinh', 'cosh',
+             'tanh', 'log', 'ln', 'lg', 'exp', 'det', 'dim', 'ker', 'deg', 'gcd', 'arg', 'mod'}
+# Funções cujos índices ficam embaixo (\lim_{x\to 0})
+LIMIT_FUNCTIONS = {'lim', 'max', 'min', 'sup', 'inf', 'limsup', 'liminf'}
+ACCENTS = {'hat': '̂', 'widehat': '̂', 'tilde': '̃', 'widetilde': '̃',
+           'vec': '⃗', 'dot': '̇', 'ddot': '̈', 'acute': '́', 'grave': '̀',
+           'check': '̌', 'breve': '̆'}
+BLACKBOARD = {'R': 'ℝ', 'N': 'ℕ', 'Z': 'ℤ', 'Q': 'ℚ', 'C': 'ℂ', 'P': 'ℙ', 'H': 'ℍ'}
+# Comandos só de apresentação, sem efeito no OMML
+IGNORED = {'displaystyle', 'textstyle', 'limits', 'nolimits', 'left.', 'right.', 'big', 'Big',
+           'bigg', 'Bigg', 'bigl', 'bigr', 'Bigl', 'Bigr'}
+FRACTIONS = {'frac', 'dfrac', 'tfrac', 'cfrac'}
+TEXT_STYLES = {'text': None, 'textrm': None, 'mathrm': 'p', 'operatorname': 'p', 'textbf': 'b',
+               'mathbf': 'b', 'textit': 'i', 'mathit': 'i', 'boldsymbol': 'bi'}
+
+
+def _m(tag: str, *children, **attrs):
+    element = etree.Element(f'{{{M_NS}}}{tag}')
+    for name, value in attrs.items():
+        element.set(f'{{{M_NS}}}{name}', value)
+    for child in children:
+        element.append(child)
+    return element
+
+
+def _prop(tag: str, value: str):
+    return _m(tag, val=value)
+
+
+def _container(tag: str, items):
+    element = _m(tag)
+    for item in items:
+        element.append(item)
+    return element
+
+
+def _run(text: str, style: str = None):
+    run = _m('r')
+    if style:
+        run.append(_m('rPr', _prop('sty', style)))
+    t = _m('t')
+    t.text = text
+    t.set(_XML_SPACE, 'preserve')
+    run.append(t)
+    return run
+
+
+class _Parser:
+    def __init__(self, latex: str):
+        self.tokens = _TOKEN_RE.findall(latex)
+        self.pos = 0
+
+    def peek(self, skip_spaces=True):
+        pos = self.pos
+        while skip_spaces and pos < len(self.tokens) and self.tokens[pos].isspace():
+            pos += 1
+        return self.tokens[pos] if pos < len(self.tokens) else None
+
+    def next(self, skip_spaces=True):
+        while skip_spaces and self.pos < len(self.tokens) and self.tokens[self.pos].isspace():
+            self.pos += 1
+        if self.pos >= len(self.tokens):
+            raise UnsupportedLatex("fim inesperado da fórmula")
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def expect(self, token):
+        found = self.next()
+        if found != token:
+            raise UnsupportedLatex(f"esperado {token!r}, encontrado {found!r}")
+
+    # Gramática ------------------------------------------------------------
+
+    def parse_expr(self, stop=None) -> list:
+        """Elementos até `stop` (consumido) ou até o fim da fórmula."""
+        items = []
+        while True:
+            token = self.peek()
+            if token is None:
+                if stop is not None:
+                    raise UnsupportedLatex(f"{stop!r} não fechado")
+                return items
+            if token == stop:
+                self.next()
+                return items
+            if token in ('}', '&', '\\\\') or token == '\\right':
+                raise UnsupportedLatex(f"{token!r} inesperado")
+            self.next()
+            if token in ('^', '_'):
+                base = items.pop() if items else None
+                items.append(self._scripts(base, token))
+            elif token[1:] in NARY and token.startswith('\\'):
+                # O operando de ∑/∫ é o resto do grupo atual
+                nary = self._nary(token[1:])
+                nary.append(_container('e', self.parse_expr(stop)))
+                items.append(nary)
+                return items
+            else:
+                items.extend(self._atom(token))
+
+    def parse_arg(self) -> list:
+        """Argumento de comando/índice: {grupo} ou um único token."""
+        token = self.next()
+        if token == '{':
+            return self.parse_expr('}')
+        if token in ('}', '^', '_', '&'):
+            raise UnsupportedLatex(f"argumento inválido {token!r}")
+        return self._atom(token)
+
+    def _optional_arg(self):
+        if self.peek() != '[':
+            return None
+        self.next()
+        return self.parse_expr(']')
+
+    def _scripts(self, base, first) -> etree._Element:
+        scripts = {first: self.parse_arg()}
+        other = '_' if first == '^' else '^'
+        if self.peek() == other:
+            self.next()
+            scripts[other] = self.parse_arg()
+        e = _container('e', [base] if base is not None else [])
+        if '^' in scripts and '_' in scripts:
+            return _m('sSubSup', e, _container('sub', scripts['_']), _container('sup', scripts['^']))
+        if '^' in scripts:
+            return _m('sSup', e, _container('sup', scripts['^']))
+        return _m('sSub', e, _container('sub', scripts['_']))
+
+    def _nary(self, name: str) -> etree._Element:
+        char, location = NARY[name]
+        limits = {}
+        while self.peek() in ('^', '_', '\\limits', '\\nolimits', '\\displaystyle'):
+            token = self.next()
+            if token in ('^', '_'):
+                limits[token] = self.parse_arg()
+        props = _m('naryPr', _prop('chr', char), _prop('limLoc', location))
+        if '_' not in limits:
+            props.append(_prop('subHide', '1'))
+        if '^' not in limits:
+            props.append(_prop('supHide', '1'))
+        return _m('nary', props, _container('sub', limits.get('_', [])), _container('sup', limits.get('^', [])))
+
+    def _delimiter(self) -> str:
+        token = self.next()
+        if token == '.':
+            return ''
+        if token.startswith('\\'):
+            name = token[1:]
+            if name in ESCAPED:
+                return ESCAPED[name]
+            if name in SYMBOLS:
+                return SYMBOLS[name]
+            raise UnsupportedLatex(f"delimitador {token!r}")
+        return token
+
+    def _text_group(self) -> str:
+        """Conteúdo literal de \\text{...} (espaços preservados, sem comandos)."""
+        self.expect('{')
+        depth, parts = 1, []
+        while True:
+            token = self.next(skip_spaces=False)
+            if token == '{':
+                depth += 1
+            elif token == '}':
+                depth -= 1
+                if depth == 0:
+                    return ''.join(parts)
+            elif token.startswith('\\') and len(token) == 2 and token[1] in ESCAPED:
+                token = ESCAPED[token[1]]
+            elif token.startswith('\\') and token[1:] in SPACES:
+                token = ' '
+            elif token.startswith('\\'):
+                raise UnsupportedLatex(f"comando {token!r} dentro de texto")
+            parts.append(token)
+
+    def _atom(self, token: str) -> list:
+        if token == '{':
+            # Grupo: conta como um único elemento para o índice seguinte
+            items = self.parse_expr('}')
+            return [items[0]] if len(items) == 1 else ([_m('box', _container('e', items))] if items else [])
+        if token == "'":
+            return [_run('′')]
+        if not token.startswith('\\'):
+            return [_run(token)]
+        name = token[1:]
+        if name in SPACES:
+            return [_run(SPACES[name])] if SPACES[name] else []
+        if name in ESCAPED:
+            return [_run(ESCAPED[name])]
+        if name in SYMBOLS:
+            return [_run(SYMBOLS[name])]
+        if name in IGNORED:
+            return []
+        if name in FRACTIONS:
+            num, den = self.parse_arg(), self.parse_arg()
+            return [_m('f', _container('num', num), _container('den', den))]
+        if name == 'binom':
+            top, bottom = self.parse_arg(), self.parse_arg()
+            fraction = _m('f', _m('fPr', _prop('type', 'noBar')), _container('num', top), _container('den', bottom))
+            return [_m('d', _m('dPr', _prop('begChr', '('), _prop('endChr', ')')), _container('e', [fraction]))]
+        if name == 'sqrt':
+            degree = self._optional_arg()
+            body = self.parse_arg()
+            if degree is None:
+                return [_m('rad', _m('radPr', _prop('degHide', '1')), _m('deg'), _container('e', body))]
+            return [_m('rad', _m('radPr'), _container('deg', degree), _container('e', body))]
+        if name == 'left':
+            begin = self._delimiter()
+            body = self.parse_expr('\\right')
+            end = self._delimiter()
+            return [_m('d', _m('dPr', _prop('begChr', begin), _prop('endChr', end)), _container('e', body))]
+        if name in ACCENTS:
+            return [_m('acc', _m('accPr', _prop('chr', ACCENTS[name])), _container('e', self.parse_arg()))]
+        if name in ('overline', 'bar'):
+            return [_m('bar', _m('barPr', _prop('pos', 'top')), _container('e', self.parse_arg()))]
+        if name == 'underline':
+            return [_m('bar', _m('barPr', _prop('pos', 'bot')), _container('e', self.parse_arg()))]
+        if name in ('mathbb', 'Bbb'):
+            letters = self._text_group()
+            return [_run(''.join(BLACKBOARD.get(ch, ch) for ch in letters))]
+        if name in TEXT_STYLES:
+            style = TEXT_STYLES[name] or 'p'
+            return [_run(self._text_group(), style=style)]
+        if name in FUNCTIONS:
+            return [_run(name, style='p')]
+        if name in LIMIT_FUNCTIONS:
+            if self.peek() == '_':
+                self.next()
+                return [_m('limLow', _container('e', [_run(name, style='p')]), _container('lim', self.parse_arg()))]
+            return [_run(name, style='p')]
+        raise UnsupportedLatex(f"comando não suportado: {token}")
+
+
+def latex_to_omml(latex: str, display: bool = False) -> etree._Element:
+    """<m:oMath> (ou <m:oMathPara> com `display`) para a fórmula LaTeX, sem delimitadores."""
+    parser = _Parser(latex)
+    math = _container('oMath', parser.parse_expr())
+    if display:
+        return _m('oMathPara', math)
+    return math
@@ -0,0 +1,124 @@
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from app.models import Questao
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination, _reverse_ordering
+
+
+class QuestaoCursorPagination(CursorPagination):
+    """
+    Paginação por cursor (keyset) para /api/questoes/.
+    Não executa COUNT(*) e mantém a ordem estável sobre chaves indexadas (id, ano+id).
+
+    O cursor guarda a posição completa na ordenação (ano+id, relevância+id), e a página
+    seguinte filtra por (k1, id) depois dessa posição. O CursorPagination padrão só usa a
+    primeira coluna e desempata com um offset limitado a `offset_cutoff` (1000): com mais
+    de 1000 questões do mesmo ano (ou com a mesma relevância) a paginação entraria em loop.
+    """
+    page_size = getattr(settings, 'QUESTOES_PAGE_SIZE', 20)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'QUESTOES_MAX_PAGE_SIZE', 100)
+    ordering = ('-id',)
+    ordering_query_param = 'ordering'
+
+    # Ordenações aceitas em ?ordering= (todas cobertas por índice e desempatadas por id)
+    ORDERINGS = Questao.ORDERINGS
+
+    # Com ?search= e sem ?ordering= explícito, os resultados vêm por relevância
+    SEARCH_ORDERING = ('-search_rank', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        requested = request.query_params.get(self.ordering_query_param)
+        if requested is None and 'search_rank' in queryset.query.annotations:
+            return self.SEARCH_ORDERING
+        return self.ORDERINGS.get(requested, self.ordering)
+
+    def _get_position_from_instance(self, instance, ordering):
+        names = [field.lstrip('-') for field in ordering]
+        if isinstance(instance, dict):
+            values = [instance[name] for name in names]
+        else:
+            values = [getattr(instance, name) for name in names]
+        return json.dumps(values, separators=(',', ':'))
+
+    def _keyset_filter(self, position: str, reverse: bool) -> Q:
+        """Questões estritamente depois de `position` (todas as chaves da ordenação) no sentido pedido."""
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if (not isinstance(values, list) or len(values) != len(self.ordering)
+                or not all(isinstance(value, (int, float, str)) for value in values)):
+            raise NotFound(self.invalid_cursor_message)
+        # (a, b) > (x, y)  ⇔  a > x  OU  (a = x E b > y)
+        condition, equal = Q(), {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if reverse != field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # Mesmo fluxo de CursorPagination.paginate_queryset, com o filtro pela posição completa
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (offset, reverse, current_position) = (0, False, None)
+        else:
+            (offset, reverse, current_position) = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if current_position is not None:
+            queryset = queryset.filter(self._keyset_filter(current_position, reverse))
+
+        # A posição é única, então o offset é sempre 0 nos cursores gerados aqui
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = list(results[:self.page_size])
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (current_position is not None) or (offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+
+class QuestaoPageNumberPagination(PageNumberPagination):
+    """
+    Paginação por número de página (?page=), mantida para o frontend atual,
+    que ainda navega por páginas e usa o campo `count`.
+    """
+    page_size = getattr(settings, 'QUESTOES_PAGE_SIZE', 20)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'QUESTOES_MAX_PAGE_SIZE', 100)
@@ -0,0 +1,268 @@
+"""
+Pool de conversores pandoc de longa duração (`pandoc server`), por processo.
+
+Disparar `pandoc` a cada exportação paga a inicialização do runtime Haskell e da
+docx de referência toda vez. Aqui cada processo (worker do gunicorn ou export_worker)
+mantém até PANDOC_POOL_SIZE instâncias de `pandoc server` escutando em 127.0.0.1:
+
+- a conversão é um POST com o HTML no corpo e o DOCX na resposta (sem arquivos
+  temporários); as imagens locais vão junto, em base64, porque o servidor não lê o disco;
+- no máximo PANDOC_POOL_SIZE conversões simultâneas: quem chega com o pool cheio espera
+  até PANDOC_POOL_ACQUIRE_TIMEOUT segundos por uma instância livre;
+- cada instância tem checagem de saúde (processo vivo + GET /version a cada
+  PANDOC_HEALTH_INTERVAL segundos) e é recriada quando falha.
+
+O tamanho vale por processo: com 3 workers do gunicorn e um export_worker rodam até
+4 × PANDOC_POOL_SIZE instâncias (cada uma com a memória de um pandoc).
+
+Se o pandoc instalado não tiver o modo servidor (pandoc < 3) ou o pool não subir,
+`get_pandoc_pool()` devolve None e a conversão volta a disparar um processo por
+exportação; nova tentativa de subir o pool após PANDOC_POOL_RETRY_INTERVAL segundos,
+intervalo que dobra a cada falha seguida (até PANDOC_POOL_RETRY_MAX).
+
+O ganho em relação a um processo por exportação não foi medido neste repositório
+(sem pandoc no ambiente de desenvolvimento); `manage.py bench_pandoc` compara os
+caminhos onde houver pandoc >= 3.
+"""
+import atexit
+import base64
+import http.client
+import json
+import logging
+import os
+import queue
+import socket
+import subprocess
+import threading
+import time
+from typing import Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PandocServerError(RuntimeError):
+    pass
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class PandocServer:
+    """Uma instância de `pandoc server` ligada a uma porta local."""
+
+    def __init__(self, binary: str = 'pandoc', request_timeout: float = 120):
+        self.binary = binary
+        self.request_timeout = request_timeout
+        self.port = None
+        self.process = None
+        self.checked_at = 0.0
+
+    def _request(self, method: str, path: str, body: bytes = None, headers=None, timeout: float = 5):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=timeout)
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+    def start(self, startup_timeout: float = 10):
+        self.port = _free_port()
+        self.process = subprocess.Popen(
+            [self.binary, 'server', '--port', str(self.port), '--timeout', str(int(self.request_timeout))],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise PandocServerError(f"pandoc server saiu com código {self.process.returncode}")
+            try:
+                if self._request('GET', '/version', timeout=1)[0] == 200:
+                    self.checked_at = time.monotonic()
+                    return self
+            except OSError:
+                pass
+            time.sleep(0.05)
+        self.stop()
+        raise PandocServerError("pandoc server não respondeu a tempo")
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def healthy(self, interval: float) -> bool:
+        if not self.alive():
+            return False
+        if time.monotonic() - self.checked_at < interval:
+            return True
+        try:
+            ok = self._request('GET', '/version', timeout=2)[0] == 200
+        except OSError:
+            ok = False
+        if ok:
+            self.checked_at = time.monotonic()
+        return ok
+
+    def convert(self, text: str, reader: str, writer: str, files: dict = None, timeout: float = None) -> bytes:
+        payload = {'text': text, 'from': reader, 'to': writer}
+        if files:
+            payload['files'] = {path: base64.b64encode(data).decode('ascii') for path, data in files.items()}
+        status, body = self._request(
+            'POST', '/', body=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json', 'Accept': 'application/octet-stream'},
+            # Folga sobre o --timeout do servidor, que aborta a conversão do lado dele
+            timeout=(timeout or self.request_timeout) + 5,
+        )
+        if status != 200:
+            raise PandocServerError(body.decode('utf-8', errors='ignore').strip() or f"HTTP {status}")
+        return body
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+
+class PandocPool:
+    """Até `size` instâncias de `pandoc server`, criadas sob demanda e reaproveitadas."""
+
+    def __init__(self, size: int, binary: str = 'pandoc', request_timeout: float = 120,
+                 acquire_timeout: float = 30, health_interval: float = 30):
+        self.size = size
+        self.binary = binary
+        self.request_timeout = request_timeout
+        self.acquire_timeout = acquire_timeout
+        self.health_interval = health_interval
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._servers = []
+        self.conversions = 0
+        self.restarts = 0
+
+    def _spawn(self) -> PandocServer:
+        server = PandocServer(self.binary, self.request_timeout).start()
+        with self._lock:
+            self._servers.append(server)
+        return server
+
+    def _discard(self, server: PandocServer):
+        server.stop()
+        with self._lock:
+            if server in self._servers:
+                self._servers.remove(server)
+
+    def _acquire(self) -> PandocServer:
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise PandocServerError("Todos os conversores pandoc estão ocupados")
+        try:
+            server = self._idle.get_nowait()
+        except queue.Empty:
+            server = None
+        try:
+            if server is not None and not server.healthy(self.health_interval):
+                self._discard(server)
+                self.restarts += 1
+                server = None
+            return server or self._spawn()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, server: Optional[PandocServer]):
+        if server is not None:
+            self._idle.put(server)
+        self._slots.release()
+
+    def convert(self, text: str, reader: str, writer: str, files: dict = None, timeout: float = None) -> bytes:
+        server = self._acquire()
+        try:
+            try:
+                data = server.convert(text, reader, writer, files=files, timeout=timeout)
+            except TimeoutError:
+                # Conversão travada: a instância é descartada e o erro sobe (sem nova tentativa)
+                self._discard(server)
+                raise PandocServerError("pandoc excedeu o tempo limite")
+            except OSError:
+                # Conexão recusada/caiu: a instância morreu no meio; recria e tenta uma vez
+                self._discard(server)
+                self.restarts += 1
+                server = self._spawn()
+                data = server.convert(text, reader, writer, files=files, timeout=timeout)
+        except BaseException:
+            if server is not None and not server.alive():
+                self._discard(server)
+                server = None
+            self._release(server)
+            raise
+        self._release(server)
+        self.conversions += 1
+        return data
+
+    def warm_up(self):
+        """Sobe uma instância já (detecta cedo um pandoc sem modo servidor)."""
+        self._release(self._acquire())
+
+    def shutdown(self):
+        with self._lock:
+            servers, self._servers = self._servers, []
+        for server in servers:
+            server.stop()
+
+    def stats(self) -> dict:
+        with self._lock:
+            running = sum(1 for server in self._servers if server.alive())
+        return {'size': self.size, 'running': running, 'conversions': self.conversions, 'restarts': self.restarts}
+
+
+_pool_lock = threading.Lock()
+_pool: Optional[PandocPool] = None
+_pool_pid = None
+# Falhas seguidas ao subir o pool e instante (monotonic) da próxima tentativa
+_failures = 0
+_retry_at = 0.0
+
+
+def get_pandoc_pool() -> Optional[PandocPool]:
+    """
+    Pool deste processo, ou None se desligado (PANDOC_POOL_SIZE=0) ou se a última tentativa
+    de subir `pandoc server` falhou há menos que o intervalo de espera.
+    """
+    global _pool, _pool_pid, _failures, _retry_at
+    size = getattr(settings, 'PANDOC_POOL_SIZE', 2)
+    if size <= 0 or time.monotonic() < _retry_at:
+        return None
+    with _pool_lock:
+        # Processos filhos (fork do gunicorn) não herdam as instâncias do pai
+        if _pool is None or _pool_pid != os.getpid():
+            if time.monotonic() < _retry_at:
+                return None
+            pool = PandocPool(
+                size,
+                binary=getattr(settings, 'PANDOC_BINARY', 'pandoc'),
+                request_timeout=getattr(settings, 'EXPORT_JOB_TIMEOUT', 120),
+                acquire_timeout=getattr(settings, 'PANDOC_POOL_ACQUIRE_TIMEOUT', 30),
+                health_interval=getattr(settings, 'PANDOC_HEALTH_INTERVAL', 30),
+            )
+            try:
+                pool.warm_up()
+            except (OSError, PandocServerError) as exc:
+                delay = min(getattr(settings, 'PANDOC_POOL_RETRY_INTERVAL', 60) * 2 ** _failures,
+                            getattr(settings, 'PANDOC_POOL_RETRY_MAX', 3600))
+                _failures += 1
+                _retry_at = time.monotonic() + delay
+                logger.warning("pandoc server indisponível (%s); usando um processo por exportação, "
+                               "nova tentativa em %gs", exc, delay)
+                pool.shutdown()
+                return None
+            _pool, _pool_pid, _failures = pool, os.getpid(), 0
+            atexit.register(pool.shutdown)
+        return _pool
@@ -0,0 +1,143 @@
+"""
+Busca textual das questões.
+
+O texto pesquisável (`Questao.search_text`) é o conteúdo de enunciado + resposta sem
+HTML e sem LaTeX, gravado no save(). A partir dele:
+- PostgreSQL: coluna `search_vector` (tsvector, configuração portuguesa + unaccent) com índice GIN,
+  consultada com SearchQuery e ordenada por SearchRank;
+- SQLite (dev/testes): tabela virtual FTS5 `app_questao_fts` (rowid = id da questão),
+  consultada com MATCH e ordenada por bm25;
+- outros bancos: icontains em `search_text`.
+"""
+import html as html_lib
+import re
+
+from django.db import connection, connections, OperationalError
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
+from django.dispatch import receiver
+from django.db.models import F, FloatField, Value
+from django.db.models.expressions import RawSQL
+
+from .math_rewriter import rewrite_math
+
+# Configuração de busca criada na migração 0015 (portuguese + unaccent)
+SEARCH_CONFIG = 'pt_unaccent'
+FTS_TABLE = 'app_questao_fts'
+# Atributo da conexão com o resultado de _fts_available()
+_FTS_FLAG = '_questao_fts_available'
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_SPACE_RE = re.compile(r"\s+")
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def html_to_search_text(*fragments: str) -> str:
+    """Texto puro para indexação: remove fórmulas, tags e entidades HTML."""
+    parts = []
+    for html in fragments:
+        if not html:
+            continue
+        text = rewrite_math(html, lambda fragment: ' ')
+        text = html_lib.unescape(_TAG_RE.sub(' ', text))
+        parts.append(text)
+    return _SPACE_RE.sub(' ', ' '.join(parts)).strip()
+
+
+def _fts_available() -> bool:
+    """
+    Se a tabela FTS5 existe. Consultado uma vez por conexão: o resultado fica na própria
+    conexão e é descartado quando ela é reaberta ou quando as migrações rodam.
+    """
+    available = getattr(connection, _FTS_FLAG, None)
+    if available is None:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+                available = cursor.fetchone() is not None
+        except OperationalError:
+            available = False
+        setattr(connection, _FTS_FLAG, available)
+    return available
+
+
+@receiver(connection_created)
+def _reset_fts_flag(sender, connection, **kwargs):
+    setattr(connection, _FTS_FLAG, None)
+
+
+@receiver(post_migrate)
+def _reset_fts_flags(sender, **kwargs):
+    for conn in connections.all(initialized_only=True):
+        setattr(conn, _FTS_FLAG, None)
+
+
+def _fts_query(term: str) -> str:
+    # Cada palavra vira um termo entre aspas com prefixo (AND implícito); evita a sintaxe do FTS5
+    return ' '.join(f'"{word}"*' for word in _WORD_RE.findall(term))
+
+
+def search_questoes(queryset, term: str):
+    """
+    Filtra `queryset` pelas questões que casam com `term` e anota `search_rank`
+    (maior = mais relevante). Não define ordenação.
+    """
+    term = (term or '').strip()
+    if not term:
+        return queryset
+
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        query = SearchQuery(term, config=SEARCH_CONFIG, search_type='websearch')
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        )
+
+    if connection.vendor == 'sqlite' and _fts_available():
+        match = _fts_query(term)
+        if not match:
+            return queryset.none()
+        table = queryset.model._meta.db_table
+        return queryset.filter(
+            id__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match])
+        ).annotate(
+            search_rank=RawSQL(
+                f"SELECT -bm25({FTS_TABLE}) FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = {table}.id",
+                [match],
+                output_field=FloatField(),
+            )
+        )
+
+    return queryset.filter(search_text__icontains=term).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+def refresh_search_index(model, pks):
+    """Atualiza o índice (tsvector ou FTS5) das questões `pks` a partir de `search_text`."""
+    pks = list(pks)
+    if not pks:
+        return
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchVector
+
+        model.objects.filter(pk__in=pks).update(search_vector=SearchVector('search_text', config=SEARCH_CONFIG))
+    elif connection.vendor == 'sqlite' and _fts_available():
+        table = model._meta.db_table
+        placeholders = ', '.join(['%s'] * len(pks))
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", pks)
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE}(rowid, search_text) "
+                f"SELECT id, search_text FROM {table} WHERE id IN ({placeholders})",
+                pks,
+            )
+
+
+def remove_from_search_index(pks):
+    """Remove questões apagadas da tabela FTS5 (no PostgreSQL o tsvector some com a linha)."""
+    pks = list(pks)
+    if pks and connection.vendor == 'sqlite' and _fts_available():
+        placeholders = ', '.join(['%s'] * len(pks))
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", pks)
@@ -1,9 +1,7 @@
 # app/serializers.py
 from rest_framework import serializers
 from .models import Questao, Conteudo
-from .utils import render_latex_to_png_bytes, html_render_math_to_img
-import base64
-import re
+from .utils import prerender_math, MATH_FORMATS, math_render_format
 from django.contrib.auth.models import User
 
 class ConteudoSerializer(serializers.ModelSerializer):
@@ -11,22 +9,58 @@ class ConteudoSerializer(serializers.ModelSerializer):
         model = Conteudo
         fields = ['id', 'nome', 'tipo', 'pai_id']
 
-def _html_render_math_to_img(html: str) -> str:
-    if not html:
-        return html or ""
-    pattern = re.compile(r"(\\\[.*?\\\]|\\\(.*?\\\)|\$.*?\$)", re.DOTALL)
-    def repl(m):
-        src = m.group(0)
-        try:
-            png = render_latex_to_png_bytes(src)
-            b64 = base64.b64encode(png).decode('ascii')
-            return f'<img alt="math" style="vertical-align: middle;" src="data:image/png;base64,{b64}" />'
-        except Exception:
-            return src
-    return pattern.sub(repl, html)
-
-
-class QuestaoSerializer(serializers.ModelSerializer):
+
+class SparseFieldsMixin:
+    """
+    Permite escolher os campos da resposta com ?fields=a,b e/ou ?omit=c,d.
+    Campos removidos não são calculados (inclusive os SerializerMethodField de renderização).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.requested_field_names(self.context.get('request'))
+        for name in set(self.fields) - requested:
+            self.fields.pop(name)
+
+    @classmethod
+    def requested_field_names(cls, request) -> set:
+        names = set(cls.Meta.fields)
+        params = getattr(request, 'query_params', None)
+        if not params:
+            return names
+        fields = params.get('fields')
+        if fields:
+            names &= {f.strip() for f in fields.split(',')} | {'id'}
+        omit = params.get('omit')
+        if omit:
+            names -= {f.strip() for f in omit.split(',')} - {'id'}
+        return names
+
+
+class QuestaoListSerializer(serializers.ListSerializer):
+    """
+    Antes de serializar a página, renderiza em lote (pool de processos) as fórmulas
+    das questões cujo HTML armazenado está desatualizado.
+    """
+
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        fmt = self.child._math_format()
+        # Só os campos renderizados que foram pedidos (os demais podem estar adiados no SQL)
+        rendered = [f for f in Questao.RENDERED_FIELDS if f'{f}_rendered' in self.child.fields]
+        # Formato diferente do armazenado: todas as fórmulas da página precisam passar pelo cache
+        all_stale = fmt is not None and fmt != math_render_format()
+        stale_html = [
+            getattr(q, field) or ''
+            for q in items
+            for field in rendered
+            if all_stale or q.rendered_is_stale(field)
+        ]
+        self.math_skip_keys = prerender_math(stale_html, fmt=fmt) if stale_html else frozenset()
+        return super().to_representation(items)
+
+
+class QuestaoSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     area = ConteudoSerializer()
     unidade = ConteudoSerializer(required=False, allow_null=True)
     topico = ConteudoSerializer(required=False, allow_null=True)
@@ -43,12 +77,33 @@ class QuestaoSerializer(serializers.ModelSerializer):
             'enunciado', 'resposta', 'resposta_gabarito',
             'enunciado_rendered', 'resposta_rendered',
         ]
+        list_serializer_class = QuestaoListSerializer
+
+    def _math_skip_keys(self):
+        return getattr(self.parent, 'math_skip_keys', None)
+
+    def _math_format(self):
+        """Formato pedido via ?math_format=svg|png (None = padrão do servidor)."""
+        request = self.context.get('request')
+        fmt = getattr(request, 'query_params', {}).get('math_format') if request is not None else None
+        return fmt if fmt in MATH_FORMATS else None
 
     def get_enunciado_rendered(self, obj: Questao):
-        return html_render_math_to_img(obj.enunciado or "")
+        return obj.get_rendered('enunciado', skip_keys=self._math_skip_keys(), fmt=self._math_format())
 
     def get_resposta_rendered(self, obj: Questao):
-        return html_render_math_to_img(obj.resposta or "")
+        return obj.get_rendered('resposta', skip_keys=self._math_skip_keys(), fmt=self._math_format())
+
+class QuestaoCompactSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """Representação leve para listagens (ex.: seleção de questões da prova): sem textos ricos."""
+
+    class Meta:
+        model = Questao
+        fields = [
+            'id', 'area_id', 'unidade_id', 'topico_id', 'subtopico_id', 'categoria_id',
+            'ano', 'banca', 'tipo_questao', 'dificuldade', 'grau_escolaridade',
+        ]
+
 
 class QuestaoCreateSerializer(serializers.ModelSerializer):
     class Meta:
@@ -0,0 +1,216 @@
+"""
+Hierarquia de Conteudo (área → unidade → tópico → subtópico → categoria).
+
+- Snapshot imutável da árvore inteira em memória, por processo (`get_taxonomy()`),
+  recarregado só quando a geração 'taxonomia' (Geracao) muda.
+- Consultas sobre a tabela de fechamento `ConteudoAncestral`.
+"""
+import threading
+import time
+from functools import reduce
+from operator import or_
+from types import MappingProxyType
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.db.models import Count, Exists, Q
+
+from .models import Conteudo, ConteudoAncestral, Geracao, Questao
+
+TAXONOMY_LEVELS = ('area', 'unidade', 'topico', 'subtopico', 'categoria')
+# Níveis abaixo de área, na ordem em que o filtro combinado os considera
+CHILD_LEVELS = TAXONOMY_LEVELS[1:]
+
+
+class TaxonomyNode(NamedTuple):
+    id: int
+    nome: str
+    tipo: str
+    pai_id: Optional[int]
+
+
+class TaxonomySnapshot:
+    """Árvore completa, somente leitura: id → nó, filhos por pai e nós por tipo (ordem de id)."""
+
+    __slots__ = ('version', 'nodes', '_children', '_by_tipo')
+
+    def __init__(self, version: int, rows):
+        nodes = {}
+        children = {}
+        by_tipo = {}
+        for row in rows:
+            node = TaxonomyNode(*row)
+            nodes[node.id] = node
+            children.setdefault(node.pai_id, []).append(node)
+            by_tipo.setdefault(node.tipo, []).append(node)
+        self.version = version
+        self.nodes = MappingProxyType(nodes)
+        self._children = MappingProxyType({key: tuple(value) for key, value in children.items()})
+        self._by_tipo = MappingProxyType({key: tuple(value) for key, value in by_tipo.items()})
+
+    def get(self, node_id) -> Optional[TaxonomyNode]:
+        return self.nodes.get(node_id)
+
+    def children_of(self, pai_id) -> tuple:
+        return self._children.get(pai_id, ())
+
+    def of_tipo(self, tipo: str, pai_ids=None) -> tuple:
+        nodes = self._by_tipo.get(tipo, ())
+        if pai_ids is not None:
+            pai_ids = set(pai_ids)
+            nodes = tuple(node for node in nodes if node.pai_id in pai_ids)
+        return nodes
+
+    def ancestors(self, node_id) -> list:
+        """Cadeia do nó até a raiz (inclusive o próprio nó)."""
+        chain = []
+        node = self.nodes.get(node_id)
+        while node is not None and len(chain) <= len(self.nodes):
+            chain.append(node)
+            node = self.nodes.get(node.pai_id)
+        return chain
+
+
+def by_name(nodes) -> list:
+    return sorted(nodes, key=lambda node: node.nome)
+
+
+_snapshot_lock = threading.Lock()
+_snapshot: Optional[TaxonomySnapshot] = None
+_checked_at = 0.0
+_local_bumps_seen = -1
+
+
+def get_taxonomy() -> TaxonomySnapshot:
+    """
+    Snapshot da árvore de conteúdos deste processo. A versão no banco só é consultada
+    a cada TAXONOMY_VERSION_CHECK_INTERVAL segundos (ou logo após uma escrita feita
+    pelo próprio processo); a árvore só é relida quando a versão muda.
+    """
+    global _snapshot, _checked_at, _local_bumps_seen
+    interval = getattr(settings, 'TAXONOMY_VERSION_CHECK_INTERVAL', 1.0)
+    with _snapshot_lock:
+        now = time.monotonic()
+        local_bumps = Geracao.local_bumps(Conteudo.GERACAO)
+        if _snapshot is not None and local_bumps == _local_bumps_seen and now - _checked_at < interval:
+            return _snapshot
+        version = Geracao.current(Conteudo.GERACAO)
+        if _snapshot is None or version != _snapshot.version or local_bumps != _local_bumps_seen:
+            rows = Conteudo.objects.order_by('id').values_list('id', 'nome', 'tipo', 'pai_id')
+            _snapshot = TaxonomySnapshot(version, list(rows))
+        _checked_at = now
+        _local_bumps_seen = local_bumps
+        return _snapshot
+
+
+def question_counts() -> dict:
+    """
+    id do nó → (questões classificadas diretamente nele, questões em toda a subárvore),
+    calculado de app_questao numa única query agrupada pelo caminho completo da questão.
+    Fonte de verdade para `reconcile_question_counters`; as telas usam `node_counters()`.
+    """
+    levels = [f'{level}_id' for level in TAXONOMY_LEVELS]
+    counts = {}
+    for row in Questao.objects.order_by().values(*levels).annotate(total=Count('id')):
+        path = [row[level] for level in levels if row[level] is not None]
+        for depth, node_id in enumerate(path):
+            direct, total = counts.get(node_id, (0, 0))
+            if depth == len(path) - 1:
+                direct += row['total']
+            counts[node_id] = (direct, total + row['total'])
+    return counts
+
+
+def node_counters() -> dict:
+    """id do nó → (questoes_diretas, questoes_total) a partir dos contadores mantidos em Conteudo."""
+    return {
+        node_id: (direct, total)
+        for node_id, direct, total in Conteudo.objects.values_list('id', 'questoes_diretas', 'questoes_total')
+    }
+
+
+def tree_payload(taxonomy: TaxonomySnapshot, layout: str = 'nested', counts: dict = None):
+    """
+    Árvore inteira para /api/conteudos/tree/.
+    - nested: [{id, nome, tipo, filhos: [...]}] a partir das áreas;
+    - columnar: {id: [...], nome: [...], tipo: [...], pai_id: [...]} (uma posição por nó, ordem de id).
+    Com `counts`, acrescenta `questoes` (subárvore) e `questoes_diretas`.
+    """
+    if layout == 'columnar':
+        nodes = list(taxonomy.nodes.values())
+        payload = {
+            'id': [node.id for node in nodes],
+            'nome': [node.nome for node in nodes],
+            'tipo': [node.tipo for node in nodes],
+            'pai_id': [node.pai_id for node in nodes],
+        }
+        if counts is not None:
+            payload['questoes'] = [counts.get(node.id, (0, 0))[1] for node in nodes]
+            payload['questoes_diretas'] = [counts.get(node.id, (0, 0))[0] for node in nodes]
+        return payload
+
+    def build(node):
+        item = {'id': node.id, 'nome': node.nome, 'tipo': node.tipo}
+        if counts is not None:
+            direct, total = counts.get(node.id, (0, 0))
+            item['questoes'] = total
+            item['questoes_diretas'] = direct
+        item['filhos'] = [build(child) for child in taxonomy.children_of(node.id)]
+        return item
+
+    return [build(node) for node in taxonomy.children_of(None)]
+
+
+def rebuild_closure():
+    """Recria a tabela de fechamento inteira a partir de `pai`."""
+    parents = dict(Conteudo.objects.values_list('id', 'pai_id'))
+    rows = []
+    for node_id in parents:
+        ancestral_id, profundidade = node_id, 0
+        visited = set()
+        while ancestral_id is not None and ancestral_id not in visited:
+            visited.add(ancestral_id)
+            rows.append(ConteudoAncestral(ancestral_id=ancestral_id, descendente_id=node_id, profundidade=profundidade))
+            ancestral_id, profundidade = parents.get(ancestral_id), profundidade + 1
+    ConteudoAncestral.objects.all().delete()
+    ConteudoAncestral.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def descendants_of(conteudo_ids):
+    """Subquery com os ids dos descendentes (inclusive os próprios nós) de `conteudo_ids`."""
+    return ConteudoAncestral.objects.filter(ancestral_id__in=conteudo_ids).values('descendente_id')
+
+
+def under_conteudo_q(conteudo_ids) -> Q:
+    """Questões classificadas em qualquer ponto da subárvore de `conteudo_ids` (filtro ?conteudo_id=)."""
+    subtree = descendants_of(conteudo_ids)
+    return reduce(or_, (Q(**{f'{level}_id__in': subtree}) for level in Questao.TAXONOMY_FIELDS))
+
+
+def area_selection_q(area_ids, child_ids: dict) -> Q:
+    """
+    Filtro de áreas combinadas com níveis filhos: para cada área, usa o primeiro nível
+    (unidade, tópico, subtópico, categoria) que tenha algum nó selecionado dentro dela;
+    se nenhum tiver, a área entra inteira. O resultado é OR entre as áreas.
+
+    Tudo vira uma única instrução SQL: a pertinência de cada nó à área é um EXISTS
+    na tabela de fechamento, sem queries prévias por área/nível.
+    """
+    conditions = []
+    for area_id in area_ids:
+        branches = []
+        none_before = Q()
+        for level in CHILD_LEVELS:
+            ids = child_ids.get(level)
+            if not ids:
+                continue
+            selected = ConteudoAncestral.objects.filter(
+                ancestral_id=area_id, descendente_id__in=ids, descendente__tipo=level,
+            )
+            has_selected = Exists(selected)
+            branches.append(none_before & Q(has_selected) & Q(**{f'{level}_id__in': selected.values('descendente_id')}))
+            none_before &= ~Q(has_selected)
+        branches.append(none_before)
+        conditions.append(Q(area_id=area_id) & reduce(or_, branches))
+    return reduce(or_, conditions)
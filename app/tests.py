@@ -1,3 +1,1699 @@
-from django.test import TestCase
+import io
+import os
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient, APIRequestFactory
+
+from app import taxonomy
+from app.models import Conteudo, ConteudoAncestral, Questao
+from app.taxonomy import get_taxonomy, rebuild_closure
+from app.views import list_questoes
+
+
+_media_override = None
+
+
+def setUpModule():
+    # Fórmulas pré-renderizadas no save() e uploads vão para um diretório temporário, não para media/
+    import tempfile
+    global _media_override
+    media_root = tempfile.mkdtemp(prefix='eduqbank-media-')
+    _media_override = override_settings(MEDIA_ROOT=media_root, MATH_RENDER_CACHE_DIR=f'{media_root}/math')
+    _media_override.enable()
+
+
+def tearDownModule():
+    import shutil
+    from django.conf import settings
+    media_root = settings.MEDIA_ROOT
+    _media_override.disable()
+    shutil.rmtree(media_root, ignore_errors=True)
+
+
+def _criar_taxonomia():
+    area = Conteudo.objects.create(nome='Matemática', tipo='area')
+    unidade = Conteudo.objects.create(nome='Álgebra', tipo='unidade', pai=area)
+    topico = Conteudo.objects.create(nome='Funções', tipo='topico', pai=unidade)
+    subtopico = Conteudo.objects.create(nome='Afim', tipo='subtopico', pai=topico)
+    categoria = Conteudo.objects.create(nome='Gráficos', tipo='categoria', pai=subtopico)
+    return {'area': area, 'unidade': unidade, 'topico': topico, 'subtopico': subtopico, 'categoria': categoria}
+
+
+def _criar_questoes(taxonomia, total, **extra):
+    dados = {
+        'ano': 2024, 'banca': 'FGV', 'tipo_questao': 'objetiva', 'dificuldade': 'facil',
+        'grau_escolaridade': 'medio', 'enunciado': '<p>Enunciado</p>', 'resposta': '<p>Resposta</p>',
+    }
+    dados.update(extra)
+    return [Questao.objects.create(**taxonomia, **dados) for _ in range(total)]
+
+
+class QuestaoQueryCountTests(TestCase):
+    """O número de queries da listagem não pode crescer com o tamanho da página (N+1)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='prof', password='x')
+        _criar_questoes(_criar_taxonomia(), 12)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _queries_for(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_viewset_list_query_count_is_constant(self):
+        small = self._queries_for('/api/questoes/?page_size=2')
+        large = self._queries_for('/api/questoes/?page_size=12')
+        self.assertEqual(small, large)
+
+    def test_viewset_page_number_query_count_is_constant(self):
+        from django.core.cache import cache
+        # Mesma situação nas duas medições: lista de ids fora do cache
+        cache.clear()
+        small = self._queries_for('/api/questoes/?page=1&page_size=2')
+        cache.clear()
+        large = self._queries_for('/api/questoes/?page=1&page_size=12')
+        self.assertEqual(small, large)
+
+    def test_viewset_unpaginated_query_count_is_constant(self):
+        baseline = self._queries_for('/api/questoes/?paginate=false')
+        _criar_questoes(_criar_taxonomia(), 8)
+        self.assertEqual(self._queries_for('/api/questoes/?paginate=false'), baseline)
+
+    def test_list_questoes_query_count_is_constant(self):
+        factory = APIRequestFactory()
+        with CaptureQueriesContext(connection) as ctx:
+            list_questoes(factory.get('/'))
+        baseline = len(ctx.captured_queries)
+        _criar_questoes(_criar_taxonomia(), 8)
+        with CaptureQueriesContext(connection) as ctx:
+            list_questoes(factory.get('/'))
+        self.assertEqual(len(ctx.captured_queries), baseline)
+
+    @override_settings(TAXONOMY_VERSION_CHECK_INTERVAL=60)
+    def test_detail_uses_single_query(self):
+        from django.core.cache import cache
+        cache.clear()
+        taxonomy._snapshot = None
+        get_taxonomy()
+        questao = Questao.objects.first()
+        # Fora do cache: versão da linha + a questão; no cache: só a versão
+        self.assertEqual(self._queries_for(f'/api/questoes/{questao.pk}/'), 2)
+        self.assertEqual(self._queries_for(f'/api/questoes/{questao.pk}/'), 1)
+
+
+class QuestaoSparseFieldsTests(TestCase):
+    """?fields=/?omit=/?view=compact reduzem a resposta e as colunas lidas do banco."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='prof', password='x')
+        _criar_questoes(_criar_taxonomia(), 3)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _get(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        sql = ' '.join(q['sql'] for q in ctx.captured_queries)
+        return response.json()['results'], sql
+
+    def test_fields_limits_output_and_defers_rich_text(self):
+        results, sql = self._get('/api/questoes/?fields=ano,banca')
+        self.assertEqual(set(results[0]), {'id', 'ano', 'banca'})
+        self.assertNotIn('"enunciado"', sql)
+        self.assertNotIn('"enunciado_rendered"', sql)
+
+    def test_omit_removes_rendered_fields(self):
+        results, sql = self._get('/api/questoes/?omit=enunciado_rendered,resposta_rendered')
+        self.assertNotIn('enunciado_rendered', results[0])
+        self.assertIn('enunciado', results[0])
+        self.assertNotIn('"resposta_rendered"', sql)
+
+    def test_compact_view(self):
+        results, sql = self._get('/api/questoes/?view=compact')
+        self.assertEqual(set(results[0]), {
+            'id', 'area_id', 'unidade_id', 'topico_id', 'subtopico_id', 'categoria_id',
+            'ano', 'banca', 'tipo_questao', 'dificuldade', 'grau_escolaridade',
+        })
+        self.assertNotIn('"resposta"', sql)
+        self.assertNotIn('JOIN', sql)
+
+
+class QuestaoSearchTests(TestCase):
+    """?search= usa o índice textual: ignora acentos, HTML e LaTeX e ordena por relevância."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='prof', password='x')
+        taxonomia = _criar_taxonomia()
+        cls.funcao, = _criar_questoes(
+            taxonomia, 1, enunciado='<p>Determine a <strong>função</strong> \\(f(x) = x^2\\)</p>')
+        cls.funcoes, = _criar_questoes(
+            taxonomia, 1, enunciado='<p>Função composta de funções</p>', resposta='<p>Funções inversas</p>')
+        _criar_questoes(taxonomia, 2, enunciado='<p>Geometria plana</p>')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _ids(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.json()['results']]
+
+    def test_search_ignores_accents_and_markup(self):
+        self.assertCountEqual(self._ids('/api/questoes/?search=funcao'), [self.funcao.pk, self.funcoes.pk])
+        self.assertEqual(self._ids('/api/questoes/?search=strong'), [])
+        self.assertEqual(self._ids('/api/questoes/?search=x%5E2'), [])
+
+    def test_search_orders_by_relevance(self):
+        self.assertEqual(self._ids('/api/questoes/?search=fun%C3%A7%C3%B5es')[0], self.funcoes.pk)
+
+    def test_index_follows_updates_and_deletes(self):
+        self.funcao.enunciado = '<p>Probabilidade condicional</p>'
+        self.funcao.save()
+        self.assertEqual(self._ids('/api/questoes/?search=condicional'), [self.funcao.pk])
+        self.funcao.delete()
+        self.assertEqual(self._ids('/api/questoes/?search=condicional'), [])
+
+    def test_fts_table_is_checked_once_per_connection(self):
+        from django.db.backends.signals import connection_created
+        from app.search import _fts_available
+
+        def lookups():
+            with CaptureQueriesContext(connection) as ctx:
+                self._ids('/api/questoes/?search=funcao')
+                self.funcoes.save()
+            return [q for q in ctx.captured_queries if 'sqlite_master' in q['sql']]
+
+        _fts_available()
+        self.assertEqual(lookups(), [])
+        # Conexão nova: verifica de novo na primeira busca
+        connection_created.send(sender=connection.__class__, connection=connection)
+        self.assertEqual(len(lookups()), int(connection.vendor == 'sqlite'))
+
+
+class QuestaoCursorPaginationTests(TestCase):
+    """O cursor guarda a posição completa (chave + id): empates em ano ou relevância não repetem páginas."""
+
+    TOTAL = 1300
+
+    @classmethod
+    def setUpTestData(cls):
+        from app.search import refresh_search_index
+        cls.user = User.objects.create_user(username='prof', password='x')
+        taxonomia = _criar_taxonomia()
+        # Mais empates que o offset_cutoff (1000) do CursorPagination padrão: mesmo ano e mesmo texto
+        Questao.objects.bulk_create([
+            Questao(**taxonomia, ano=2024, banca='FGV', tipo_questao='objetiva', dificuldade='facil',
+                    grau_escolaridade='medio', enunciado='<p>Geometria</p>', resposta='<p>R</p>',
+                    search_text='Geometria R')
+            for _ in range(cls.TOTAL)
+        ])
+        refresh_search_index(Questao, Questao.objects.values_list('pk', flat=True))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _walk(self, url, direction='next'):
+        ids, pages = [], 0
+        while url and pages <= self.TOTAL // 100 + 1:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            ids.extend(item['id'] for item in body['results'])
+            url = body[direction]
+            pages += 1
+        self.assertIsNone(url)
+        return ids, body
+
+    def _assert_each_once(self, ids):
+        self.assertEqual(len(ids), self.TOTAL)
+        self.assertEqual(set(ids), set(Questao.objects.values_list('pk', flat=True)))
+
+    def test_ordering_by_ano_past_tie_cutoff(self):
+        for ordering in ('ano', '-ano'):
+            ids, last = self._walk(f'/api/questoes/?view=compact&page_size=100&ordering={ordering}')
+            self._assert_each_once(ids)
+            # E de volta, pelos links "previous"
+            back, _ = self._walk(last['previous'], direction='previous')
+            self.assertEqual(len(back) + len(last['results']), self.TOTAL)
+            self.assertEqual(len(set(back)), len(back))
+
+    def test_search_relevance_past_tie_cutoff(self):
+        ids, _ = self._walk('/api/questoes/?view=compact&page_size=100&search=geometria')
+        self._assert_each_once(ids)
+
+    def test_invalid_cursor(self):
+        import base64
+        cursor = base64.b64encode(b'p=%5B1%5D').decode()
+        response = self.client.get(f'/api/questoes/?ordering=ano&cursor={cursor}')
+        self.assertEqual(response.status_code, 404)
+
+
+class MathRenderCacheTests(SimpleTestCase):
+    """Cache de fórmulas: LRU limitado em bytes na memória + disco compartilhado com escrita atômica."""
+
+    def setUp(self):
+        import tempfile
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+
+    def _files(self):
+        return sorted(name for _, _, names in os.walk(self.directory) for name in names)
+
+    def test_memory_tier_evicts_least_recently_used_by_bytes(self):
+        from app.utils import MathRenderCache
+        cache = MathRenderCache(max_bytes=10, directory='')
+        cache.set('a', b'aaaa')
+        cache.set('b', b'bbbb')
+        self.assertEqual(cache.get('a'), b'aaaa')  # "a" passa a ser a mais recente
+        cache.set('c', b'cccc')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (b'aaaa', b'cccc'))
+        cache.set('grande', b'x' * 11)  # maior que o orçamento: não entra nem despeja as outras
+        stats = cache.stats()
+        self.assertEqual((stats['entries'], stats['bytes'], stats['evictions']), (2, 8, 1))
+        self.assertIsNone(cache.get('grande'))
+
+    def test_disk_tier_serves_after_memory_cleared(self):
+        from app.utils import MathRenderCache
+        cache = MathRenderCache(max_bytes=1024, directory=self.directory)
+        cache.set('ab12', b'png', ext='png')
+        self.assertEqual(self._files(), ['ab12.png'])
+        cache.clear_memory()
+        self.assertEqual(cache.get('ab12', ext='png'), b'png')
+        self.assertEqual(cache.get('ab12', ext='svg'), None)
+        # Outro worker (outra instância) lê o mesmo arquivo
+        other = MathRenderCache(max_bytes=1024, directory=self.directory)
+        self.assertEqual(other.get('ab12', ext='png'), b'png')
+        self.assertEqual((cache.stats()['disk_hits'], other.stats()['disk_hits']), (1, 1))
+        self.assertEqual(cache.get('ab12', ext='png'), b'png')
+        self.assertEqual(cache.stats()['memory_hits'], 1)
+
+    def test_disk_write_is_atomic(self):
+        from unittest import mock
+        from app.utils import MathRenderCache
+        cache = MathRenderCache(max_bytes=1024, directory=self.directory)
+        replaced = []
+        real_replace = os.replace
+
+        def spy(src, dst):
+            # No momento da troca, o destino ainda não existe e o temporário está completo
+            self.assertFalse(os.path.exists(dst))
+            with open(src, 'rb') as f:
+                self.assertEqual(f.read(), b'conteudo')
+            replaced.append((os.path.dirname(src), dst))
+            real_replace(src, dst)
+
+        with mock.patch('app.utils.os.replace', side_effect=spy):
+            cache.set('cd34', b'conteudo')
+        self.assertEqual(replaced, [(os.path.dirname(cache.path_for('cd34')), cache.path_for('cd34'))])
+        with mock.patch('app.utils.os.replace', side_effect=OSError('disco cheio')):
+            cache.set('ef56', b'outro')
+        # Falha na troca: nenhum arquivo parcial ou temporário fica para trás, e a memória ainda serve
+        self.assertEqual(self._files(), ['cd34.png'])
+        self.assertEqual(cache.get('ef56'), b'outro')
+
+
+class MathImageSrcTests(SimpleTestCase):
+    """`src` das fórmulas: URL de arquivo com hash de conteúdo no diretório de cache ou data URI inline."""
+
+    def setUp(self):
+        import tempfile
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+
+    def test_url_mode_writes_file_under_cache_dir(self):
+        from app.utils import math_cache_key, math_image_src, render_latex
+        with override_settings(MATH_RENDER_CACHE_DIR=self.directory, MATH_RENDER_CACHE_URL='/media/math/'):
+            src = math_image_src(r'$\frac{a}{b}$', mode='url', fmt='png')
+            # Fórmula equivalente (espaços) aponta para o mesmo arquivo
+            self.assertEqual(math_image_src(r'\(  \frac{a}{b} \)', mode='url', fmt='png'), src)
+        key = math_cache_key(r'$\frac{a}{b}$', fmt='png')
+        self.assertEqual(src, f'/media/math/{key[:2]}/{key}.png')
+        path = os.path.join(self.directory, key[:2], f'{key}.png')
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.assertTrue(data.startswith(b'\x89PNG'))
+        self.assertEqual(data, render_latex(r'$\frac{a}{b}$', fmt='png'))
+
+    def test_inline_mode_returns_data_uri(self):
+        import base64
+        from app.utils import math_image_src, render_latex
+        src = math_image_src('$x^2$', mode='inline', fmt='png')
+        prefix = 'data:image/png;base64,'
+        self.assertTrue(src.startswith(prefix))
+        self.assertEqual(base64.b64decode(src[len(prefix):]), render_latex('$x^2$', fmt='png'))
+
+    def test_url_mode_without_cache_dir_falls_back_to_data_uri(self):
+        from app.utils import math_image_src
+        with override_settings(MATH_RENDER_CACHE_DIR=''):
+            self.assertTrue(math_image_src('$x^2$', mode='url', fmt='png').startswith('data:image/png;base64,'))
+
+    def test_skip_keys_raise_lookup_error(self):
+        from app.utils import math_cache_key, math_image_src
+        with self.assertRaises(LookupError):
+            math_image_src('$x^3$', skip_keys={math_cache_key('$x^3$', fmt='png')}, fmt='png')
+
+
+class MathSvgTests(TestCase):
+    """Fórmulas em SVG: saída vetorial, formato na chave do cache e ?math_format=svg na API."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='prof', password='x')
+        cls.questao = _criar_questoes(_criar_taxonomia(), 1, enunciado=r'<p>Seja $\sqrt{x}$</p>')[0]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_svg_output(self):
+        from app.utils import render_latex
+        data = render_latex(r'$\sqrt{x}$', fmt='svg')
+        self.assertIn(b'<svg', data)
+        self.assertNotIn(b'<image', data)  # vetorial, sem bitmap embutido
+
+    def test_format_is_part_of_cache_key(self):
+        from app.utils import math_cache_key, math_image_src, math_render_cache
+        png, svg = math_cache_key(r'$\sqrt{x}$', fmt='png'), math_cache_key(r'$\sqrt{x}$', fmt='svg')
+        self.assertNotEqual(png, svg)
+        src = math_image_src(r'$\sqrt{x}$', mode='url', fmt='svg')
+        self.assertTrue(src.endswith(f'/{svg}.svg'))
+        self.assertIn(b'<svg', math_render_cache.get(svg, ext='svg'))
+        self.assertTrue(math_image_src(r'$\sqrt{x}$', mode='inline', fmt='svg').startswith('data:image/svg+xml;base64,'))
+
+    def _enunciado(self, query=''):
+        response = self.client.get(f'/api/questoes/{self.questao.pk}/{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['enunciado_rendered']
+
+    def test_math_format_query_param(self):
+        import re
+        stored = Questao.objects.get(pk=self.questao.pk).enunciado_rendered
+        self.assertRegex(self._enunciado(), r'src="[^"]+\.png"')
+        svg = self._enunciado('?math_format=svg')
+        self.assertRegex(svg, r'src="[^"]+\.svg"')
+        self.assertFalse(re.search(r'\.png"', svg))
+        # Valor desconhecido cai no padrão; o HTML armazenado (png) não muda
+        self.assertRegex(self._enunciado('?math_format=gif'), r'src="[^"]+\.png"')
+        self.assertEqual(Questao.objects.get(pk=self.questao.pk).enunciado_rendered, stored)
+
+    def test_math_format_in_list(self):
+        response = self.client.get('/api/questoes/?math_format=svg&fields=id,enunciado_rendered')
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response.json()['results'][0]['enunciado_rendered'], r'src="[^"]+\.svg"')
+
+
+class _FakeRenderPool:
+    """Substitui o ProcessPoolExecutor: renderiza no próprio processo, trava ou quebra conforme `modo`."""
+
+    def __init__(self, modo='ok'):
+        self.modo = modo
+        self.submetidas = []
+
+    def submit(self, fn, *args):
+        from concurrent.futures import Future
+        from concurrent.futures.process import BrokenProcessPool
+        if self.modo == 'quebrado':
+            raise BrokenProcessPool('worker morreu')
+        self.submetidas.append(args[0])
+        future = Future()
+        if self.modo == 'ok':
+            future.set_result(fn(*args))
+        elif self.modo == 'quebra_no_resultado':
+            future.set_exception(BrokenProcessPool('worker morreu'))
+        return future  # 'trava': nunca termina
+
+
+class MathPrerenderTests(TestCase):
+    """Renderização em lote da página: dedupe, timeout (LaTeX puro) e pool quebrado (render no processo)."""
+
+    _seq = 0
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='prof', password='x')
+        cls.questoes = _criar_questoes(_criar_taxonomia(), 3)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _formula(self):
+        # Fórmula inédita por teste: o disco do cache de fórmulas é compartilhado pelo módulo
+        MathPrerenderTests._seq += 1
+        return f'$y^{{{MathPrerenderTests._seq}}} + 1$'
+
+    def _tornar_desatualizadas(self, html):
+        Questao.objects.filter(pk__in=[q.pk for q in self.questoes]).update(enunciado=html)
+
+    def _listar(self, pool):
+        from unittest import mock
+        with mock.patch('app.utils._get_render_pool', return_value=pool), \
+                mock.patch('app.utils._reset_render_pool') as reset:
+            response = self.client.get('/api/questoes/?page_size=10&fields=id,enunciado_rendered')
+        self.assertEqual(response.status_code, 200)
+        return [r['enunciado_rendered'] for r in response.json()['results']], reset
+
+    def test_repeated_formulas_are_rendered_once(self):
+        from app.utils import prerender_math
+        a, b = self._formula(), self._formula()
+        self._tornar_desatualizadas(f'<p>{a} e {b} e de novo {a}</p>')
+        pool = _FakeRenderPool()
+        rendered, _ = self._listar(pool)
+        self.assertEqual(sorted(pool.submetidas), sorted([a, b]))
+        for html in rendered:
+            self.assertEqual(html.count('<img'), 3)
+            self.assertNotIn(a, html)
+        # Segunda passada: tudo no cache, nada vai para o pool
+        self.assertEqual(prerender_math([f'<p>{a}{b}</p>']), frozenset())
+
+    def test_batch_timeout_returns_skip_keys_and_keeps_latex(self):
+        from app.utils import math_cache_key, math_render_format, prerender_math
+        formula = self._formula()
+        html = f'<p>Calcule {formula}</p>'
+        with override_settings(MATH_RENDER_BATCH_TIMEOUT=0.01):
+            from unittest import mock
+            with mock.patch('app.utils._get_render_pool', return_value=_FakeRenderPool('trava')):
+                skip = prerender_math([html])
+            self.assertEqual(skip, {math_cache_key(formula, fmt=math_render_format())})
+
+            self._tornar_desatualizadas(html)
+            rendered, reset = self._listar(_FakeRenderPool('trava'))
+        self.assertEqual(rendered, [html] * 3)
+        reset.assert_not_called()
+        # Resultado parcial não é persistido: a próxima listagem tenta de novo
+        for questao in Questao.objects.filter(pk__in=[q.pk for q in self.questoes]):
+            self.assertTrue(questao.rendered_is_stale('enunciado'))
+
+    def test_broken_pool_on_submit_falls_back_to_inline_rendering(self):
+        from unittest import mock
+        from app.utils import prerender_math
+        formula = self._formula()
+        with mock.patch('app.utils._get_render_pool', return_value=_FakeRenderPool('quebrado')), \
+                mock.patch('app.utils._reset_render_pool') as reset:
+            self.assertEqual(prerender_math([f'<p>{formula}</p>']), frozenset())
+        reset.assert_called_once()
+
+        self._tornar_desatualizadas(f'<p>{formula}</p>')
+        rendered, reset = self._listar(_FakeRenderPool('quebrado'))
+        reset.assert_called_once()
+        for html in rendered:
+            self.assertIn('<img', html)
+            self.assertNotIn(formula, html)
+        for questao in Questao.objects.filter(pk__in=[q.pk for q in self.questoes]):
+            self.assertFalse(questao.rendered_is_stale('enunciado'))
+
+    def test_broken_pool_on_result_falls_back_to_inline_rendering(self):
+        formula = self._formula()
+        self._tornar_desatualizadas(f'<p>{formula}</p>')
+        rendered, reset = self._listar(_FakeRenderPool('quebra_no_resultado'))
+        reset.assert_called_once()
+        for html in rendered:
+            self.assertIn('<img', html)
+            self.assertNotIn(formula, html)
+
+
+class MathRewriterTests(SimpleTestCase):
+    """rewrite_math: reconhece as seis formas de fórmula e copia todo o resto byte a byte."""
+
+    def _fragments(self, html, **kwargs):
+        from app.math_rewriter import rewrite_math
+        found = []
+        self.assertEqual(rewrite_math(html, lambda f: found.append(f), **kwargs), html)
+        return [(f.kind, f.latex, f.display, f.sole_child) for f in found]
+
+    def _rewrite(self, html, **kwargs):
+        from app.math_rewriter import rewrite_math
+        return rewrite_math(html, lambda f: f'[{f.kind}]', **kwargs)
+
+    def test_delimited_forms(self):
+        self.assertEqual(self._fragments('<p>a $x$ b $$y$$ c \\(z\\) d \\[w\\]</p>'), [
+            ('delimited', '$x$', False, False),
+            ('delimited', '$$y$$', True, False),
+            ('delimited', '\\(z\\)', False, False),
+            ('delimited', '\\[w\\]', True, False),
+        ])
+        self.assertEqual(self._fragments('<div>\\[a &lt; b\\]</div>'), [('delimited', '\\[a < b\\]', True, True)])
+
+    def test_math_tex_span(self):
+        self.assertEqual(self._fragments('<p><span class="math-tex">\\(a&lt;b\\)</span></p>'), [
+            ('span', '\\(a<b\\)', False, True),
+        ])
+        self.assertEqual(self._fragments("<p>texto <SPAN class='x math-tex'>\\[c\\]</SPAN></p>"), [
+            ('span', '\\[c\\]', True, False),
+        ])
+
+    def test_script_math_tex(self):
+        self.assertEqual(self._fragments(
+            '<div><script type="math/tex; mode=display">x^2</script></div>'
+            '<p>e <script type="math/tex">y &amp; z</script></p><script>var a = "$b$";</script>'
+        ), [
+            ('script', 'x^2', True, True),
+            ('script', 'y & z', False, False),
+        ])
+
+    def test_nested_span_inside_formula(self):
+        html = '<p><span class="math-tex">\\(a<span style="color:red">b</span>c\\)</span> depois</p>'
+        self.assertEqual(self._fragments(html), [('span', '\\(abc\\)', False, False)])
+        self.assertEqual(self._rewrite(html), '<p>[span] depois</p>')
+
+    def test_markup_outside_math_is_untouched(self):
+        html = (
+            "<!DOCTYPE html><P CLASS='a'  data-x=\"$1$\">R$ 5,00&nbsp;e <a href='/q?x=$y$'>link</a>"
+            "<!-- $comentario$ --> fim $x$.</P><style>.a::before{content:'$z$'}</style>"
+            '<span class="destaque">\\(k\\)</span><img src="a.png" alt="$w$">'
+        )
+        self.assertEqual(self._rewrite(html), (
+            "<!DOCTYPE html><P CLASS='a'  data-x=\"$1$\">R$ 5,00&nbsp;e <a href='/q?x=$y$'>link</a>"
+            "<!-- $comentario$ --> fim [delimited].</P><style>.a::before{content:'$z$'}</style>"
+            '<span class="destaque">[delimited]</span><img src="a.png" alt="$w$">'
+        ))
+        # Sem envolver em <html><body>; sem fórmulas, a entrada volta inalterada
+        self.assertEqual(self._rewrite('<p>sem fórmulas</p>'), '<p>sem fórmulas</p>')
+
+    def test_kinds_and_formulas_across_tags(self):
+        html = '<p>$a$ <span class="math-tex">\\(b\\)</span> $c<sup>2</sup>$</p>'
+        self.assertEqual(self._rewrite(html, kinds=('span',)), '<p>$a$ [span] $c<sup>2</sup>$</p>')
+        # Fórmula delimitada atravessando tags não é reconhecida (como nas passadas antigas, por nó de texto);
+        # sem 'span' em kinds, o conteúdo do span.math-tex é texto comum
+        self.assertEqual(self._rewrite(html, kinds=('delimited',)),
+                         '<p>[delimited] <span class="math-tex">[delimited]</span> $c<sup>2</sup>$</p>')
+
+
+class QuestaoRenderedHtmlTests(TestCase):
+    """O HTML com fórmulas renderizadas é gravado no save() e refeito só quando o campo-fonte muda."""
+
+    @classmethod
+    def setUpTestData(cls):
+        area = Conteudo.objects.create(nome='Matemática', tipo='area')
+        cls.questao = Questao.objects.create(
+            area=area, ano=2024, banca='FGV', tipo_questao='objetiva', dificuldade='facil',
+            grau_escolaridade='medio', enunciado='<p>Seja $x^2$</p>', resposta='<p>Resposta</p>',
+        )
+
+    def test_save_stores_rendered_html(self):
+        questao = Questao.objects.get(pk=self.questao.pk)
+        self.assertIn('<img', questao.enunciado_rendered)
+        self.assertNotIn('$x^2$', questao.enunciado_rendered)
+        self.assertIn('Resposta', questao.resposta_rendered)
+        with self.assertNumQueries(0):
+            self.assertEqual(questao.get_rendered('enunciado'), questao.enunciado_rendered)
+
+    def test_stale_html_is_refreshed_and_persisted(self):
+        Questao.objects.filter(pk=self.questao.pk).update(enunciado='<p>Seja $y^3$</p>')
+        questao = Questao.objects.get(pk=self.questao.pk)
+        with self.assertNumQueries(1):
+            html = questao.get_rendered('enunciado')
+        self.assertIn('<img', html)
+        self.assertNotEqual(html, self.questao.enunciado_rendered)
+        questao = Questao.objects.get(pk=self.questao.pk)
+        self.assertEqual(questao.enunciado_rendered, html)
+        with self.assertNumQueries(0):
+            questao.get_rendered('enunciado')
+
+    def test_save_with_update_fields_refreshes_rendered(self):
+        questao = Questao.objects.get(pk=self.questao.pk)
+        questao.enunciado = '<p>Sem fórmula</p>'
+        questao.save(update_fields=['enunciado'])
+        questao = Questao.objects.get(pk=self.questao.pk)
+        self.assertNotIn('<img', questao.enunciado_rendered)
+        self.assertIn('Sem fórmula', questao.enunciado_rendered)
+
+
+class QuestaoImagemTests(TestCase):
+    """has_image e QuestaoImagem são mantidos no save() e usados pelo filtro tem_imagem."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='prof', password='x')
+        taxonomia = _criar_taxonomia()
+        cls.com_imagem, = _criar_questoes(
+            taxonomia, 1,
+            enunciado='<p><img alt="" src="/media/uploads/fig%201.png" style="height:120px; width:240px" /></p>',
+            resposta='<p><img src="https://exemplo.com/a.png" width="10" height="20"></p>'
+                     '<p><img src="data:image/png;base64,AAAA"></p>',
+        )
+        cls.sem_imagem, = _criar_questoes(taxonomia, 1)
+
+    def test_image_refs_are_recorded(self):
+        refs = sorted(self.com_imagem.imagens.values_list('campo', 'caminho', 'local', 'largura', 'altura'))
+        self.assertEqual(refs, [
+            ('enunciado', 'uploads/fig 1.png', True, 240, 120),
+            ('resposta', 'https://exemplo.com/a.png', False, 10, 20),
+        ])
+        self.assertTrue(self.com_imagem.has_image)
+        self.assertFalse(self.sem_imagem.has_image)
+
+    def test_tem_imagem_filter_uses_flag(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get('/api/questoes/?tem_imagem=true')
+        self.assertEqual([item['id'] for item in response.json()['results']], [self.com_imagem.pk])
+        self.assertNotIn('<img', ' '.join(q['sql'] for q in ctx.captured_queries))
+
+    def test_refs_follow_edits(self):
+        self.com_imagem.enunciado = '<p>Sem figura</p>'
+        self.com_imagem.resposta = '<p>Sem figura</p>'
+        self.com_imagem.save(update_fields=['enunciado', 'resposta'])
+        self.com_imagem.refresh_from_db()
+        self.assertFalse(self.com_imagem.has_image)
+        self.assertFalse(self.com_imagem.imagens.exists())
+
+
+class ConteudoClosureTests(TestCase):
+    """A tabela de fechamento acompanha criação e movimentação de nós e resolve o filtro por área em uma query."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='prof', password='x')
+        cls.mat = _criar_taxonomia()
+        cls.qui = {'area': Conteudo.objects.create(nome='Química', tipo='area')}
+        cls.qui['unidade'] = Conteudo.objects.create(nome='Orgânica', tipo='unidade', pai=cls.qui['area'])
+        cls.outra_unidade = Conteudo.objects.create(nome='Inorgânica', tipo='unidade', pai=cls.qui['area'])
+        cls.q_mat, = _criar_questoes(cls.mat, 1)
+        cls.q_org, = _criar_questoes(cls.qui, 1)
+        cls.q_inorg, = _criar_questoes({'area': cls.qui['area'], 'unidade': cls.outra_unidade}, 1)
+
+    def _pairs(self):
+        return set(ConteudoAncestral.objects.values_list('ancestral_id', 'descendente_id', 'profundidade'))
+
+    def test_closure_matches_rebuild_after_move(self):
+        self.assertIn((self.mat['area'].pk, self.mat['categoria'].pk, 4), self._pairs())
+        self.mat['topico'].pai = self.outra_unidade
+        self.mat['topico'].save()
+        pairs = self._pairs()
+        self.assertIn((self.qui['area'].pk, self.mat['categoria'].pk, 4), pairs)
+        self.assertNotIn((self.mat['area'].pk, self.mat['categoria'].pk, 4), pairs)
+        rebuild_closure()
+        self.assertEqual(self._pairs(), pairs)
+
+    def test_failed_closure_update_rolls_back_move(self):
+        from unittest import mock
+        pairs = self._pairs()
+        self.mat['topico'].pai = self.outra_unidade
+        with mock.patch.object(ConteudoAncestral, 'move_subtree', side_effect=RuntimeError('falha')):
+            with self.assertRaises(RuntimeError):
+                self.mat['topico'].save()
+        self.assertEqual(Conteudo.objects.get(pk=self.mat['topico'].pk).pai_id, self.mat['unidade'].pk)
+        self.assertEqual(self._pairs(), pairs)
+
+    def test_cannot_move_into_own_subtree(self):
+        self.mat['area'].pai = self.mat['categoria']
+        with self.assertRaises(ValueError):
+            self.mat['area'].save()
+
+    def test_area_with_children_filter_is_single_query(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = (f"/api/questoes/?paginate=false&fields=id&area_id={self.mat['area'].pk}"
+               f"&area_id={self.qui['area'].pk}&unidade_id={self.qui['unidade'].pk}")
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(url)
+        self.assertCountEqual([item['id'] for item in response.json()], [self.q_mat.pk, self.q_org.pk])
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_conteudo_filter_matches_whole_subtree(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        def ids(query):
+            with CaptureQueriesContext(connection) as ctx:
+                response = client.get(f'/api/questoes/?paginate=false&fields=id&{query}')
+            self.assertEqual(len(ctx.captured_queries), 1)
+            return sorted(item['id'] for item in response.json())
+
+        qui = self.qui['area'].pk
+        self.assertEqual(ids(f'conteudo_id={qui}'), sorted([self.q_org.pk, self.q_inorg.pk]))
+        self.assertEqual(ids(f"conteudo_id={self.qui['unidade'].pk}"), [self.q_org.pk])
+        # Nó profundo e vários nós de uma vez
+        self.assertEqual(ids(f"conteudo_id={self.mat['subtopico'].pk}"), [self.q_mat.pk])
+        self.assertEqual(ids(f"conteudo_ids={self.mat['topico'].pk}&conteudo_ids={self.outra_unidade.pk}"),
+                         sorted([self.q_mat.pk, self.q_inorg.pk]))
+        # Segue a árvore: o tópico movido leva as questões junto
+        self.mat['topico'].pai = self.outra_unidade
+        self.mat['topico'].save()
+        self.assertEqual(ids(f'conteudo_id={qui}'), sorted([self.q_mat.pk, self.q_org.pk, self.q_inorg.pk]))
+
+
+@override_settings(TAXONOMY_VERSION_CHECK_INTERVAL=60)
+class TaxonomySnapshotTests(TestCase):
+    """A árvore de conteúdos é lida da memória e recarregada quando a geração muda."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.taxonomia = _criar_taxonomia()
+
+    def setUp(self):
+        # O rollback entre testes desfaz gerações que o snapshot do processo já viu
+        taxonomy._snapshot = None
+
+    def test_reads_do_not_hit_database(self):
+        area = self.taxonomia['area']
+        get_taxonomy()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(f'/api/buscar-conteudos/?pai_id={area.pk}')
+        self.assertEqual(response.json(), [{'id': self.taxonomia['unidade'].pk, 'nome': 'Álgebra'}])
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+    def test_write_invalidates_snapshot(self):
+        area = self.taxonomia['area']
+        version = get_taxonomy().version
+        nova = Conteudo.objects.create(nome='Geometria', tipo='unidade', pai=area)
+        snapshot = get_taxonomy()
+        self.assertGreater(snapshot.version, version)
+        self.assertIn(nova.pk, [node.id for node in snapshot.children_of(area.pk)])
+        nova.delete()
+        self.assertIsNone(get_taxonomy().get(nova.pk))
+
+    def test_queryset_delete_invalidates_snapshot_and_etag(self):
+        categoria = self.taxonomia['categoria']
+        etag = self.client.get('/api/conteudos/tree/')['ETag']
+        self.assertIsNotNone(get_taxonomy().get(categoria.pk))
+        # Ação "excluir selecionados" do admin: QuerySet.delete(), sem Conteudo.delete()
+        Conteudo.objects.filter(pk=categoria.pk).delete()
+        self.assertIsNone(get_taxonomy().get(categoria.pk))
+        self.assertNotEqual(self.client.get('/api/conteudos/tree/')['ETag'], etag)
+
+
+class ConteudoTreeTests(TestCase):
+    """/api/conteudos/tree/ entrega a árvore inteira com ETag derivado da versão da taxonomia."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.taxonomia = _criar_taxonomia()
+        _criar_questoes(cls.taxonomia, 2)
+        _criar_questoes({'area': cls.taxonomia['area'], 'unidade': cls.taxonomia['unidade']}, 1)
+
+    def test_nested_tree_with_counts(self):
+        tree = self.client.get('/api/conteudos/tree/?counts=1').json()
+        area = tree[0]
+        self.assertEqual((area['nome'], area['questoes'], area['questoes_diretas']), ('Matemática', 3, 0))
+        unidade = area['filhos'][0]
+        self.assertEqual((unidade['questoes'], unidade['questoes_diretas']), (3, 1))
+        categoria = unidade['filhos'][0]['filhos'][0]['filhos'][0]
+        self.assertEqual((categoria['questoes'], categoria['filhos']), (2, []))
+
+    def test_columnar_layout(self):
+        tree = self.client.get('/api/conteudos/tree/?layout=columnar').json()
+        self.assertEqual(set(tree), {'id', 'nome', 'tipo', 'pai_id'})
+        self.assertEqual(len(tree['id']), 5)
+
+    def test_etag_revalidation(self):
+        response = self.client.get('/api/conteudos/tree/')
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/api/conteudos/tree/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Conteudo.objects.create(nome='Geometria', tipo='unidade', pai=self.taxonomia['area'])
+        response = self.client.get('/api/conteudos/tree/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class ConteudoCounterTests(TestCase):
+    """Contadores de questões por conteúdo acompanham criação, reclassificação e exclusão."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.taxonomia = _criar_taxonomia()
+        cls.outra_unidade = Conteudo.objects.create(nome='Geometria', tipo='unidade', pai=cls.taxonomia['area'])
+        cls.questoes = _criar_questoes(cls.taxonomia, 3)
+
+    def _counters(self, node):
+        node.refresh_from_db()
+        return node.questoes_diretas, node.questoes_total
+
+    def test_counters_follow_writes(self):
+        area, categoria = self.taxonomia['area'], self.taxonomia['categoria']
+        self.assertEqual(self._counters(area), (0, 3))
+        self.assertEqual(self._counters(categoria), (3, 3))
+
+        questao = self.questoes[0]
+        questao.unidade, questao.topico, questao.subtopico, questao.categoria = self.outra_unidade, None, None, None
+        questao.save()
+        self.assertEqual(self._counters(categoria), (2, 2))
+        self.assertEqual(self._counters(self.outra_unidade), (1, 1))
+        self.assertEqual(self._counters(area), (0, 3))
+
+        self.questoes[1].delete()
+        self.assertEqual(self._counters(area), (0, 2))
+        self.assertEqual(self._counters(self.taxonomia['unidade']), (0, 1))
+
+    def test_queryset_delete_keeps_counters_index_and_generation(self):
+        from app.models import Geracao
+        from app.search import search_questoes
+        area, categoria = self.taxonomia['area'], self.taxonomia['categoria']
+        geracao = Geracao.current(Questao.GERACAO)
+        # Mesmo caminho da ação "excluir selecionados" do admin: QuerySet.delete()
+        Questao.objects.filter(pk__in=[q.pk for q in self.questoes[:2]]).delete()
+        self.assertEqual(self._counters(area), (0, 1))
+        self.assertEqual(self._counters(categoria), (1, 1))
+        self.assertGreater(Geracao.current(Questao.GERACAO), geracao)
+        self.assertEqual(list(search_questoes(Questao.objects.all(), 'Enunciado').values_list('pk', flat=True)),
+                         [self.questoes[2].pk])
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT COUNT(*) FROM app_questao_fts')
+                self.assertEqual(cursor.fetchone()[0], 1)
+        # O último decremento não viola o CHECK dos contadores
+        Questao.objects.all().delete()
+        self.assertEqual(self._counters(categoria), (0, 0))
+
+    def test_conteudo_save_keeps_counters(self):
+        stale = Conteudo.objects.get(pk=self.taxonomia['area'].pk)
+        _criar_questoes(self.taxonomia, 1)
+        stale.nome = 'Matemática Básica'
+        stale.save()
+        self.assertEqual(self._counters(stale), (0, 4))
+
+    def test_reconcile_fixes_drift(self):
+        from django.core.management import call_command
+        Conteudo.objects.filter(pk=self.taxonomia['area'].pk).update(questoes_total=99)
+        call_command('reconcile_question_counters', stdout=io.StringIO())
+        self.assertEqual(self._counters(self.taxonomia['area']), (0, 3))
+
+    def test_index_uses_counters(self):
+        self.client.force_login(User.objects.create_user(username='prof', password='x'))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/')
+        self.assertContains(response, '3 questão')
+        self.assertNotIn('app_questao', ' '.join(q['sql'] for q in ctx.captured_queries))
+
+
+class QuestaoQueryPlanTests(TestCase):
+    """
+    Os formatos de filtro/ordenação mais comuns das listagens usam índice (EXPLAIN do SQLite),
+    sobre um banco sintético grande o bastante para o planner preferir índices a varreduras.
+    """
+    TOTAL = 5000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.areas = []
+        for a in range(6):
+            area = Conteudo.objects.create(nome=f'Área {a}', tipo='area')
+            unidades = [Conteudo.objects.create(nome=f'Unidade {a}.{u}', tipo='unidade', pai=area) for u in range(5)]
+            cls.areas.append((area, unidades))
+        bancas = ['FGV', 'CESPE', 'VUNESP', 'ENEM', 'FUVEST', 'UNICAMP', 'CESGRANRIO', 'FCC']
+        rows = []
+        for i in range(cls.TOTAL):
+            area, unidades = cls.areas[i % len(cls.areas)]
+            rows.append(Questao(
+                area=area, unidade=unidades[i % len(unidades)], ano=2000 + i % 25, banca=bancas[i % len(bancas)],
+                tipo_questao=('objetiva', 'discursiva')[i % 2], dificuldade=('facil', 'medio', 'dificil')[i % 3],
+                grau_escolaridade=('fundamental', 'medio', 'superior')[i % 3], has_image=i % 10 == 0,
+                enunciado='<p>Enunciado</p>', resposta='<p>Resposta</p>',
+            ))
+        Questao.objects.bulk_create(rows, batch_size=500)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def _list_queryset(self, query):
+        from app.views import QuestaoViewSet
+        request = APIRequestFactory().get(f'/api/questoes/?{query}')
+        view = QuestaoViewSet(action_map={'get': 'list'})
+        view.setup(request)
+        view.request = view.initialize_request(request)
+        view.format_kwarg = None
+        return view.get_queryset()
+
+    def assertUsesIndex(self, queryset, allow_pk_scan=False):
+        """Sem varredura da tabela nem ordenação em tabela temporária (allow_pk_scan: varrer em ordem de id)."""
+        if connection.vendor != 'sqlite':
+            # Só o formato do EXPLAIN do SQLite foi verificado com estes dados; no PostgreSQL a
+            # escolha entre índice e Seq Scan depende da seletividade e das estatísticas
+            self.skipTest('planos verificados só no SQLite')
+        plan = queryset.explain()
+        questao_lines = [line for line in plan.splitlines() if 'app_questao ' in line or line.endswith('app_questao')]
+        self.assertTrue(questao_lines, plan)
+        if not allow_pk_scan:
+            self.assertTrue(all('USING' in line for line in questao_lines if 'SCAN app_questao' in line), plan)
+        self.assertNotIn('TEMP B-TREE FOR ORDER BY', plan, plan)
+
+    def test_filter_shapes_use_indexes(self):
+        area, unidades = self.areas[0]
+        shapes = [
+            f'area_id={area.pk}',
+            f'area_id={area.pk}&unidade_id={unidades[1].pk}',
+            'ano=2010',
+            'banca=FGV',
+            'banca=FGV&ano=2010',
+            'tem_imagem=true',
+        ]
+        for shape in shapes:
+            with self.subTest(shape=shape):
+                self.assertUsesIndex(self._list_queryset(shape))
+
+    def test_sort_keys_use_indexes(self):
+        for key, ordering in Questao.ORDERINGS.items():
+            with self.subTest(ordering=key):
+                # Sem filtro, ordenar por id é percorrer a chave primária
+                self.assertUsesIndex(self._list_queryset('fields=id,ano').order_by(*ordering),
+                                     allow_pk_scan=ordering[0].lstrip('-') == 'id')
+
+    def test_page_order_by_is_restricted(self):
+        self.client.force_login(User.objects.create_user(username='prof', password='x'))
+        response = self.client.get('/questoes/?order_by=enunciado')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['page_obj'][0].pk, Questao.objects.order_by('-id').first().pk)
+
+
+class QuestaoFacetsTests(TestCase):
+    """/api/questoes/facets/ conta por valor de cada faceta numa única query, com cache por filtro."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='prof', password='x')
+        taxonomia = _criar_taxonomia()
+        _criar_questoes(taxonomia, 3, banca='FGV', ano=2023)
+        _criar_questoes(taxonomia, 2, banca='CESPE', ano=2023)
+        _criar_questoes(taxonomia, 1, banca='CESPE', ano=2024, dificuldade='dificil')
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _facets(self, query=''):
+        response = self.client.get(f'/api/questoes/facets/?{query}')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return data['total'], {field: {item['value']: item['count'] for item in items}
+                               for field, items in data['facets'].items()}
+
+    def test_counts_are_disjunctive(self):
+        total, facets = self._facets('banca=FGV')
+        self.assertEqual(total, 3)
+        # A própria faceta ignora a seleção; as outras respeitam
+        self.assertEqual(facets['banca'], {'FGV': 3, 'CESPE': 3})
+        self.assertEqual(facets['ano'], {2023: 3})
+        total, facets = self._facets('banca=CESPE&ano=2024')
+        self.assertEqual((total, facets['banca'], facets['ano']), (1, {'CESPE': 1}, {2023: 2, 2024: 1}))
+
+    def test_single_grouped_query_and_cache(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self._facets('dificuldade=facil')
+        grouped = [q['sql'] for q in ctx.captured_queries if 'GROUP BY' in q['sql']]
+        self.assertEqual(len(grouped), 1)
+        with CaptureQueriesContext(connection) as ctx:
+            self._facets('dificuldade=facil')
+        self.assertFalse([q for q in ctx.captured_queries if 'GROUP BY' in q['sql']])
+
+    def test_write_invalidates_cache(self):
+        self.assertEqual(self._facets()[0], 6)
+        _criar_questoes(_criar_taxonomia(), 1, banca='VUNESP')
+        total, facets = self._facets()
+        self.assertEqual((total, facets['banca']['VUNESP']), (7, 1))
+
+
+class UniqueValuesTests(TestCase):
+    """get_unique_values serve os valores do cache versionado, com ETag e opção de todos os campos."""
+
+    @classmethod
+    def setUpTestData(cls):
+        taxonomia = _criar_taxonomia()
+        _criar_questoes(taxonomia, 1, banca='FGV', ano=2023)
+        _criar_questoes(taxonomia, 1, banca='CESPE', ano=2024)
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def test_single_field_and_all(self):
+        self.assertEqual(self.client.get('/api/unique-values/?field=ano').json(), [2024, 2023])
+        data = self.client.get('/api/unique-values/?field=all').json()
+        self.assertEqual(data['banca'], ['CESPE', 'FGV'])
+        self.assertEqual(set(data), {'ano', 'banca', 'tipo_questao', 'dificuldade', 'grau_escolaridade'})
+        self.assertEqual(self.client.get('/api/unique-values/?field=enunciado').status_code, 400)
+
+    def test_etag_changes_on_write(self):
+        etag = self.client.get('/api/unique-values/?field=banca')['ETag']
+        response = self.client.get('/api/unique-values/?field=banca', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        _criar_questoes(_criar_taxonomia(), 1, banca='VUNESP')
+        response = self.client.get('/api/unique-values/?field=banca', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.json(), ['CESPE', 'FGV', 'VUNESP'])
+
+
+class ResultIdsCacheTests(TestCase):
+    """A paginação por página reaproveita a lista de ids do filtro; escritas invalidam."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='prof', password='x')
+        cls.taxonomia = _criar_taxonomia()
+        _criar_questoes(cls.taxonomia, 5, banca='FGV')
+        _criar_questoes(cls.taxonomia, 2, banca='CESPE')
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _page(self, page):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(f'/api/questoes/?banca=FGV&page={page}&page_size=2')
+        self.assertEqual(response.status_code, 200)
+        filtered = [q['sql'] for q in ctx.captured_queries if '"banca" IN' in q['sql']]
+        return response.json(), filtered
+
+    def test_second_page_reuses_cached_ids(self):
+        first, filtered = self._page(1)
+        self.assertEqual(first['count'], 5)
+        self.assertEqual(len(filtered), 1)
+        second, filtered = self._page(2)
+        self.assertFalse(filtered)
+        ids = [item['id'] for item in first['results'] + second['results']]
+        self.assertEqual(ids, sorted(ids, reverse=True))
+
+    def test_write_invalidates_cached_ids(self):
+        self.assertEqual(self._page(1)[0]['count'], 5)
+        _criar_questoes(self.taxonomia, 1, banca='FGV')
+        data, filtered = self._page(1)
+        self.assertEqual((data['count'], len(filtered)), (6, 1))
+
+    def test_page_view_uses_cached_ids(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/questoes/?banca=CESPE')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['page_obj'].object_list), 2)
+        self.assertEqual(response.context['filtros_ativos']['bancas'], ['CESPE'])
+
+    @override_settings(RESULT_IDS_CACHE_MAX_IDS=3)
+    def test_large_result_falls_back_to_queryset_pagination(self):
+        ids, id_queries = [], []
+        for page in (1, 2, 3):
+            data, filtered = self._page(page)
+            self.assertEqual(data['count'], 5)
+            id_queries += [sql for sql in filtered if sql.startswith('SELECT "app_questao"."id" AS "id" FROM')]
+            ids += [item['id'] for item in data['results']]
+        # Só max + 1 ids são lidos, uma vez: o "grande demais" fica em cache
+        self.assertEqual(len(id_queries), 1)
+        self.assertIn('LIMIT 4', id_queries[0])
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(ids, sorted(ids, reverse=True))
+
+    @override_settings(RESULT_IDS_CACHE_MAX_IDS=1)
+    def test_page_view_falls_back_to_queryset_pagination(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/questoes/?banca=CESPE')
+        self.assertEqual(response.status_code, 200)
+        page_obj = response.context['page_obj']
+        self.assertEqual(page_obj.paginator.count, 2)
+        self.assertEqual([q.banca for q in page_obj.object_list], ['CESPE', 'CESPE'])
+
+
+@override_settings(TAXONOMY_VERSION_CHECK_INTERVAL=60)
+class DetailCacheTests(TestCase):
+    """Detalhe em cache pela versão da linha (válida entre workers); recálculo concorrente é serializado."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='prof', password='x')
+        cls.taxonomia = _criar_taxonomia()
+        cls.questoes = _criar_questoes(cls.taxonomia, 2)
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        taxonomy._snapshot = None
+        get_taxonomy()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _detail(self, questao, query=''):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(f'/api/questoes/{questao.pk}/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(ctx.captured_queries)
+
+    def test_detail_invalidated_by_question_write(self):
+        primeira, segunda = self.questoes
+        self._detail(primeira)
+        self._detail(segunda)
+        self.assertEqual(self._detail(primeira)[1], 1)
+        primeira.banca = 'CESPE'
+        primeira.save()
+        data, queries = self._detail(primeira)
+        self.assertEqual((data['banca'], queries), ('CESPE', 2))
+        # A escrita na primeira não invalida o detalhe da segunda
+        self.assertEqual(self._detail(segunda)[1], 1)
+
+    def test_write_from_other_worker_invalidates_detail(self):
+        from django.utils import timezone
+        questao = self.questoes[0]
+        self._detail(questao)
+        # Outro processo: altera a linha (e sua versão), sem tocar no cache deste processo
+        Questao.objects.filter(pk=questao.pk).update(banca='VUNESP', atualizado_em=timezone.now())
+        self.assertEqual(self._detail(questao)[0]['banca'], 'VUNESP')
+
+    def test_missing_or_invalid_pk_is_404(self):
+        self.assertEqual(self.client.get('/api/questoes/999999/').status_code, 404)
+        self.assertEqual(self.client.get('/api/questoes/abc/').status_code, 404)
+
+    def test_update_fields_save_changes_version(self):
+        questao = self.questoes[0]
+        self._detail(questao)
+        questao.banca = 'FCC'
+        questao.save(update_fields=['banca'])
+        self.assertEqual(self._detail(questao)[0]['banca'], 'FCC')
+
+    def test_variant_key_is_hashed(self):
+        from django.core.cache import cache
+        questao = self.questoes[0]
+        self._detail(questao, 'fields=id,banca&x=' + 'a%20b' * 200)
+        keys = [key for key in cache._cache if ':questao:' in key]
+        self.assertTrue(keys)
+        self.assertTrue(all(' ' not in key and len(key) < 250 for key in keys))
+
+    def test_taxonomy_write_invalidates_detail(self):
+        questao = self.questoes[0]
+        self._detail(questao)
+        area = self.taxonomia['area']
+        area.nome = 'Matemática Básica'
+        area.save()
+        self.assertEqual(self._detail(questao)[0]['area']['nome'], 'Matemática Básica')
+
+    def test_cadastro_does_not_clear_cache(self):
+        from django.core.cache import cache
+        cache.set('outra-coisa', 1)
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        dados = {
+            'area': self.taxonomia['area'].pk, 'ano': 2024, 'banca': 'FGV', 'tipo_questao': 'objetiva',
+            'dificuldade': 'facil', 'grau_escolaridade': 'medio',
+            'enunciado': '<p>Nova</p>', 'resposta': '<p>Resposta</p>',
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/cadastro_questao/', dados)
+        self.assertEqual(Questao.objects.count(), 3)
+        self.assertEqual(cache.get('outra-coisa'), 1)
+
+    @override_settings(CACHE_LOCK_WAIT=0.1)
+    def test_locked_key_is_computed_without_storing(self):
+        from django.core.cache import cache
+        from app.caching import get_or_compute
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return 'valor'
+
+        cache.add('lock:chave', 1)
+        self.assertEqual(get_or_compute('chave', compute, 60), 'valor')
+        self.assertIsNone(cache.get('chave'))
+        cache.delete('lock:chave')
+        get_or_compute('chave', compute, 60)
+        self.assertEqual(get_or_compute('chave', compute, 60), 'valor')
+        self.assertEqual(len(calls), 2)
+
+
+@override_settings(EXPORT_JOB_RETRY_DELAY=0)
+class ExportacaoProvaTests(TestCase):
+    """Exportação assíncrona: a view só enfileira; o export_worker gera, retenta e limpa."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='prof', password='x')
+        cls.questoes = _criar_questoes(_criar_taxonomia(), 2)
+
+    def setUp(self):
+        import tempfile
+        from unittest import mock
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings_override = override_settings(EXPORT_JOBS_DIR=tmp.name, EXPORT_CACHE_DIR=f'{tmp.name}/cache')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.convert = mock.patch('app.exam._convert_with_pandoc', return_value=b'DOCX').start()
+        self.addCleanup(mock.patch.stopall)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _submit(self, **extra):
+        data = {'question_ids': [q.pk for q in self.questoes], 'test_name': 'simulado', **extra}
+        response = self.client.post('/api/export-jobs/', data, format='json')
+        self.assertEqual(response.status_code, 202)
+        return response.json()
+
+    def _work(self):
+        from django.core.management import call_command
+        call_command('export_worker', '--once', stdout=io.StringIO())
+
+    def test_submit_work_and_download(self):
+        job = self._submit()
+        self.assertEqual(job['status'], 'pendente')
+        self.convert.assert_not_called()
+        self._work()
+        status = self.client.get(f"/api/export-jobs/{job['id']}/").json()
+        self.assertEqual((status['status'], status['progresso']), ('concluida', 100))
+        response = self.client.get(status['download_url'])
+        self.assertEqual(b''.join(response.streaming_content), b'DOCX')
+        self.assertIn('simulado.docx', response['Content-Disposition'])
+        # Tarefas de outro usuário não são visíveis
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username='outro', password='x'))
+        self.assertEqual(other.get(f"/api/export-jobs/{job['id']}/").status_code, 404)
+
+    def test_failures_are_retried_then_marked_failed(self):
+        from app.models import ExportacaoProva
+        self.convert.side_effect = RuntimeError('pandoc quebrou')
+        job_id = self._submit()['id']
+        with self.settings(EXPORT_JOB_MAX_ATTEMPTS=2), self.assertLogs('app.exports', 'WARNING'):
+            self._work()
+            job = ExportacaoProva.objects.get(pk=job_id)
+            # _work() com --once reprocessa a tarefa enquanto ela estiver disponível
+            self.assertEqual((job.status, job.tentativas), ('falhou', 2))
+            self.assertIn('pandoc quebrou', job.erro)
+        self.assertEqual(self.client.get(f'/api/export-jobs/{job_id}/download/').status_code, 409)
+
+    def test_stale_jobs_requeued_and_old_jobs_cleaned(self):
+        import os
+        from datetime import timedelta
+        from django.utils import timezone
+        from app.exports import artifact_path, claim_next, cleanup_exports, requeue_stale
+        from app.models import ExportacaoProva
+        stale_id = self._submit()['id']
+        claim_next('morto')
+        ExportacaoProva.objects.filter(pk=stale_id).update(iniciado_em=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale(), 1)
+        self.assertEqual(ExportacaoProva.objects.get(pk=stale_id).status, 'pendente')
+        self._work()
+        job = ExportacaoProva.objects.get(pk=stale_id)
+        path = artifact_path(job)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(cleanup_exports(), 0)
+        self.assertEqual(cleanup_exports(now=timezone.now() + timedelta(days=2)), 1)
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(ExportacaoProva.objects.filter(pk=stale_id).exists())
+
+    def test_artifact_is_hard_link_to_cached_document(self):
+        import os
+        import time
+        from django.conf import settings
+        from app.exports import artifact_path, cleanup_export_cache
+        from app.models import ExportacaoProva
+        job_id = self._submit()['id']
+        self._work()
+        path = artifact_path(ExportacaoProva.objects.get(pk=job_id))
+        cached = [os.path.join(dirpath, name) for dirpath, _, names in os.walk(settings.EXPORT_CACHE_DIR)
+                  for name in names if name.endswith('.docx')]
+        self.assertEqual(len(cached), 1)
+        self.assertTrue(os.path.samefile(path, cached[0]))
+        # Tirar o documento do cache não apaga o arquivo da tarefa
+        self.assertEqual(cleanup_export_cache(now=time.time() + 30 * 24 * 3600), 1)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'DOCX')
+
+    def test_criar_prova_enqueues_and_redirects(self):
+        self.client.force_login(self.user)
+        response = self.client.post('/criar-prova/', {
+            'question_ids': [q.pk for q in self.questoes], 'gabarito_option': 'somente_questoes',
+            'test_name': 'lista',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.convert.assert_not_called()
+        page = self.client.get(response['Location'])
+        self.assertContains(page, 'lista.docx')
+        self.assertContains(page, 'window.location.reload')
+        self.assertContains(page, 'export_worker')
+
+    def test_status_page_generates_unclaimed_job(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from app.models import ExportacaoProva
+        self.client.force_login(self.user)
+        job_id = self._submit()['id']
+        # Recém-enviada: ainda é do worker
+        self.assertEqual(self.client.get(f'/criar-prova/exportacao/{job_id}/').context['job'].status, 'pendente')
+        self.convert.assert_not_called()
+        ExportacaoProva.objects.filter(pk=job_id).update(disponivel_em=timezone.now() - timedelta(minutes=1))
+        with self.assertLogs('app.exports', 'WARNING'):
+            page = self.client.get(f'/criar-prova/exportacao/{job_id}/')
+        self.assertContains(page, 'Baixar Prova')
+        job = ExportacaoProva.objects.get(pk=job_id)
+        self.assertEqual((job.status, job.worker.split(':')[0]), ('concluida', 'sync'))
+        self.assertEqual(self.convert.call_count, 1)
+
+    def test_sync_fallback_leaves_claimed_or_disabled_jobs_alone(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from app.exports import claim_next
+        from app.models import ExportacaoProva
+        first, second = self._submit()['id'], self._submit()['id']
+        ExportacaoProva.objects.update(disponivel_em=timezone.now() - timedelta(minutes=1))
+        claim_next('worker-vivo')
+        self.assertEqual(self.client.get(f'/api/export-jobs/{first}/').json()['status'], 'executando')
+        with self.settings(EXPORT_SYNC_FALLBACK_AFTER=0):
+            self.assertEqual(self.client.get(f'/api/export-jobs/{second}/').json()['status'], 'pendente')
+        self.convert.assert_not_called()
+
+
+_FAKE_PANDOC = '''#!{python}
+import json, sys
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+if sys.argv[1:2] != ['server']:
+    sys.exit(1)
+port = int(sys.argv[sys.argv.index('--port') + 1])
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._send(b'3.1.11')
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self._send(('%s|%s|%s' % (data['to'], len(data['text']), ','.join(sorted(data.get('files', {}))))).encode())
+
+
+HTTPServer(('127.0.0.1', port), Handler).serve_forever()
+'''
+
+
+class PandocPoolTests(TestCase):
+    """Pool de `pandoc server`: conversão por HTTP, instâncias recriadas e volta ao spawn sem modo servidor."""
+
+    def setUp(self):
+        import os
+        import stat
+        import sys
+        import tempfile
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.binary = os.path.join(tmp.name, 'pandoc')
+        with open(self.binary, 'w') as f:
+            f.write(_FAKE_PANDOC.replace('{python}', sys.executable))
+        os.chmod(self.binary, os.stat(self.binary).st_mode | stat.S_IEXEC)
+        self.media = os.path.join(tmp.name, 'media')
+        os.makedirs(os.path.join(self.media, 'uploads'))
+        with open(os.path.join(self.media, 'uploads', 'fig.png'), 'wb') as f:
+            f.write(b'png')
+
+    def test_convert_reuses_and_restarts_instances(self):
+        from app.pandoc_pool import PandocPool
+        pool = PandocPool(1, binary=self.binary, health_interval=0)
+        self.addCleanup(pool.shutdown)
+        self.assertEqual(pool.convert('<p>a</p>', 'html', 'docx'), b'docx|8|')
+        first = pool._servers[0].process.pid
+        pool.convert('<p>b</p>', 'html', 'docx')
+        self.assertEqual(pool._servers[0].process.pid, first)
+        # Instância morta: a próxima conversão sobe outra
+        pool._servers[0].process.kill()
+        pool._servers[0].process.wait()
+        self.assertEqual(pool.convert('<p>c</p>', 'html', 'docx'), b'docx|8|')
+        self.assertEqual(pool.stats()['restarts'], 1)
+
+    def test_local_images_sent_with_request(self):
+        import os
+        from unittest import mock
+        from app import pandoc_pool
+        from app.exam import _convert_with_pandoc
+        image = os.path.join(self.media, 'uploads', 'fig.png')
+        with override_settings(PANDOC_BINARY=self.binary, PANDOC_POOL_SIZE=1, MEDIA_ROOT=self.media), \
+                mock.patch.multiple(pandoc_pool, _pool=None, _pool_pid=None, _failures=0, _retry_at=0.0):
+            html = f'<p><img src="{image}"/><img src="/etc/passwd"/></p>'
+            output = _convert_with_pandoc(html, 'docx')
+            pandoc_pool._pool.shutdown()
+        self.assertEqual(output, f'docx|{len(html)}|{image}'.encode())
+
+    def test_falls_back_without_server_mode(self):
+        import time
+        from unittest import mock
+        from app import pandoc_pool
+        with override_settings(PANDOC_BINARY='/nao/existe/pandoc', PANDOC_POOL_SIZE=2), \
+                mock.patch.multiple(pandoc_pool, _pool=None, _pool_pid=None, _failures=0, _retry_at=0.0), \
+                self.assertLogs('app.pandoc_pool', 'WARNING'):
+            self.assertIsNone(pandoc_pool.get_pandoc_pool())
+            self.assertGreater(pandoc_pool._retry_at, time.monotonic())
+
+    @override_settings(PANDOC_POOL_SIZE=1, PANDOC_POOL_RETRY_INTERVAL=60, PANDOC_POOL_RETRY_MAX=200)
+    def test_retries_after_backoff(self):
+        from unittest import mock
+        from app import pandoc_pool
+        with mock.patch.multiple(pandoc_pool, _pool=None, _pool_pid=None, _failures=0, _retry_at=0.0), \
+                self.assertLogs('app.pandoc_pool', 'WARNING') as logs:
+            with override_settings(PANDOC_BINARY='/nao/existe/pandoc'):
+                self.assertIsNone(pandoc_pool.get_pandoc_pool())
+                # Dentro da espera: nem tenta subir o pool de novo
+                self.assertIsNone(pandoc_pool.get_pandoc_pool())
+                self.assertEqual(len(logs.output), 1)
+                pandoc_pool._retry_at = 0.0
+                self.assertIsNone(pandoc_pool.get_pandoc_pool())
+                # A espera dobra a cada falha seguida, até PANDOC_POOL_RETRY_MAX
+                self.assertIn('nova tentativa em 120s', logs.output[-1])
+                pandoc_pool._retry_at = 0.0
+                self.assertIsNone(pandoc_pool.get_pandoc_pool())
+                self.assertIn('nova tentativa em 200s', logs.output[-1])
+            # pandoc passou a funcionar: a próxima tentativa sobe o pool
+            pandoc_pool._retry_at = 0.0
+            with override_settings(PANDOC_BINARY=self.binary):
+                pool = pandoc_pool.get_pandoc_pool()
+                self.assertIsNotNone(pool)
+                pool.shutdown()
+            self.assertEqual(pandoc_pool._failures, 0)
+
+
+class ExportFragmentCacheTests(TestCase):
+    """Campos já convertidos para o pandoc são reaproveitados entre exportações enquanto o HTML não muda."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.questoes = _criar_questoes(
+            _criar_taxonomia(), 3,
+            enunciado='<p>Calcule <span class="math-tex">\\(x^2\\)</span></p>',
+            resposta='<p>Resposta</p>', resposta_gabarito='<p>A</p>',
+        )
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def _build(self, questoes, option='apos_cada_questao'):
+        from unittest import mock
+        from app import exam
+        with mock.patch.object(exam, 'convert_ckeditor_math_to_latex',
+                               wraps=exam.convert_ckeditor_math_to_latex) as convert:
+            html = exam.build_exam_html(questoes, use_resposta_gabarito=True, gabarito_option=option)
+        return html, convert.call_count
+
+    def test_fragments_converted_once_per_content(self):
+        html, calls = self._build(self.questoes)
+        # Três questões idênticas: cada campo distinto é convertido uma única vez
+        self.assertEqual(calls, 2)
+        self.assertIn('\\(x^2\\)', html)
+        self.assertEqual(html.count('<h4>Gabarito</h4>'), 3)
+        again, calls = self._build(self.questoes)
+        self.assertEqual((again, calls), (html, 0))
+
+    def test_edited_question_reconverted(self):
+        self._build(self.questoes)
+        questao = self.questoes[0]
+        questao.enunciado = '<p>Novo <span class="math-tex">\\(y\\)</span></p>'
+        html, calls = self._build([questao])
+        self.assertEqual(calls, 1)
+        self.assertIn('\\(y\\)', html)
+
+    def test_only_fields_used_by_option_converted(self):
+        _, calls = self._build(self.questoes, option='somente_gabarito')
+        self.assertEqual(calls, 1)
+
+
+class ExportDocumentCacheTests(TestCase):
+    """A mesma prova (questões sem edição, mesmas opções) sai do cache em disco, sem pandoc."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.questoes = _criar_questoes(_criar_taxonomia(), 2)
+
+    def setUp(self):
+        import tempfile
+        from unittest import mock
+        from django.core.cache import cache
+        cache.clear()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings_override = override_settings(EXPORT_CACHE_DIR=tmp.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.convert = mock.patch('app.exam._convert_with_pandoc', return_value=b'DOCX').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def _download(self, **extra):
+        data = {'question_ids': [q.pk for q in self.questoes], 'gabarito_option': 'final_arquivo', **extra}
+        response = self.client.post('/api/print-test/docx/', data, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'DOCX')
+        return response
+
+    def test_repeated_export_served_from_disk(self):
+        self._download(test_name='prova A')
+        response = self._download(test_name='prova B')
+        self.assertEqual(self.convert.call_count, 1)
+        self.assertIn('prova B.docx', response['Content-Disposition'])
+        self._download(gabarito_option='somente_questoes')
+        self.assertEqual(self.convert.call_count, 2)
+
+    def test_editing_included_question_invalidates(self):
+        self._download()
+        questao = self.questoes[1]
+        questao.enunciado = '<p>Outro enunciado</p>'
+        questao.save()
+        self._download()
+        self.assertEqual(self.convert.call_count, 2)
+
+    def test_unused_documents_cleaned(self):
+        import time
+        from app.exports import cleanup_export_cache
+        self._download()
+        self.assertEqual(cleanup_export_cache(), 0)
+        self.assertEqual(cleanup_export_cache(now=time.time() + 30 * 24 * 3600), 1)
+        self._download()
+        self.assertEqual(self.convert.call_count, 2)
+
+    def test_write_prunes_cache_without_worker(self):
+        import os
+        import time
+        from django.conf import settings
+        self._download()
+        old = time.time() - 30 * 24 * 3600
+        for dirpath, _, names in os.walk(settings.EXPORT_CACHE_DIR):
+            for name in names:
+                os.utime(os.path.join(dirpath, name), (old, old))
+        # Nova escrita com a última limpeza vencida: o documento antigo sai do cache
+        self._download(gabarito_option='somente_questoes')
+        self._download()
+        self.assertEqual(self.convert.call_count, 3)
+
+
+class DocxEngineTests(TestCase):
+    """Motor python-docx: documento montado no processo, com volta ao pandoc para conteúdo não suportado."""
+
+    # PNG 1x1
+    PNG = (
+        'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=='
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.questoes = _criar_questoes(
+            _criar_taxonomia(), 2,
+            enunciado=(
+                '<p>Calcule <span class="math-tex">\\(\\frac{1}{2} + x^2\\)</span> (custa R$ 10 e R$ 20):</p>'
+                '<p><span class="math-tex">\\[\\int_0^1 \\sqrt{x}\\,dx\\]</span></p>'
+                f'<ol type="a"><li>um</li><li><strong>dois</strong></li></ol><p><img src="{cls.PNG}" style="width:40px"></p>'
+            ),
+            resposta='<p>Resposta</p>', resposta_gabarito='<p>A</p>',
+        )
+
+    def setUp(self):
+        import tempfile
+        from unittest import mock
+        from django.core.cache import cache
+        cache.clear()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings_override = override_settings(EXPORT_CACHE_DIR=tmp.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.convert = mock.patch('app.exam._convert_with_pandoc', return_value=b'DOCX').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def _download(self, **extra):
+        data = {'question_ids': [q.pk for q in self.questoes], 'gabarito_option': 'final_arquivo', **extra}
+        response = self.client.post('/api/print-test/docx/', data, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_native_document(self):
+        import docx
+        content = self._download(engine='python-docx')
+        self.assertEqual(self.convert.call_count, 0)
+        document = docx.Document(io.BytesIO(content))
+        texts = [p.text for p in document.paragraphs]
+        self.assertIn('Questão 2', texts)
+        self.assertIn('GABARITO', texts)
+        self.assertTrue(any(t.startswith('Professor(a):') and 'Turma:' in t and 'Data:' in t for t in texts))
+        self.assertIn('a. um', texts)
+        xml = document.element.xml
+        self.assertEqual(xml.count('<m:oMathPara>'), 2)
+        self.assertIn('<m:f>', xml)
+        self.assertIn('<m:rad>', xml)
+        self.assertIn('R$ 10 e R$ 20', xml)
+        self.assertEqual(len(document.inline_shapes), 2)
+
+    def test_html_whitespace_and_tbody(self):
+        import docx
+        from app.docx_export import UnsupportedContent, _add_html, _paragraph_style_ids
+
+        def paragraphs(html):
+            document = docx.Document()
+            _add_html(document, _paragraph_style_ids(document), html)
+            return document, [p.text for p in document.paragraphs]
+
+        _, texts = paragraphs('<p>  um <b> dois</b> três <i>quatro </i> cinco</p><p>seis<br>  sete</p>')
+        self.assertEqual(texts, ['um dois três quatro cinco', 'seis\nsete'])
+        # Espaço depois de uma fórmula em linha é mantido (a fórmula não é texto do parágrafo)
+        _, texts = paragraphs('<p>a <span class="math-tex">\\(x\\)</span> b</p>')
+        self.assertEqual(texts, ['a  b'])
+        _, texts = paragraphs('<ol><li> um</li></ol>')
+        self.assertEqual(texts, ['1. um'])
+        document, _ = paragraphs('<table><tbody><tr><td> a</td><td>b </td></tr></tbody></table>')
+        self.assertEqual([c.text for c in document.tables[0].rows[0].cells], ['a', 'b '])
+        with self.assertRaises(UnsupportedContent):
+            paragraphs('<p>x</p><tbody><tr><td>a</td></tr></tbody>')
+
+    def test_latex_to_omml(self):
+        from app.omml import UnsupportedLatex, latex_to_omml
+        from lxml import etree
+        xml = etree.tostring(latex_to_omml('\\sum_{i=1}^{n} i^2 \\leq \\left(\\frac{n}{2}\\right)^3'), encoding='unicode')
+        for tag in ('nary', 'sSup', 'd', 'f'):
+            self.assertIn(f':{tag}>', xml)
+        self.assertIn('≤', xml)
+        with self.assertRaises(UnsupportedLatex):
+            latex_to_omml('\\begin{pmatrix} a \\end{pmatrix}')
+
+    def test_unsupported_content_falls_back_to_pandoc(self):
+        questao = self.questoes[0]
+        questao.enunciado = '<p><span class="math-tex">\\(\\begin{matrix} a \\end{matrix}\\)</span></p>'
+        questao.save()
+        with self.assertLogs('app.exports', level='INFO'):
+            self.assertEqual(self._download(engine='python-docx'), b'DOCX')
+        self.assertEqual(self.convert.call_count, 1)
+
+    def test_engine_selects_cached_document(self):
+        self._download()
+        self._download(engine='python-docx')
+        self._download(engine='desconhecido')
+        self.assertEqual(self.convert.call_count, 1)
+        with override_settings(EXPORT_ENGINE='python-docx'):
+            self.assertNotEqual(self._download(), b'DOCX')
@@ -16,7 +16,12 @@ urlpatterns = [
     path('upload-image/', views.upload_image, name='upload_image'),
     path('buscar-conteudos/', views.buscar_conteudos_filho, name='buscar_conteudos'),
     path('conteudos/', views.list_conteudos, name='list_conteudos'),
+    path('conteudos/tree/', views.conteudos_tree, name='conteudos_tree'),
     path('unique-values/', views.get_unique_values, name='get_unique_values'),
+    path('math/cache-stats/', views.math_cache_stats, name='math_cache_stats'),
     path('print-test/docx/', views.print_test_docx, name='print_test_docx'),
+    path('export-jobs/', views.export_jobs, name='api_export_jobs'),
+    path('export-jobs/<uuid:pk>/', views.export_job_detail, name='api_export_job_detail'),
+    path('export-jobs/<uuid:pk>/download/', views.export_job_download, name='api_export_job_download'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
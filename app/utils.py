@@ -1,86 +1,384 @@
 import io
+import os
 import re
+import hashlib
+import tempfile
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
 from PIL import Image as PILImage
-from matplotlib import mathtext
+from matplotlib import mathtext, rc_context
+from matplotlib.figure import Figure
+from matplotlib.font_manager import FontProperties
 import base64
-from bs4 import BeautifulSoup
-
-def _strip_math_delimiters(expr: str) -> str:
-    t = expr.strip()
-    if (t.startswith('$$') and t.endswith('$$')):
-        return t[2:-2]
-    if (t.startswith('$') and t.endswith('$')):
-        return t[1:-1]
-    if (t.startswith('\\(') and t.endswith('\\)')):
-        return t[2:-2]
-    if (t.startswith('\\[') and t.endswith('\\]')):
-        return t[2:-2]
-    return t
-
-def render_latex_to_png_bytes(latex_src: str, dpi: int = 200) -> bytes:
-    parser = mathtext.MathTextParser("Bitmap")
-    inner = _strip_math_delimiters(latex_src)
-    text = f"${inner}$"
-    rgba, depth = parser.to_rgba(text, dpi=dpi, fontsize=14)
-    pil_img = PILImage.fromarray((rgba * 255).astype('uint8'))
+from django.conf import settings
+from .math_rewriter import rewrite_math, strip_math_delimiters
+
+# Incrementar sempre que a saída do renderizador mudar (invalida os caches).
+MATH_RENDER_VERSION = 2
+
+MATH_FORMATS = ('png', 'svg')
+_MATH_MIME_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+def normalize_latex(latex_src: str) -> str:
+    """Remove delimitadores e colapsa espaços para que fórmulas equivalentes compartilhem a mesma chave."""
+    inner = strip_math_delimiters(latex_src)
+    return re.sub(r"\s+", " ", inner).strip()
+
+
+def math_cache_key(latex_src: str, dpi: int = 200, fontsize: int = 14, fmt: str = 'png') -> str:
+    """Hash de conteúdo (LaTeX normalizado, formato, dpi, fontsize) usado pelos dois níveis do cache."""
+    payload = f"{MATH_RENDER_VERSION}|{fmt}|{dpi}|{fontsize}|{normalize_latex(latex_src)}"
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class MathRenderCache:
+    """
+    Cache em dois níveis para imagens de fórmulas:
+    - LRU em memória, limitado por um orçamento de bytes (por processo);
+    - armazenamento em disco sob MEDIA_ROOT, compartilhado por todos os workers do gunicorn.
+
+    As chaves são hashes de conteúdo, então uma entrada nunca fica desatualizada:
+    o disco só cresce e a escrita é atômica (arquivo temporário + os.replace).
+    """
+
+    def __init__(self, max_bytes: int = None, directory: str = None):
+        self._max_bytes = max_bytes
+        self._directory = directory
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_bytes(self) -> int:
+        if self._max_bytes is None:
+            return getattr(settings, 'MATH_RENDER_CACHE_MAX_BYTES', 32 * 1024 * 1024)
+        return self._max_bytes
+
+    @property
+    def directory(self):
+        if self._directory is None:
+            return getattr(settings, 'MATH_RENDER_CACHE_DIR', None)
+        return self._directory
+
+    def path_for(self, key: str, ext: str = 'png'):
+        directory = self.directory
+        if not directory:
+            return None
+        return os.path.join(directory, key[:2], f"{key}.{ext}")
+
+    def get(self, key: str, ext: str = 'png'):
+        with self._lock:
+            data = self._entries.get((key, ext))
+            if data is not None:
+                self._entries.move_to_end((key, ext))
+                self.memory_hits += 1
+                return data
+        path = self.path_for(key, ext)
+        if path:
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                data = None
+            if data is not None:
+                self._remember(key, ext, data)
+                with self._lock:
+                    self.disk_hits += 1
+                return data
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, data: bytes, ext: str = 'png'):
+        self._remember(key, ext, data)
+        self._write_to_disk(key, ext, data)
+
+    def _remember(self, key: str, ext: str, data: bytes):
+        max_bytes = self.max_bytes
+        if len(data) > max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop((key, ext), None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[(key, ext)] = data
+            self._size += len(data)
+            while self._size > max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def _write_to_disk(self, key: str, ext: str, data: bytes):
+        path = self.path_for(key, ext)
+        if not path or os.path.exists(path):
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            # O disco é só uma otimização: falhar aqui não pode quebrar a renderização.
+            try:
+                os.unlink(tmp_path)
+            except (OSError, UnboundLocalError):
+                pass
+
+    def ensure_file(self, key: str, data: bytes, ext: str = 'png') -> bool:
+        """Garante que a entrada exista no disco (necessário para servir por URL)."""
+        path = self.path_for(key, ext)
+        if not path:
+            return False
+        self._write_to_disk(key, ext, data)
+        return os.path.exists(path)
+
+    def clear_memory(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            hits = self.memory_hits + self.disk_hits
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hit_ratio': (hits / lookups) if lookups else 0.0,
+            }
+
+
+math_render_cache = MathRenderCache()
+
+_parsers = threading.local()
+
+
+def _get_parser(output: str = 'agg'):
+    """Parser mathtext reaproveitado por thread (mantém fontes e o cache interno de parse aquecidos)."""
+    parser = getattr(_parsers, output, None)
+    if parser is None:
+        parser = mathtext.MathTextParser(output)
+        setattr(_parsers, output, parser)
+    return parser
+
+
+def _rasterize_latex_png(latex_src: str, dpi: int = 200, fontsize: int = 14) -> bytes:
+    text = f"${normalize_latex(latex_src)}$"
+    result = _get_parser().parse(text, dpi=dpi, prop=FontProperties(size=fontsize))
+    alpha = PILImage.fromarray(np.asarray(result.image))
+    pil_img = PILImage.merge('LA', (PILImage.new('L', alpha.size, 0), alpha))
     output = io.BytesIO()
     pil_img.save(output, format='PNG')
     return output.getvalue()
 
+
+def _render_latex_svg(latex_src: str, fontsize: int = 14) -> bytes:
+    """Saída vetorial (glifos como paths) sem passar por rasterização nem PIL."""
+    text = f"${normalize_latex(latex_src)}$"
+    prop = FontProperties(size=fontsize)
+    width, height, depth, _, _ = _get_parser('path').parse(text, dpi=72, prop=prop)
+    if not width or not height:
+        raise ValueError("Fórmula vazia")
+    fig = Figure(figsize=(width / 72, height / 72))
+    fig.text(0, depth / height, text, fontproperties=prop)
+    output = io.BytesIO()
+    with rc_context({'svg.fonttype': 'path', 'svg.hashsalt': 'math'}):
+        fig.savefig(output, format='svg', facecolor='none',
+                    metadata={'Date': None, 'Creator': None, 'Format': None, 'Type': None})
+    svg = output.getvalue().decode('utf-8')
+    # Remove prólogo XML, doctype e comentários (o comentário repete o LaTeX) e compacta espaços
+    svg = svg[svg.index('<svg'):]
+    svg = re.sub(r"<!--[\s\S]*?-->", "", svg)
+    svg = re.sub(r"\s*\n\s*", " ", svg).strip()
+    return svg.encode('utf-8')
+
+
+def render_latex(latex_src: str, fmt: str = 'png', dpi: int = 200, fontsize: int = 14) -> bytes:
+    """Renderiza uma fórmula em PNG ou SVG, passando pelo cache de dois níveis."""
+    key = math_cache_key(latex_src, dpi=dpi, fontsize=fontsize, fmt=fmt)
+    data = math_render_cache.get(key, ext=fmt)
+    if data is None:
+        data = _render_uncached(latex_src, fmt, dpi, fontsize)
+        math_render_cache.set(key, data, ext=fmt)
+    return data
+
+
+def _render_uncached(latex_src: str, fmt: str, dpi: int, fontsize: int) -> bytes:
+    if fmt == 'svg':
+        return _render_latex_svg(latex_src, fontsize=fontsize)
+    if fmt == 'png':
+        return _rasterize_latex_png(latex_src, dpi=dpi, fontsize=fontsize)
+    raise ValueError(f"Formato de fórmula não suportado: {fmt}")
+
+
+def render_latex_to_png_bytes(latex_src: str, dpi: int = 200, fontsize: int = 14) -> bytes:
+    return render_latex(latex_src, fmt='png', dpi=dpi, fontsize=fontsize)
+
+
+def _math_render_mode() -> str:
+    return getattr(settings, 'MATH_RENDER_MODE', 'url')
+
+
+def math_render_format() -> str:
+    """Formato padrão das fórmulas (MATH_RENDER_FORMAT), usado no HTML armazenado."""
+    fmt = getattr(settings, 'MATH_RENDER_FORMAT', 'png')
+    return fmt if fmt in MATH_FORMATS else 'png'
+
+
+def math_image_src(latex_src: str, mode: str = None, skip_keys=None, fmt: str = None) -> str:
+    """
+    Retorna o `src` da imagem de uma fórmula.
+    - "url": arquivo com nome = hash do conteúdo sob MATH_RENDER_CACHE_URL (cacheável para sempre);
+    - "inline": data URI base64 (fallback quando não há diretório de cache em disco).
+    Fórmulas cuja chave está em `skip_keys` (ex.: estouraram o timeout do lote) levantam LookupError
+    para que o chamador mantenha o LaTeX original.
+    """
+    mode = mode or _math_render_mode()
+    fmt = fmt or math_render_format()
+    key = math_cache_key(latex_src, fmt=fmt)
+    if skip_keys and key in skip_keys:
+        raise LookupError(key)
+    data = render_latex(latex_src, fmt=fmt)
+    if mode == 'url':
+        if math_render_cache.ensure_file(key, data, ext=fmt):
+            base_url = getattr(settings, 'MATH_RENDER_CACHE_URL', '/media/math/')
+            return f"{base_url}{key[:2]}/{key}.{fmt}"
+    b64 = base64.b64encode(data).decode('ascii')
+    return f"data:{_MATH_MIME_TYPES[fmt]};base64,{b64}"
+
+
+def rendered_html_hash(html: str) -> str:
+    """Hash do HTML-fonte + versão/modo/formato do renderizador; identifica se um HTML pré-renderizado ainda vale."""
+    payload = f"{MATH_RENDER_VERSION}|{_math_render_mode()}|{math_render_format()}|{html or ''}"
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def extract_math_sources(html: str) -> list:
+    """Lista as fórmulas (na ordem em que aparecem) que html_render_math_to_img tentaria renderizar."""
+    sources = []
+
+    def collect(fragment):
+        sources.append(fragment.latex)
+        return None
+
+    rewrite_math(html, collect)
+    return sources
+
+
+# ---------- Renderização em lote (pool de processos) ----------
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+def _init_render_worker():
+    # Aquece o parser e as fontes uma vez por processo do pool
+    _rasterize_latex_png('x')
+
+
+def _render_worker(latex_src: str, fmt: str, dpi: int, fontsize: int) -> bytes:
+    return _render_uncached(latex_src, fmt, dpi, fontsize)
+
+
+def _get_render_pool():
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(
+                max_workers=getattr(settings, 'MATH_RENDER_POOL_SIZE', 2),
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_render_worker,
+            )
+        return _render_pool
+
+
+def _reset_render_pool():
+    global _render_pool
+    with _render_pool_lock:
+        pool, _render_pool = _render_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def prerender_math(html_fragments, timeout: float = None, fmt: str = None, dpi: int = 200, fontsize: int = 14) -> frozenset:
+    """
+    Renderiza de uma vez todas as fórmulas distintas de vários fragmentos HTML.
+    Os misses do cache vão para um pool de processos limitado; o resultado é gravado no cache,
+    então a serialização seguinte só faz hits. Retorna as chaves que não ficaram prontas
+    (timeout ou erro) para serem passadas como `skip_keys` e saírem como LaTeX puro.
+    Com o pool quebrado (processo morto), as fórmulas afetadas não entram no retorno: a
+    serialização as renderiza no próprio processo, como sem pool.
+    """
+    fmt = fmt or math_render_format()
+    pending = {}
+    for html in html_fragments:
+        for src in extract_math_sources(html):
+            key = math_cache_key(src, dpi=dpi, fontsize=fontsize, fmt=fmt)
+            if key not in pending:
+                pending[key] = src
+    pending = {key: src for key, src in pending.items() if math_render_cache.get(key, ext=fmt) is None}
+    if not pending or getattr(settings, 'MATH_RENDER_POOL_SIZE', 2) <= 0:
+        return frozenset()
+
+    if timeout is None:
+        timeout = getattr(settings, 'MATH_RENDER_BATCH_TIMEOUT', 5.0)
+    try:
+        pool = _get_render_pool()
+        futures = {pool.submit(_render_worker, src, fmt, dpi, fontsize): key for key, src in pending.items()}
+    except BrokenProcessPool:
+        _reset_render_pool()
+        return frozenset()
+
+    done, not_done = wait(futures, timeout=timeout)
+    failed = set()
+    for future in done:
+        key = futures[future]
+        try:
+            math_render_cache.set(key, future.result(), ext=fmt)
+        except BrokenProcessPool:
+            _reset_render_pool()
+        except Exception:
+            failed.add(key)
+    for future in not_done:
+        future.cancel()
+        failed.add(futures[future])
+    return frozenset(failed)
+
+
 def split_text_and_math(content: str):
     pattern = re.compile(r"(\$\$[\s\S]*?\$\$|\\\[[\s\S]*?\\\]|\\\([\s\S]*?\\\)|\$[\s\S]*?\$)")
     parts = pattern.split(content)
     return parts
 
-def html_render_math_to_img(html: str) -> str:
+def html_render_math_to_img(html: str, skip_keys=None, fmt: str = None) -> str:
+    """
+    Troca cada fórmula ($...$, \\(...\\), <span class="math-tex">, <script type="math/tex">)
+    por um <img>. Fórmulas que falham (ou estão em `skip_keys`) ficam como estavam.
+    """
     if not html:
         return html or ""
-    # Convert inline/display math delimited by $...$, $$...$$, \(...\), \[...\]
-    pattern = re.compile(r"(\$\$[\s\S]*?\$\$|\\\[[\s\S]*?\\\]|\\\([\s\S]*?\\\)|\$[\s\S]*?\$)")
-    def repl(m):
-        src = m.group(0)
+
+    def render(fragment):
         try:
-            png = render_latex_to_png_bytes(src)
-            b64 = base64.b64encode(png).decode('ascii')
-            return f'<img alt="math" style="vertical-align: middle;" src="data:image/png;base64,{b64}" />'
+            img_src = math_image_src(fragment.latex, skip_keys=skip_keys, fmt=fmt)
         except Exception:
-            return src
-    processed = pattern.sub(repl, html)
-
-    # Additionally, handle CKEditor MathJax plugin markup like <span class="math-tex">..</span>
-    try:
-        soup = BeautifulSoup(processed, 'lxml')
-        changed = False
-        for span in soup.find_all(['span','script'], class_=lambda c: c and 'math-tex' in c.split()) or []:
-            latex_src = span.get_text()
-            try:
-                png = render_latex_to_png_bytes(latex_src)
-                b64 = base64.b64encode(png).decode('ascii')
-                img_tag = soup.new_tag('img', src=f'data:image/png;base64,{b64}')
-                img_tag['alt'] = 'math'
-                img_tag['style'] = 'vertical-align: middle;'
-                span.replace_with(img_tag)
-                changed = True
-            except Exception:
-                pass
-        # Also handle <script type="math/tex"> and math/tex; mode=display
-        for script in soup.find_all('script'):
-            t = (script.get('type') or '').lower()
-            if t.startswith('math/tex'):
-                latex_src = script.get_text()
-                try:
-                    png = render_latex_to_png_bytes(latex_src)
-                    b64 = base64.b64encode(png).decode('ascii')
-                    img_tag = soup.new_tag('img', src=f'data:image/png;base64,{b64}')
-                    img_tag['alt'] = 'math'
-                    img_tag['style'] = 'vertical-align: middle; display:block; margin: 6px 0;'
-                    script.replace_with(img_tag)
-                    changed = True
-                except Exception:
-                    pass
-        if changed:
-            return str(soup)
-    except Exception:
-        pass
-    return processed
+            return None
+        if fragment.kind == 'script':
+            return f'<img alt="math" style="vertical-align: middle; display:block; margin: 6px 0;" src="{img_src}" />'
+        return f'<img alt="math" style="vertical-align: middle;" src="{img_src}" />'
 
+    return rewrite_math(html, render)
@@ -7,11 +7,20 @@ from .questions import (
     questao_detail,
     cadastro_questao,
 )
-from .export import print_test_docx
-from .content import buscar_conteudos_filho, list_conteudos, get_unique_values
+from .export import print_test_docx, export_jobs, export_job_detail, export_job_download
+from .content import buscar_conteudos_filho, list_conteudos, conteudos_tree, get_unique_values
 from .upload import upload_image
-from .pages import index, questoes_list, questao_detail as questao_detail_page, criar_prova, perfil
+from .pages import (
+    index,
+    questoes_list,
+    questao_detail as questao_detail_page,
+    criar_prova,
+    exportacao_prova,
+    exportacao_prova_download,
+    perfil,
+)
 from .bancas import bancas_page
+from .math import math_cache_stats
 
 __all__ = [
     'signup',
@@ -26,14 +35,21 @@ __all__ = [
     'cadastro_questao',
     'bancas_page',
     'print_test_docx',
+    'export_jobs',
+    'export_job_detail',
+    'export_job_download',
     'buscar_conteudos_filho',
     'list_conteudos',
+    'conteudos_tree',
     'get_unique_values',
+    'math_cache_stats',
     'upload_image',
     'index',
     'questoes_list',
     'questao_detail_page',
     'criar_prova',
+    'exportacao_prova',
+    'exportacao_prova_download',
     'perfil',
     'login_page',
     'signup_page',
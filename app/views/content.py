@@ -1,8 +1,14 @@
 from django.http import JsonResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from app.models import Conteudo, Questao
-from app.serializers import ConteudoSerializer
+from app.facets import distinct_values, values_etag
+from app.filters import FACET_FIELDS
+from app.models import Geracao, Questao
+from app.taxonomy import get_taxonomy, node_counters, tree_payload
+
+TREE_LAYOUTS = ('nested', 'columnar')
 
 
 def buscar_conteudos_filho(request):
@@ -14,51 +20,96 @@ def buscar_conteudos_filho(request):
     pai_id = request.GET.get('pai_id')
     if not pai_id:
         return JsonResponse({'error': 'pai_id ausente'}, status=400)
+    try:
+        pai_id = int(pai_id)
+    except ValueError:
+        return JsonResponse({'error': 'pai_id inválido'}, status=400)
 
-    filhos = Conteudo.objects.filter(pai_id=pai_id).values('id', 'nome')
-    return JsonResponse(list(filhos), safe=False)
+    filhos = [{'id': node.id, 'nome': node.nome} for node in get_taxonomy().children_of(pai_id)]
+    return JsonResponse(filhos, safe=False)
 
 
 @api_view(["GET"])
 def list_conteudos(request):
     """List all Conteudos, optionally filtered by tipo and pai_id"""
-    conteudos = Conteudo.objects.all()
+    taxonomy = get_taxonomy()
+    conteudos = taxonomy.nodes.values()
     
     tipo = request.query_params.get('tipo', None)
     if tipo:
-        conteudos = conteudos.filter(tipo=tipo)
+        conteudos = taxonomy.of_tipo(tipo)
     
     pai_id = request.query_params.get('pai_id', None)
     if pai_id:
-        conteudos = conteudos.filter(pai_id=pai_id)
+        try:
+            pai_id = int(pai_id)
+        except ValueError:
+            return Response({"error": "Invalid pai_id"}, status=400)
+        conteudos = [node for node in conteudos if node.pai_id == pai_id]
     else:
         if tipo:
-            conteudos = conteudos.filter(pai__isnull=True)
+            conteudos = [node for node in conteudos if node.pai_id is None]
     
-    serializer = ConteudoSerializer(conteudos, many=True)
-    return Response(serializer.data)
+    # Mesmo formato do ConteudoSerializer (id, nome, tipo, pai_id)
+    return Response([node._asdict() for node in conteudos])
+
+
+def _tree_options(request):
+    layout = request.GET.get('layout', 'nested')
+    counts = request.GET.get('counts', '').lower() in ('1', 'true')
+    return layout, counts
+
+
+def _tree_etag(request):
+    """ETag da árvore: versão do snapshot servido (+ geração das questões quando há contagens)."""
+    layout, counts = _tree_options(request)
+    if layout not in TREE_LAYOUTS:
+        return None
+    etag = f'"tax{get_taxonomy().version}-{layout}'
+    if counts:
+        etag += f'-q{Geracao.current(Questao.GERACAO)}'
+    return etag + '"'
+
+
+@condition(etag_func=_tree_etag)
+@api_view(["GET"])
+def conteudos_tree(request):
+    """
+    Hierarquia completa de conteúdos em uma resposta (substitui a navegação nível a nível).
+    ?layout=nested|columnar, ?counts=1 inclui o número de questões por nó.
+    O cliente revalida com If-None-Match e recebe 304 enquanto a árvore não mudar.
+    """
+    layout, counts = _tree_options(request)
+    if layout not in TREE_LAYOUTS:
+        return Response({"error": "Invalid layout"}, status=400)
+    payload = tree_payload(get_taxonomy(), layout, node_counters() if counts else None)
+    response = Response(payload)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _unique_values_etag(request):
+    return values_etag()
 
 
+@condition(etag_func=_unique_values_etag)
 @api_view(["GET"])
 def get_unique_values(request):
-    """Get unique values for fields like banca, tipo_questao, dificuldade, ano"""
+    """
+    Get unique values for fields like banca, tipo_questao, dificuldade, ano.
+    ?field=<campo> devolve a lista de um campo; ?field=all devolve {campo: [valores]} de todos
+    em uma chamada. Os valores vêm do cache versionado das facetas (sem DISTINCT a cada chamada)
+    e a resposta leva ETag, revalidada com 304 até a próxima escrita em questões.
+    """
     field = request.query_params.get('field', None)
     
     if not field:
         return Response({"error": "Field parameter is required"}, status=400)
     
-    if field == 'banca':
-        values = Questao.objects.values_list('banca', flat=True).distinct().order_by('banca')
-    elif field == 'tipo_questao':
-        values = Questao.objects.values_list('tipo_questao', flat=True).distinct().order_by('tipo_questao')
-    elif field == 'dificuldade':
-        values = Questao.objects.values_list('dificuldade', flat=True).distinct().order_by('dificuldade')
-    elif field == 'ano':
-        values = Questao.objects.values_list('ano', flat=True).distinct().order_by('-ano')
-    elif field == 'grau_escolaridade':
-        values = Questao.objects.values_list('grau_escolaridade', flat=True).distinct().order_by('grau_escolaridade')
-    else:
+    if field != 'all' and field not in FACET_FIELDS:
         return Response({"error": "Invalid field"}, status=400)
     
-    return Response(list(values))
-
+    values = distinct_values()
+    response = Response(values if field == 'all' else values[field])
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -1,8 +1,15 @@
-from django.http import HttpResponse
-from rest_framework.decorators import api_view
+import os
+
+from django.http import FileResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from app.models import Questao
-from .helpers import generate_exam_with_pandoc
+from app.exports import artifact_path, export_options, render_export_file, run_if_unclaimed, submit_export
+from app.models import ExportacaoProva, Questao
+
+DOCX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
 
 
 @api_view(["POST"]) 
@@ -20,63 +27,88 @@ def print_test_docx(request):
             "somente_gabarito_com_expectativa"
       - include_gabarito / use_resposta_gabarito:
             mantidos por compatibilidade com versões antigas do frontend.
+      - engine (opcional): "pandoc" ou "python-docx" (padrão: EXPORT_ENGINE).
+
+    A geração roda dentro da requisição; para provas grandes prefira /api/export-jobs/.
     """
-    ids = request.data.get('question_ids', [])
-
-    # Compatibilidade: valores antigos ainda podem ser enviados
-    include_gabarito = bool(request.data.get('include_gabarito', True))
-    use_resposta_gabarito = bool(request.data.get('use_resposta_gabarito', False))
-    gabarito_option = request.data.get('gabarito_option')
-
-    # Se a opção de gabarito foi explicitamente informada pelo frontend novo,
-    # convertemos para os flags internos.
-    if gabarito_option:
-        if gabarito_option == "somente_questoes":
-            include_gabarito = False
-            use_resposta_gabarito = False
-        elif gabarito_option == "somente_gabarito":
-            include_gabarito = True
-            use_resposta_gabarito = True  # usar resposta_gabarito (letras, etc.)
-        elif gabarito_option == "somente_gabarito_com_expectativa":
-            include_gabarito = True
-            use_resposta_gabarito = False  # usar expectativa / resposta completa
-        elif gabarito_option in ("apos_cada_questao", "final_arquivo"):
-            # Provas completas com gabarito em posições diferentes.
-            include_gabarito = True
-            # Para essas opções seguimos o valor enviado ou o padrão (False).
-        else:
-            # Valor desconhecido: assumir comportamento padrão atual
-            gabarito_option = "final_arquivo"
-    else:
-        # Frontend antigo: inferir opção a partir dos flags
-        if not include_gabarito:
-            gabarito_option = "somente_questoes"
-        else:
-            gabarito_option = "final_arquivo"
-    
-    if not isinstance(ids, list) or not ids:
-        return Response({"detail": "question_ids deve ser uma lista não vazia"}, status=400)
-    questions = list(Questao.objects.filter(id__in=ids))
-    if not questions:
-        return Response({"detail": "Nenhuma questão encontrada"}, status=404)
-    
-    # Obter nome da prova (se fornecido)
-    test_name = request.data.get('test_name', '').strip()
-    if not test_name:
-        test_name = "prova" if not include_gabarito else "prova_com_gabarito"
-    
     try:
-        pandoc_bytes = generate_exam_with_pandoc(
-            questions,
-            out_format='docx',
-            include_gabarito=include_gabarito,
-            use_resposta_gabarito=use_resposta_gabarito,
-            gabarito_option=gabarito_option,
-        )
+        options = export_options(request.data)
+    except ValueError as exc:
+        return Response({"detail": str(exc)}, status=400)
+
+    try:
+        # Prova já gerada com as mesmas questões (sem edições) e opções: servida direto do cache em disco
+        path = render_export_file(options)
+    except LookupError as exc:
+        return Response({"detail": str(exc)}, status=404)
     except RuntimeError as exc:
         return Response({"detail": str(exc)}, status=500)
 
-    resp = HttpResponse(pandoc_bytes, content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
-    resp["Content-Disposition"] = f'attachment; filename="{test_name}.docx"'
-    return resp
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{options["test_name"]}.docx',
+                        content_type=DOCX_CONTENT_TYPE)
+
+
+def _job_payload(request, job: ExportacaoProva) -> dict:
+    payload = {
+        'id': str(job.pk),
+        'status': job.status,
+        'progresso': job.progresso,
+        'tentativas': job.tentativas,
+        'erro': job.erro,
+        'nome_arquivo': job.nome_arquivo,
+        'criado_em': job.criado_em,
+        'concluido_em': job.concluido_em,
+        'status_url': request.build_absolute_uri(reverse('api_export_job_detail', args=[job.pk])),
+    }
+    if job.status == ExportacaoProva.CONCLUIDA:
+        payload['download_url'] = request.build_absolute_uri(reverse('api_export_job_download', args=[job.pk]))
+    return payload
+
+
+def user_export_or_404(user, pk) -> ExportacaoProva:
+    """Tarefa de exportação do usuário (staff enxerga todas)."""
+    jobs = ExportacaoProva.objects.all() if user.is_staff else ExportacaoProva.objects.filter(usuario=user)
+    return get_object_or_404(jobs, pk=pk)
+
+
+def export_file_response(job: ExportacaoProva):
+    """Arquivo de uma tarefa concluída, ou None se ainda não existir (ou já tiver sido limpo)."""
+    path = artifact_path(job)
+    if job.status != ExportacaoProva.CONCLUIDA or not path or not os.path.exists(path):
+        return None
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=job.nome_arquivo,
+                        content_type=DOCX_CONTENT_TYPE)
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def export_jobs(request):
+    """
+    Enfileira a geração da prova (mesmos parâmetros de /api/print-test/docx/) e responde
+    202 com o id da tarefa. Acompanhe por `status_url` e baixe por `download_url`.
+    """
+    try:
+        options = export_options(request.data)
+    except ValueError as exc:
+        return Response({"detail": str(exc)}, status=400)
+    if not Questao.objects.filter(id__in=options['question_ids']).exists():
+        return Response({"detail": "Nenhuma questão encontrada"}, status=404)
+    job = submit_export(options, request.user)
+    return Response(_job_payload(request, job), status=202)
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def export_job_detail(request, pk):
+    """Status e progresso (0-100) da tarefa (gerada aqui mesmo se nenhum worker a pegar; ver run_if_unclaimed)."""
+    return Response(_job_payload(request, run_if_unclaimed(user_export_or_404(request.user, pk))))
+
 
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def export_job_download(request, pk):
+    job = user_export_or_404(request.user, pk)
+    response = export_file_response(job)
+    if response is None:
+        return Response({"detail": "Arquivo ainda não disponível", "status": job.status}, status=409)
+    return response
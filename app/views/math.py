@@ -0,0 +1,11 @@
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from app.utils import math_render_cache
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def math_cache_stats(request):
+    """Contadores do cache de fórmulas deste worker (hits em memória/disco, misses, evicções)."""
+    return Response(math_render_cache.stats())
@@ -1,29 +1,25 @@
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.core.paginator import Paginator
-from django.db.models import Q, Count
+from django.db.models import F
 from django.http import JsonResponse, HttpResponse
 from app.models import Questao, Conteudo
-from app.utils import html_render_math_to_img
+from app.exports import export_options, run_if_unclaimed, submit_export
+from app.facets import distinct_values
+from app.filters import apply_filters, default_ordering, fetch_in_order, parse_filters, result_ids
+from app.taxonomy import by_name, get_taxonomy
+from .export import export_file_response, user_export_or_404
 import json
 
 
 def index(request):
     """Página inicial com lista de áreas"""
-    # Buscar áreas e contar questões de forma mais explícita
-    # Usar Count com distinct=True para evitar contagens duplicadas
-    areas = Conteudo.objects.filter(tipo='area').annotate(
-        questao_count=Count('q_area', distinct=True)
-    ).order_by('nome')
-    
-    # Garantir que o contador seja sempre atualizado
-    # Forçar avaliação da query e recalcular contadores
-    areas_list = []
-    for area in areas:
-        # Recalcular o contador diretamente do banco para garantir atualização
-        area.questao_count = Questao.objects.filter(area=area).count()
-        areas_list.append(area)
+    # Contagem de questões por área vem do contador mantido em Conteudo (uma query, sem varrer app_questao)
+    areas_list = list(
+        Conteudo.objects.filter(tipo='area').annotate(questao_count=F('questoes_total')).order_by('nome')
+    )
     
     # Verificar se usuário está autenticado
     is_authenticated = request.user.is_authenticated
@@ -41,129 +37,40 @@ def index(request):
 @login_required
 def questoes_list(request):
     """Lista de questões com filtros e busca"""
-    questoes = Questao.objects.all().select_related('area', 'unidade', 'topico', 'subtopico', 'categoria')
-    
-    # Busca por texto
     search = request.GET.get('search', '')
-    if search:
-        questoes = questoes.filter(enunciado__icontains=search)
-    
-    # Filtros - filtrar valores vazios e converter IDs para inteiros
-    area_ids_raw = request.GET.getlist('area_id')
-    area_ids = []
-    for a in area_ids_raw:
-        a_str = str(a).strip()
-        if a_str:
-            try:
-                area_ids.append(int(a_str))
-            except ValueError:
-                pass
-    if area_ids:
-        questoes = questoes.filter(area_id__in=area_ids)
-    
-    unidade_ids_raw = request.GET.getlist('unidade_id')
-    unidade_ids = []
-    for u in unidade_ids_raw:
-        u_str = str(u).strip()
-        if u_str:
-            try:
-                unidade_ids.append(int(u_str))
-            except ValueError:
-                pass
-    if unidade_ids:
-        questoes = questoes.filter(unidade_id__in=unidade_ids)
-    
-    topico_ids_raw = request.GET.getlist('topico_id')
-    topico_ids = []
-    for t in topico_ids_raw:
-        t_str = str(t).strip()
-        if t_str:
-            try:
-                topico_ids.append(int(t_str))
-            except ValueError:
-                pass
-    if topico_ids:
-        questoes = questoes.filter(topico_id__in=topico_ids)
-    
-    subtopico_ids_raw = request.GET.getlist('subtopico_id')
-    subtopico_ids = []
-    for s in subtopico_ids_raw:
-        s_str = str(s).strip()
-        if s_str:
-            try:
-                subtopico_ids.append(int(s_str))
-            except ValueError:
-                pass
-    if subtopico_ids:
-        questoes = questoes.filter(subtopico_id__in=subtopico_ids)
-    
-    categoria_ids_raw = request.GET.getlist('categoria_id')
-    categoria_ids = []
-    for c in categoria_ids_raw:
-        c_str = str(c).strip()
-        if c_str:
-            try:
-                categoria_ids.append(int(c_str))
-            except ValueError:
-                pass
-    if categoria_ids:
-        questoes = questoes.filter(categoria_id__in=categoria_ids)
-    
-    # Filtro por ano (IntegerField) - ignorar valores vazios
-    anos_raw = request.GET.getlist('ano')
-    anos = []
-    for a in anos_raw:
-        a_str = str(a).strip()
-        if a_str:
-            try:
-                anos.append(int(a_str))
-            except ValueError:
-                pass
-    if anos:
-        questoes = questoes.filter(ano__in=anos)
-    
-    bancas_raw = request.GET.getlist('banca')
-    bancas = [b for b in bancas_raw if str(b).strip()]
-    if bancas:
-        questoes = questoes.filter(banca__in=bancas)
-    
-    tipos_questao_raw = request.GET.getlist('tipo_questao')
-    tipos_questao = [t for t in tipos_questao_raw if str(t).strip()]
-    if tipos_questao:
-        questoes = questoes.filter(tipo_questao__in=tipos_questao)
-    
-    dificuldades_raw = request.GET.getlist('dificuldade')
-    dificuldades = [d for d in dificuldades_raw if str(d).strip()]
-    if dificuldades:
-        questoes = questoes.filter(dificuldade__in=dificuldades)
-    
-    graus_escolaridade_raw = request.GET.getlist('grau_escolaridade')
-    graus_escolaridade = [g for g in graus_escolaridade_raw if str(g).strip()]
-    if graus_escolaridade:
-        questoes = questoes.filter(grau_escolaridade__in=graus_escolaridade)
-    
-    tem_imagem = request.GET.get('tem_imagem')
-    if tem_imagem == 'true':
-        questoes = questoes.filter(Q(enunciado__icontains='<img') | Q(resposta__icontains='<img'))
-    elif tem_imagem == 'false':
-        questoes = questoes.exclude(Q(enunciado__icontains='<img') | Q(resposta__icontains='<img'))
+    # Filtros normalizados (valores vazios/inválidos descartados), os mesmos da API
+    filters = parse_filters(request.GET)
+    area_ids = filters['area_id']
+    unidade_ids = filters['unidade_id']
+    topico_ids = filters['topico_id']
+    subtopico_ids = filters['subtopico_id']
     
     # Ordenação
-    order_by = request.GET.get('order_by', '-id')
-    questoes = questoes.order_by(order_by)
+    # Só chaves servidas por índice (Questao.ORDERINGS); com busca, o padrão é a relevância
+    order_by = request.GET.get('order_by', '')
+    ordering = Questao.ORDERINGS.get(order_by) or default_ordering(filters)
     
-    # Paginação
-    paginator = Paginator(questoes, 10)
+    # Paginação sobre a lista de ids em cache; só as questões da página saem do banco
+    queryset = Questao.objects.select_related(*Questao.TAXONOMY_FIELDS)
     page_number = request.GET.get('page', 1)
-    page_obj = paginator.get_page(page_number)
+    ids = result_ids(filters, ordering)
+    if ids is None:
+        # Resultado grande demais para a lista de ids: pagina o queryset (COUNT + LIMIT/OFFSET)
+        page_obj = Paginator(apply_filters(queryset, filters).order_by(*ordering), 10).get_page(page_number)
+    else:
+        page_obj = Paginator(ids, 10).get_page(page_number)
+        page_obj.object_list = fetch_in_order(queryset, page_obj.object_list)
     
     # Dados para filtros
-    areas = Conteudo.objects.filter(tipo='area').order_by('nome')
-    anos_disponiveis = Questao.objects.values_list('ano', flat=True).distinct().order_by('-ano')
-    bancas_disponiveis = Questao.objects.values_list('banca', flat=True).distinct().order_by('banca')
-    tipos_disponiveis = Questao.objects.values_list('tipo_questao', flat=True).distinct().order_by('tipo_questao')
-    dificuldades_disponiveis = Questao.objects.values_list('dificuldade', flat=True).distinct().order_by('dificuldade')
-    graus_disponiveis = Questao.objects.values_list('grau_escolaridade', flat=True).distinct().order_by('grau_escolaridade')
+    taxonomy = get_taxonomy()
+    areas = by_name(taxonomy.of_tipo('area'))
+    # Valores das facetas sem filtro: uma query agrupada, em cache até a próxima escrita em questões
+    valores = distinct_values()
+    anos_disponiveis = valores['ano']
+    bancas_disponiveis = valores['banca']
+    tipos_disponiveis = valores['tipo_questao']
+    dificuldades_disponiveis = valores['dificuldade']
+    graus_disponiveis = valores['grau_escolaridade']
     
     # Carregar hierarquia baseada na área selecionada
     unidades = []
@@ -173,16 +80,16 @@ def questoes_list(request):
     
     if area_ids:
         # Carregar unidades das áreas selecionadas
-        unidades = Conteudo.objects.filter(tipo='unidade', pai_id__in=area_ids).order_by('nome')
+        unidades = by_name(taxonomy.of_tipo('unidade', pai_ids=area_ids))
         if unidade_ids:
             # Carregar tópicos das unidades selecionadas
-            topicos = Conteudo.objects.filter(tipo='topico', pai_id__in=unidade_ids).order_by('nome')
+            topicos = by_name(taxonomy.of_tipo('topico', pai_ids=unidade_ids))
             if topico_ids:
                 # Carregar subtópicos dos tópicos selecionados
-                subtopicos = Conteudo.objects.filter(tipo='subtopico', pai_id__in=topico_ids).order_by('nome')
+                subtopicos = by_name(taxonomy.of_tipo('subtopico', pai_ids=topico_ids))
                 if subtopico_ids:
                     # Carregar categorias dos subtópicos selecionados
-                    categorias = Conteudo.objects.filter(tipo='categoria', pai_id__in=subtopico_ids).order_by('nome')
+                    categorias = by_name(taxonomy.of_tipo('categoria', pai_ids=subtopico_ids))
     
     context = {
         'page_obj': page_obj,
@@ -203,13 +110,13 @@ def questoes_list(request):
             'unidade_ids': [str(u) for u in unidade_ids],
             'topico_ids': [str(t) for t in topico_ids],
             'subtopico_ids': [str(s) for s in subtopico_ids],
-            'categoria_ids': [str(c) for c in categoria_ids],
-            'anos': [str(a) for a in anos],
-            'bancas': bancas,
-            'tipos_questao': tipos_questao,
-            'dificuldades': dificuldades,
-            'graus_escolaridade': graus_escolaridade,
-            'tem_imagem': tem_imagem,
+            'categoria_ids': [str(c) for c in filters['categoria_id']],
+            'anos': [str(a) for a in filters['ano']],
+            'bancas': list(filters['banca']),
+            'tipos_questao': list(filters['tipo_questao']),
+            'dificuldades': list(filters['dificuldade']),
+            'graus_escolaridade': list(filters['grau_escolaridade']),
+            'tem_imagem': filters['tem_imagem'],
         }
     }
     return render(request, 'app/questoes.html', context)
@@ -218,11 +125,11 @@ def questoes_list(request):
 @login_required
 def questao_detail(request, questao_id):
     """Detalhe de uma questão"""
-    questao = get_object_or_404(Questao, id=questao_id)
+    questao = get_object_or_404(Questao.objects.select_related(*Questao.TAXONOMY_FIELDS), id=questao_id)
     
-    # Renderizar HTML com MathJax
-    questao.enunciado_rendered = html_render_math_to_img(questao.enunciado or "")
-    questao.resposta_rendered = html_render_math_to_img(questao.resposta or "")
+    # HTML com fórmulas já renderizadas (armazenado; re-renderiza só se o hash estiver velho)
+    questao.get_rendered('enunciado')
+    questao.get_rendered('resposta')
     
     context = {
         'questao': questao,
@@ -255,39 +162,44 @@ def criar_prova(request):
             messages.error(request, "Algumas questões não foram encontradas.")
             return redirect('criar_prova')
         
-        # Usar a view de exportação diretamente
-        from app.views.export import print_test_docx
-        from rest_framework.test import APIRequestFactory
-        import json
-        
-        factory = APIRequestFactory()
-        api_request = factory.post(
-            '/api/print-test/docx/',
-            json.dumps({
-                'question_ids': question_ids_int,
-                'gabarito_option': gabarito_option,
-                'test_name': test_name,
-            }),
-            content_type='application/json'
-        )
-        api_request.user = request.user
-
-        try:
-            response = print_test_docx(api_request)  # api_view espera HttpRequest; ele cria o DRF Request internamente
-            # Limpar seleção após gerar
-            return response
-        except Exception as e:
-            messages.error(request, f"Erro ao gerar prova: {str(e)}")
-            return redirect('criar_prova')
+        # A geração roda no worker de exportação (app.exports); a página acompanha o progresso
+        options = export_options({
+            'question_ids': question_ids_int,
+            'gabarito_option': gabarito_option,
+            'test_name': test_name,
+            'engine': request.POST.get('engine'),
+        })
+        job = submit_export(options, request.user)
+        return redirect('exportacao_prova', pk=job.pk)
     
     # GET - mostrar página de seleção
-    areas = Conteudo.objects.filter(tipo='area')
+    areas = get_taxonomy().of_tipo('area')
     context = {
         'areas': areas,
     }
     return render(request, 'app/criar_prova.html', context)
 
 
+@login_required
+def exportacao_prova(request, pk):
+    """Acompanhamento de uma exportação enfileirada por criar_prova (recarrega até terminar)."""
+    job = run_if_unclaimed(user_export_or_404(request.user, pk))
+    return render(request, 'app/exportacao_prova.html', {
+        'job': job,
+        'fallback_after': getattr(settings, 'EXPORT_SYNC_FALLBACK_AFTER', 15),
+    })
+
+
+@login_required
+def exportacao_prova_download(request, pk):
+    job = user_export_or_404(request.user, pk)
+    response = export_file_response(job)
+    if response is None:
+        messages.error(request, "O arquivo desta prova ainda não está disponível.")
+        return redirect('exportacao_prova', pk=job.pk)
+    return response
+
+
 @login_required
 def perfil(request):
     """Página de perfil do usuário"""
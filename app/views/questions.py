@@ -1,30 +1,54 @@
+from django.conf import settings
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, user_passes_test
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework import viewsets, generics
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
-from app.models import Questao, Conteudo
+from app.models import Questao
 from app.forms import QuestaoForm
-from app.serializers import QuestaoSerializer
+from app.serializers import QuestaoSerializer, QuestaoCompactSerializer
+from app.pagination import QuestaoCursorPagination, QuestaoPageNumberPagination
+from app.caching import get_or_compute, hashed
+from app.facets import compute_facets
+from app.filters import apply_filters, default_ordering, fetch_in_order, parse_filters, result_ids
+from app.taxonomy import get_taxonomy
 
 
 class QuestaoList(generics.ListAPIView):
-    queryset = Questao.objects.all()
+    queryset = Questao.objects.select_related(*Questao.TAXONOMY_FIELDS)
     serializer_class = QuestaoSerializer
 
 
 class QuestaoDetail(generics.RetrieveAPIView):
-    queryset = Questao.objects.all()
+    queryset = Questao.objects.select_related(*Questao.TAXONOMY_FIELDS)
     serializer_class = QuestaoSerializer
 
 
 class QuestaoViewSet(viewsets.ModelViewSet):
     queryset = Questao.objects.all()
     serializer_class = QuestaoSerializer
+    pagination_class = QuestaoCursorPagination
+
+    @property
+    def paginator(self):
+        """
+        Padrão: paginação por cursor. `?page=` usa paginação por número de página
+        (compatibilidade com o frontend atual) e `?paginate=false` desliga a paginação
+        explicitamente, devolvendo o banco inteiro como antes.
+        """
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params if self.request is not None else {}
+            if params.get('paginate') == 'false':
+                self._paginator = None
+            elif 'page' in params:
+                self._paginator = QuestaoPageNumberPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
     
     def get_permissions(self):
         """
@@ -35,179 +59,93 @@ class QuestaoViewSet(viewsets.ModelViewSet):
         return [permission() for permission in permission_classes]
     
     def get_queryset(self):
-        from django.db.models import Q
-        queryset = Questao.objects.all()
-        
-        search = self.request.query_params.get('search', None)
-        if search:
-            queryset = queryset.filter(enunciado__icontains=search)
-        
-        # Suporte para múltipla seleção usando listas
-        area_ids = self.request.query_params.getlist('area_id') or self.request.query_params.getlist('area_ids')
-        unidade_ids = self.request.query_params.getlist('unidade_id') or self.request.query_params.getlist('unidade_ids')
-        topico_ids = self.request.query_params.getlist('topico_id') or self.request.query_params.getlist('topico_ids')
-        subtopico_ids = self.request.query_params.getlist('subtopico_id') or self.request.query_params.getlist('subtopico_ids')
-        categoria_ids = self.request.query_params.getlist('categoria_id') or self.request.query_params.getlist('categoria_ids')
-        
-        # Converter para inteiros
+        queryset = apply_filters(Questao.objects.all(), parse_filters(self.request.query_params))
+        queryset = self._select_requested_columns(queryset)
+        # Ordem estável para os modos sem cursor (o cursor aplica a própria ordenação)
+        if 'search_rank' in queryset.query.annotations:
+            return queryset.order_by('-search_rank', '-id')
+        return queryset.order_by('-id')
+
+    def list(self, request, *args, **kwargs):
+        """
+        No modo ?page=, pagina a lista de ids em cache (app.filters.result_ids) e busca só
+        as questões da página pela chave primária. Cursor, ?paginate=false e resultados
+        acima de RESULT_IDS_CACHE_MAX_IDS seguem o fluxo padrão (paginação do queryset).
+        """
+        if not isinstance(self.paginator, QuestaoPageNumberPagination):
+            return super().list(request, *args, **kwargs)
+        filters = parse_filters(request.query_params)
+        ids = result_ids(filters, default_ordering(filters))
+        if ids is None:
+            return super().list(request, *args, **kwargs)
+        page_ids = self.paginator.paginate_queryset(ids, request, view=self)
+        rows = fetch_in_order(self._select_requested_columns(Questao.objects.all()), page_ids)
+        serializer = self.get_serializer(rows, many=True)
+        return self.paginator.get_paginated_response(serializer.data)
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Detalhe em cache por questão e variação pedida (serializer, ?fields=, ?math_format=...).
+        A chave leva a versão da própria linha (Questao.atualizado_em, lida por pk) e a versão
+        do snapshot da árvore de conteúdos (nomes dos níveis): salvar uma questão não invalida
+        o detalhe das outras, e um acerto custa só a leitura da versão.
+        """
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
         try:
-            area_ids_int = [int(aid) for aid in area_ids] if area_ids else []
-            unidade_ids_int = [int(uid) for uid in unidade_ids] if unidade_ids else []
-            topico_ids_int = [int(tid) for tid in topico_ids] if topico_ids else []
-            subtopico_ids_int = [int(sid) for sid in subtopico_ids] if subtopico_ids else []
-            categoria_ids_int = [int(cid) for cid in categoria_ids] if categoria_ids else []
-        except ValueError:
-            area_ids_int = []
-            unidade_ids_int = []
-            topico_ids_int = []
-            subtopico_ids_int = []
-            categoria_ids_int = []
-        
-        # Lógica: Se há áreas E unidades/tópicos selecionados, fazer OR entre combinações
-        # Exemplo: (área=Matemática) OU (área=Química E unidade=Química Orgânica)
-        if area_ids_int and (unidade_ids_int or topico_ids_int or subtopico_ids_int or categoria_ids_int):
-            from app.models import Conteudo
-            
-            # Para cada área, criar uma condição que inclui a área E seus filhos selecionados
-            area_conditions = []
-            
-            for area_id in area_ids_int:
-                area_q = Q(area_id=area_id)
-                has_children_filter = False
-                
-                # Verificar se há unidades desta área selecionadas
-                if unidade_ids_int:
-                    unidades_da_area = list(Conteudo.objects.filter(
-                        tipo='unidade', 
-                        pai_id=area_id, 
-                        id__in=unidade_ids_int
-                    ).values_list('id', flat=True))
-                    if unidades_da_area:
-                        area_q &= Q(unidade_id__in=unidades_da_area)
-                        has_children_filter = True
-                
-                # Verificar se há tópicos de unidades desta área selecionados
-                if topico_ids_int and not has_children_filter:
-                    unidades_da_area = Conteudo.objects.filter(
-                        tipo='unidade', 
-                        pai_id=area_id
-                    ).values_list('id', flat=True)
-                    topicos_da_area = list(Conteudo.objects.filter(
-                        tipo='topico',
-                        pai_id__in=unidades_da_area,
-                        id__in=topico_ids_int
-                    ).values_list('id', flat=True))
-                    if topicos_da_area:
-                        area_q &= Q(topico_id__in=topicos_da_area)
-                        has_children_filter = True
-                
-                # Verificar se há subtópicos de tópicos desta área selecionados
-                if subtopico_ids_int and not has_children_filter:
-                    unidades_da_area = Conteudo.objects.filter(
-                        tipo='unidade', 
-                        pai_id=area_id
-                    ).values_list('id', flat=True)
-                    topicos_da_area = Conteudo.objects.filter(
-                        tipo='topico',
-                        pai_id__in=unidades_da_area
-                    ).values_list('id', flat=True)
-                    subtopicos_da_area = list(Conteudo.objects.filter(
-                        tipo='subtopico',
-                        pai_id__in=topicos_da_area,
-                        id__in=subtopico_ids_int
-                    ).values_list('id', flat=True))
-                    if subtopicos_da_area:
-                        area_q &= Q(subtopico_id__in=subtopicos_da_area)
-                        has_children_filter = True
-                
-                # Verificar se há categorias de subtópicos desta área selecionadas
-                if categoria_ids_int and not has_children_filter:
-                    unidades_da_area = Conteudo.objects.filter(
-                        tipo='unidade', 
-                        pai_id=area_id
-                    ).values_list('id', flat=True)
-                    topicos_da_area = Conteudo.objects.filter(
-                        tipo='topico',
-                        pai_id__in=unidades_da_area
-                    ).values_list('id', flat=True)
-                    subtopicos_da_area = Conteudo.objects.filter(
-                        tipo='subtopico',
-                        pai_id__in=topicos_da_area
-                    ).values_list('id', flat=True)
-                    categorias_da_area = list(Conteudo.objects.filter(
-                        tipo='categoria',
-                        pai_id__in=subtopicos_da_area,
-                        id__in=categoria_ids_int
-                    ).values_list('id', flat=True))
-                    if categorias_da_area:
-                        area_q &= Q(categoria_id__in=categorias_da_area)
-                        has_children_filter = True
-                
-                # Se não há filhos desta área selecionados, incluir todas as questões desta área
-                area_conditions.append(area_q)
-            
-            # Combinar todas as condições com OR
-            if area_conditions:
-                combined_q = area_conditions[0]
-                for condition in area_conditions[1:]:
-                    combined_q |= condition
-                queryset = queryset.filter(combined_q)
-        else:
-            # Comportamento padrão: AND entre diferentes tipos de filtros
-            if area_ids_int:
-                queryset = queryset.filter(area_id__in=area_ids_int)
-            if unidade_ids_int:
-                queryset = queryset.filter(unidade_id__in=unidade_ids_int)
-            if topico_ids_int:
-                queryset = queryset.filter(topico_id__in=topico_ids_int)
-            if subtopico_ids_int:
-                queryset = queryset.filter(subtopico_id__in=subtopico_ids_int)
-            if categoria_ids_int:
-                queryset = queryset.filter(categoria_id__in=categoria_ids_int)
-        
-        anos = self.request.query_params.getlist('ano')
-        if anos:
-            try:
-                anos_int = [int(a) for a in anos]
-                queryset = queryset.filter(ano__in=anos_int)
-            except ValueError:
-                pass
-        
-        bancas = self.request.query_params.getlist('banca')
-        if bancas:
-            queryset = queryset.filter(banca__in=bancas)
-        
-        tipos_questao = self.request.query_params.getlist('tipo_questao')
-        if tipos_questao:
-            queryset = queryset.filter(tipo_questao__in=tipos_questao)
-        
-        dificuldades = self.request.query_params.getlist('dificuldade')
-        if dificuldades:
-            queryset = queryset.filter(dificuldade__in=dificuldades)
-        
-        graus_escolaridade = self.request.query_params.getlist('grau_escolaridade')
-        if graus_escolaridade:
-            queryset = queryset.filter(grau_escolaridade__in=graus_escolaridade)
-        
-        tem_imagem = self.request.query_params.get('tem_imagem', None)
-        if tem_imagem is not None:
-            if tem_imagem.lower() == 'true':
-                # Questões que têm imagem no enunciado ou resposta
-                queryset = queryset.filter(
-                    Q(enunciado__icontains='<img') | Q(resposta__icontains='<img')
-                )
-            elif tem_imagem.lower() == 'false':
-                # Questões que não têm imagem
-                queryset = queryset.exclude(
-                    Q(enunciado__icontains='<img') | Q(resposta__icontains='<img')
-                )
-        
-        return queryset
+            versao = Questao.objects.filter(pk=pk).values_list('atualizado_em', flat=True).first()
+        except (TypeError, ValueError):
+            versao = None
+        if versao is None:
+            # Inexistente ou pk inválido: get_object() responde 404
+            return Response(self.get_serializer(self.get_object()).data)
+        variant = '&'.join(f'{name}={value}' for name, value in sorted(request.query_params.lists()))
+        data = get_or_compute(
+            f'questao:{hashed(str(pk))}:{versao.isoformat()}:{get_taxonomy().version}:'
+            f'{self.get_serializer_class().__name__}:{hashed(variant)}',
+            lambda: dict(self.get_serializer(self.get_object()).data),
+            getattr(settings, 'QUESTAO_CACHE_TIMEOUT', 300),
+        )
+        return Response(data)
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """
+        Contagem de questões por valor de ano, banca, tipo, dificuldade e grau de escolaridade
+        para os filtros atuais (mesmos parâmetros da listagem).
+        """
+        return Response(compute_facets(parse_filters(request.query_params)))
+
+    def get_serializer_class(self):
+        # ?view=compact: representação leve, sem textos ricos (só leitura)
+        if self.request is not None and self.request.method == 'GET':
+            if self.request.query_params.get('view') == 'compact':
+                return QuestaoCompactSerializer
+        return super().get_serializer_class()
+
+    def _select_requested_columns(self, queryset):
+        """
+        Busca só o que a resposta vai usar: JOIN apenas nos níveis de Conteudo pedidos
+        e colunas de texto rico fora do ?fields=/?omit= ficam adiadas (não saem do banco).
+        """
+        serializer_class = self.get_serializer_class()
+        if self.request.method != 'GET' or not hasattr(serializer_class, 'requested_field_names'):
+            return queryset.select_related(*Questao.TAXONOMY_FIELDS)
+        requested = serializer_class.requested_field_names(self.request)
+        # Um único JOIN traz os níveis de Conteudo serializados em cada questão
+        related = [f for f in Questao.TAXONOMY_FIELDS if f in requested]
+        if related:
+            queryset = queryset.select_related(*related)
+        needed = set()
+        for field in requested:
+            needed.update(Questao.RICH_TEXT_COLUMNS.get(field, ()))
+        deferred = {col for cols in Questao.RICH_TEXT_COLUMNS.values() for col in cols} - needed
+        deferred.update(Questao.SEARCH_COLUMNS)
+        return queryset.defer(*deferred) if deferred else queryset
 
 
 @api_view(["GET"])
 def list_questoes(request):
-    questions = Questao.objects.all()
+    questions = Questao.objects.select_related(*Questao.TAXONOMY_FIELDS)
     serializer = QuestaoSerializer(questions, many=True)
     return Response(serializer.data)
 
@@ -215,7 +153,7 @@ def list_questoes(request):
 @api_view(["GET"])
 def questao_detail(request, pk):
     try:
-        question = Questao.objects.get(pk=pk)
+        question = Questao.objects.select_related(*Questao.TAXONOMY_FIELDS).get(pk=pk)
     except Questao.DoesNotExist:
         return Response({"detail": "Questão não encontrada"}, status=404)
     serializer = QuestaoSerializer(question)
@@ -300,14 +238,11 @@ def cadastro_questao(request):
             messages.success(request, f"Questão #{questao.id} cadastrada com sucesso!")
             # Limpar o formulário para cadastrar nova questão
             form = QuestaoForm()
-            # Forçar atualização do cache do Django
-            from django.core.cache import cache
-            cache.clear()
         else:
             messages.error(request, "Erro ao cadastrar questão. Verifique os campos.")
     else:
         form = QuestaoForm()
 
-    areas = Conteudo.objects.filter(tipo='area')
+    areas = get_taxonomy().of_tipo('area')
     return render(request, 'app/cadastro_questao.html', {'form': form, 'areas': areas})
 
@@ -48,6 +48,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'app',
     "rest_framework",
     "rest_framework_simplejwt",
@@ -192,6 +193,20 @@ CORS_ALLOW_HEADERS = [
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Cache de renderização de fórmulas LaTeX (app.utils.math_render_cache)
+# LRU em memória por worker, limitado em bytes, + armazenamento em disco compartilhado sob MEDIA_ROOT
+MATH_RENDER_CACHE_MAX_BYTES = int(os.environ.get('MATH_RENDER_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+MATH_RENDER_CACHE_DIR = os.path.join(MEDIA_ROOT, 'math')
+MATH_RENDER_CACHE_URL = MEDIA_URL + 'math/'
+# "url": fórmulas referenciadas por URL (arquivo com hash, servido pelo nginx); "inline": data URI base64
+MATH_RENDER_MODE = os.environ.get('MATH_RENDER_MODE', 'url')
+# Formato padrão das fórmulas: "png" (raster 200 dpi) ou "svg" (vetorial); a API aceita ?math_format=
+MATH_RENDER_FORMAT = os.environ.get('MATH_RENDER_FORMAT', 'png')
+# Pool de processos para renderizar em lote as fórmulas de uma página (0 desativa)
+MATH_RENDER_POOL_SIZE = int(os.environ.get('MATH_RENDER_POOL_SIZE', 2))
+# Tempo máximo (s) esperando o lote; o que não ficar pronto sai como LaTeX puro
+MATH_RENDER_BATCH_TIMEOUT = float(os.environ.get('MATH_RENDER_BATCH_TIMEOUT', 5.0))
 CKEDITOR_UPLOAD_PATH = "uploads/"
 CKEDITOR_IMAGE_BACKEND = "pillow"
 CKEDITOR_ALLOW_NONIMAGE_FILES = True
@@ -229,6 +244,67 @@ CKEDITOR_CONFIGS = {
     }
 }
 
+# Paginação de /api/questoes/ (cursor por padrão; ver app.pagination)
+QUESTOES_PAGE_SIZE = int(os.environ.get('QUESTOES_PAGE_SIZE', 20))
+QUESTOES_MAX_PAGE_SIZE = int(os.environ.get('QUESTOES_MAX_PAGE_SIZE', 100))
+
+# Facetas de /api/questoes/facets/ em cache (segundos); a geração das questões já invalida nas escritas
+FACETS_CACHE_TIMEOUT = int(os.environ.get('FACETS_CACHE_TIMEOUT', 300))
+
+# Lista ordenada de ids por filtro (app.filters.result_ids), usada na paginação por página;
+# acima do limite de ids, a paginação volta a ser feita pelo queryset (sem materializar os ids)
+RESULT_IDS_CACHE_TIMEOUT = int(os.environ.get('RESULT_IDS_CACHE_TIMEOUT', 300))
+RESULT_IDS_CACHE_MAX_IDS = int(os.environ.get('RESULT_IDS_CACHE_MAX_IDS', 20000))
+
+# Detalhe de questão em cache (app.caching; invalidado pela versão da linha e da árvore de conteúdos)
+QUESTAO_CACHE_TIMEOUT = int(os.environ.get('QUESTAO_CACHE_TIMEOUT', 300))
+# Proteção contra stampede: validade da trava de recálculo e espera máxima de quem não a obteve
+CACHE_LOCK_TIMEOUT = int(os.environ.get('CACHE_LOCK_TIMEOUT', 30))
+CACHE_LOCK_WAIT = float(os.environ.get('CACHE_LOCK_WAIT', 5.0))
+
+# Exportação assíncrona de provas (app.exports, comando export_worker). Os arquivos ficam fora
+# de MEDIA_ROOT para não serem servidos publicamente pelo nginx.
+# Requer o export_worker rodando (serviço `worker` do docker-compose.yml). Sem ele, a consulta de
+# status gera a tarefa na própria requisição depois de EXPORT_SYNC_FALLBACK_AFTER segundos sem
+# nenhum worker reivindicá-la (0 = só o worker gera; a página fica esperando).
+EXPORT_JOBS_DIR = os.environ.get('EXPORT_JOBS_DIR', os.path.join(BASE_DIR, 'exports'))
+EXPORT_JOB_TIMEOUT = int(os.environ.get('EXPORT_JOB_TIMEOUT', 120))
+EXPORT_JOB_MAX_ATTEMPTS = int(os.environ.get('EXPORT_JOB_MAX_ATTEMPTS', 3))
+EXPORT_JOB_RETRY_DELAY = int(os.environ.get('EXPORT_JOB_RETRY_DELAY', 10))
+EXPORT_JOB_RETENTION = int(os.environ.get('EXPORT_JOB_RETENTION', 24 * 3600))
+EXPORT_WORKER_POLL_INTERVAL = float(os.environ.get('EXPORT_WORKER_POLL_INTERVAL', 1.0))
+EXPORT_SYNC_FALLBACK_AFTER = int(os.environ.get('EXPORT_SYNC_FALLBACK_AFTER', 15))
+# Intervalo (s) entre varreduras de tarefas presas e limpeza de arquivos antigos (no worker); a
+# limpeza do cache de provas também roda, com o mesmo intervalo, em quem grava no cache
+EXPORT_CLEANUP_INTERVAL = int(os.environ.get('EXPORT_CLEANUP_INTERVAL', 600))
+# Cache em disco das provas geradas (app.exports.render_export_file) e tempo sem uso até a remoção
+EXPORT_CACHE_DIR = os.environ.get('EXPORT_CACHE_DIR', os.path.join(EXPORT_JOBS_DIR, 'cache'))
+EXPORT_CACHE_MAX_AGE = int(os.environ.get('EXPORT_CACHE_MAX_AGE', 7 * 24 * 3600))
+# Motor padrão quando a requisição não escolhe: "pandoc" ou "python-docx" (app.docx_export,
+# volta para o pandoc quando a prova tem conteúdo que ele não suporta)
+EXPORT_ENGINE = os.environ.get('EXPORT_ENGINE', 'pandoc')
+
+# Conversores `pandoc server` persistentes (app.pandoc_pool); 0 = um processo por exportação.
+# O tamanho é POR PROCESSO: cada worker do gunicorn (--workers 3 no entrypoint.sh) e cada
+# export_worker têm o seu pool, então o total de instâncias é PANDOC_POOL_SIZE × processos.
+# Requer pandoc >= 3; sem o modo servidor volta para um processo por exportação e tenta subir o
+# pool de novo após PANDOC_POOL_RETRY_INTERVAL segundos (dobrando a cada falha, até o máximo).
+# O ganho sobre um processo por exportação não foi medido aqui (ver `manage.py bench_pandoc`).
+PANDOC_BINARY = os.environ.get('PANDOC_BINARY', 'pandoc')
+PANDOC_POOL_SIZE = int(os.environ.get('PANDOC_POOL_SIZE', 2))
+PANDOC_POOL_RETRY_INTERVAL = float(os.environ.get('PANDOC_POOL_RETRY_INTERVAL', 60))
+PANDOC_POOL_RETRY_MAX = float(os.environ.get('PANDOC_POOL_RETRY_MAX', 3600))
+PANDOC_POOL_ACQUIRE_TIMEOUT = float(os.environ.get('PANDOC_POOL_ACQUIRE_TIMEOUT', 30))
+PANDOC_HEALTH_INTERVAL = float(os.environ.get('PANDOC_HEALTH_INTERVAL', 30))
+
+# Fragmentos de exportação (campo da questão já convertido para o pandoc) no cache do Django,
+# chaveados pelo hash do HTML: nunca ficam desatualizados, o prazo só limita o espaço ocupado
+EXPORT_FRAGMENT_CACHE_TIMEOUT = int(os.environ.get('EXPORT_FRAGMENT_CACHE_TIMEOUT', 7 * 24 * 3600))
+
+# Snapshot em memória da árvore de conteúdos (app.taxonomy): intervalo, em segundos, entre
+# checagens da versão no banco (0 = checar a cada acesso)
+TAXONOMY_VERSION_CHECK_INTERVAL = float(os.environ.get('TAXONOMY_VERSION_CHECK_INTERVAL', 1.0))
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework_simplejwt.authentication.JWTAuthentication',
@@ -34,6 +34,8 @@ urlpatterns = [
     path('questoes/', views.questoes_list, name='questoes_list'),
     path('questao/<int:questao_id>/', views.questao_detail_page, name='questao_detail_page'),
     path('criar-prova/', views.criar_prova, name='criar_prova'),
+    path('criar-prova/exportacao/<uuid:pk>/', views.exportacao_prova, name='exportacao_prova'),
+    path('criar-prova/exportacao/<uuid:pk>/download/', views.exportacao_prova_download, name='exportacao_prova_download'),
     path('perfil/', views.perfil, name='perfil'),
     
     # Autenticação